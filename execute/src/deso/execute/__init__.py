@@ -20,12 +20,37 @@
 """Initialization file for the deso.execute package."""
 
 
+from deso.execute.async_ import (
+  executeAsync,
+  pipelineAsync,
+  springAsync,
+)
+from deso.execute.coprocess import (
+  Coprocess,
+  LengthFraming,
+  LineFraming,
+  TerminatorFraming,
+)
 from deso.execute.execute_ import (
+  CommandUsage,
   execute,
   formatCommands,
   pipeline,
+  pipelineIter,
   ProcessError,
+  ProcessTimeoutError,
+  setUsageHook,
   spring,
+  springIter,
+  Tee,
+  Usage,
+)
+from deso.execute.executor import (
+  Executor,
+)
+from deso.execute.many import (
+  executeMany,
+  executeManyUnordered,
 )
 from deso.execute.util import (
   findCommand,
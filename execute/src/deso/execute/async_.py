@@ -0,0 +1,251 @@
+# async_.py
+
+#/***************************************************************************
+# *   Copyright (C) 2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Asynchronous variants of the command execution functions.
+
+  The functions provided here are coroutines to be used with asyncio.
+  They have the same semantics as their blocking counterparts with
+  respect to data supplied to stdin, the capturing of stdout and
+  stderr, and the reporting of errors by means of ProcessError.
+  However, instead of polling the pipes and waiting for processes in a
+  blocking manner, all file descriptors are registered with the running
+  event loop. Where possible, the termination of processes is detected
+  using process file descriptors (pidfds).
+  If a coroutine is cancelled, all processes it started are killed.
+"""
+
+from asyncio import (
+  get_running_loop,
+)
+from deso.cleanup import (
+  defer,
+)
+from deso.execute.execute_ import (
+  _abort,
+  _check,
+  _output,
+  _pidfd,
+  _pipeline,
+  _PipelineFileDescriptors,
+  _read,
+  _spawn,
+  _waitpid,
+  _write,
+  formatCommands,
+)
+from os import (
+  O_CLOEXEC,
+  P_PID,
+  WEXITED,
+  WNOWAIT,
+  close as close_,
+  pipe2,
+  waitid,
+)
+
+
+def _transfer(loop, fds, later):
+  """Service the pipes of a _PipelineFileDescriptors object from an event loop.
+
+    The function returns a future that completes once all data was
+    written and read, respectively.
+  """
+  def finish(data):
+    """Stop servicing a pipe dict."""
+    nonlocal pending
+
+    data["unreg"]()
+    data["close"]()
+
+    pending -= 1
+    if pending == 0 and not future.done():
+      future.set_result(None)
+
+  def handle(function, data):
+    """Invoke a function to write or read data and check whether we are done."""
+    # Note that writing data may also fail because reading a stream
+    # supplied as stdin raised an exception.
+    try:
+      done = function(data)
+    except Exception as e:
+      data["unreg"]()
+      if not future.done():
+        future.set_exception(e)
+      return
+
+    if done:
+      finish(data)
+
+  future = loop.create_future()
+  writes, reads = fds.channels()
+  pending = len(writes) + len(reads)
+
+  for data in writes:
+    loop.add_writer(data["out"], handle, _write, data)
+    data["unreg"] = later.defer(loop.remove_writer, data["out"])
+
+  for data in reads:
+    loop.add_reader(data["in"], handle, _read, data)
+    data["unreg"] = later.defer(loop.remove_reader, data["in"])
+
+  if pending == 0:
+    future.set_result(None)
+
+  return future
+
+
+async def _waitpidAsync(loop, pid):
+  """Wait for a process to terminate without blocking the event loop."""
+  def ready():
+    """Mark the future as done once the pidfd got readable."""
+    if not future.done():
+      future.set_result(None)
+
+  fd = _pidfd(pid)
+  if fd is not None:
+    with defer() as d:
+      d.defer(close_, fd)
+
+      future = loop.create_future()
+      loop.add_reader(fd, ready)
+      d.defer(loop.remove_reader, fd)
+
+      # A pidfd becomes readable once the process terminated.
+      await future
+  else:
+    # Without pidfds we wait for the process in a separate thread. We
+    # do not reap it there, though. That way we do not interfere with
+    # the killing and reaping of processes in case we get cancelled.
+    await loop.run_in_executor(None, waitid, P_PID, pid, WEXITED | WNOWAIT)
+
+  # The process terminated, so it can be reaped without blocking.
+  return _waitpid(pid)
+
+
+async def _waitAsync(loop, pids, commands, data_err, status=0, failed=None):
+  """Wait for all processes represented by a list of process IDs, see _wait."""
+  statuses = []
+  try:
+    for pid in pids:
+      statuses += [await _waitpidAsync(loop, pid)]
+  except BaseException:
+    _abort(pids[len(statuses):])
+    raise
+
+  _check(statuses, commands, data_err, status, failed)
+
+
+async def executeAsync(*args, env=None, stdin=None, stdout=None, stderr=b""):
+  """Execute a program asynchronously, see execute."""
+  return await pipelineAsync([list(args)], env, stdin, stdout, stderr)
+
+
+async def pipelineAsync(commands, env=None, stdin=None, stdout=None, stderr=b""):
+  """Execute a pipeline asynchronously, see pipeline."""
+  loop = get_running_loop()
+
+  with defer() as later:
+    with defer() as here:
+      fds = _PipelineFileDescriptors(later, here, stdin, stdout, stderr)
+      transfer = _transfer(loop, fds, later)
+      pids = _pipeline(commands, env, fds.stdin(), fds.stdout(), fds.stderr())
+
+    try:
+      await transfer
+    except BaseException:
+      _abort(pids)
+      raise
+
+    data_out, data_err = fds.data()
+
+  await _waitAsync(loop, pids, commands, data_err)
+
+  return _output(stdout, stderr, data_out, data_err)
+
+
+async def springAsync(commands, env=None, stdout=None, stderr=b""):
+  """Execute a spring asynchronously, see spring.
+
+    Contrary to the blocking version, all commands of the spring are
+    waited for while the event loop keeps servicing the output of the
+    spring.
+  """
+  assert len(commands) > 0, commands
+  assert len(commands[0]) > 0, commands
+  assert isinstance(commands[0][0], list), commands
+
+  loop = get_running_loop()
+  pids = []
+  status = 0
+  failed = None
+
+  spring_cmds = commands[0]
+  pipe_cmds = commands[1:]
+
+  with defer() as later:
+    with defer() as here:
+      # A spring never receives any input from stdin, i.e., we always
+      # want it to be redirected from /dev/null.
+      fds = _PipelineFileDescriptors(later, here, None, stdout, stderr)
+      transfer = _transfer(loop, fds, later)
+
+      fd_in = fds.stdin()
+      fd_out = fds.stdout()
+      fd_err = fds.stderr()
+
+      # Kill all processes started so far if anything goes wrong.
+      abort = here.defer(_abort, pids)
+
+      if pipe_cmds:
+        fd_in_new, fd_out_new = pipe2(O_CLOEXEC)
+        here.defer(close_, fd_out_new)
+        close_in_new = here.defer(close_, fd_in_new)
+      else:
+        fd_out_new = fd_out
+
+      for i, command in enumerate(spring_cmds):
+        pid = _spawn(command, env, fd_in, fd_out_new, fd_err)
+        abort_pid = here.defer(_abort, [pid])
+
+        if i == 0 and pipe_cmds:
+          pids += _pipeline(pipe_cmds, env, fd_in_new, fd_out, fd_err)
+          close_in_new()
+
+        status = await _waitpidAsync(loop, pid)
+        abort_pid.release()
+
+        if status != 0:
+          failed = formatCommands(command)
+          break
+
+      abort.release()
+
+    try:
+      await transfer
+    except BaseException:
+      _abort(pids)
+      raise
+
+    data_out, data_err = fds.data()
+
+  # All commands of the spring have been waited for already, so the
+  # pids we got left belong to the commands of the pipeline.
+  await _waitAsync(loop, pids, pipe_cmds, data_err, status=status, failed=failed)
+
+  return _output(stdout, stderr, data_out, data_err)
@@ -0,0 +1,80 @@
+# benchExecutor.py
+
+#/***************************************************************************
+# *   Copyright (C) 2014-2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Benchmarks for the overhead of executing many short lived commands.
+
+  The benchmark compares running a trivial command using the module
+  level execute function, which sets up all resources it needs anew
+  for every invocation, with running it through an Executor, which
+  shares them between invocations.
+"""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.execute import (
+  execute,
+  Executor,
+  findCommand,
+)
+from sys import (
+  argv,
+)
+from time import (
+  perf_counter,
+)
+
+
+TRUE = findCommand("true")
+
+
+def measure(execute_, count, **kwargs):
+  """Measure the average time it takes to run a trivial command."""
+  start = perf_counter()
+  for _ in range(count):
+    execute_(TRUE, **kwargs)
+
+  return (perf_counter() - start) / count
+
+
+def main(args):
+  """Run the executor benchmarks and print the results."""
+  parser = ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--count", type=int, default=1000,
+                      help="The number of processes to start per measurement.")
+  namespace = parser.parse_args(args)
+
+  row = "{:<10} {:<10} {:>12} {:>12}"
+  print(row.format("variant", "output", "latency us", "execs/s"))
+
+  with Executor() as executor:
+    for output, kwargs in [("null", {"stderr": None}),
+                           ("captured", {"stdout": b""})]:
+      for name, execute_ in [("execute", execute),
+                             ("executor", executor.execute)]:
+        latency = measure(execute_, namespace.count, **kwargs)
+        print(row.format(name, output,
+                         "%.1f" % (latency * 1000000),
+                         "%.0f" % (1 / latency)))
+
+  return 0
+
+
+if __name__ == "__main__":
+  exit(main(argv[1:]))
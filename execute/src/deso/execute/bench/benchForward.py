@@ -0,0 +1,116 @@
+# benchForward.py
+
+#/***************************************************************************
+# *   Copyright (C) 2016 Daniel Mueller (deso@posteo.net)                   *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Benchmarks for the throughput of forwarding the output of a parallel spring.
+
+  The output of the commands of a parallel spring passes through our
+  process. The benchmark compares splicing it from pipe to pipe (or
+  file) in the kernel with reading it into user space and writing it
+  out again, for different kinds of destinations.
+"""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.execute import (
+  findCommand,
+  spring,
+)
+from deso.execute.execute_ import (
+  splice,
+)
+from os import (
+  O_CLOEXEC,
+  O_WRONLY,
+  close,
+  devnull,
+  open as open_,
+)
+from sys import (
+  argv,
+)
+from tempfile import (
+  TemporaryFile,
+)
+from time import (
+  perf_counter,
+)
+from unittest.mock import (
+  patch,
+)
+
+
+HEAD = findCommand("head")
+CAT = findCommand("cat")
+MIB = 1024 * 1024
+
+BACKENDS = [
+  ("splice", splice),
+  ("read/write", None),
+]
+
+
+def measure(backend, commands, stdout, size):
+  """Measure the throughput (in MB/s) of a parallel spring forwarding 'size' bytes."""
+  with patch("deso.execute.execute_.splice", backend):
+    start = perf_counter()
+    spring(commands, stdout=stdout, parallel=True)
+    return size / (perf_counter() - start) / 1000000
+
+
+def main(args):
+  """Run the forwarding benchmarks and print the results."""
+  parser = ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--size", type=int, default=256,
+                      help="The amount of data (in MiB) each command produces.")
+  parser.add_argument("--commands", type=int, default=4,
+                      help="The number of commands of the spring.")
+  namespace = parser.parse_args(args)
+
+  size = namespace.size * MIB
+  producers = [[HEAD, "-c", str(size), "/dev/zero"]] * namespace.commands
+  total = size * namespace.commands
+  backends = [(name, splice_) for name, splice_ in BACKENDS
+              if splice_ is not None or name != "splice"]
+
+  row = "{:<12} {:<10} {:>10}"
+  print(row.format("backend", "sink", "MB/s"))
+
+  null = open_(devnull, O_WRONLY | O_CLOEXEC)
+  try:
+    for name, backend in backends:
+      # The output is forwarded to the null device, a file, and the pipe
+      # of a pipeline following the spring.
+      rate = measure(backend, [producers], null, total)
+      print(row.format(name, "null", "%.0f" % rate))
+
+      with TemporaryFile() as file_:
+        rate = measure(backend, [producers], file_.fileno(), total)
+      print(row.format(name, "file", "%.0f" % rate))
+
+      rate = measure(backend, [producers, [CAT]], null, total)
+      print(row.format(name, "pipe", "%.0f" % rate))
+  finally:
+    close(null)
+
+  return 0
+
+
+if __name__ == "__main__":
+  exit(main(argv[1:]))
@@ -0,0 +1,116 @@
+# benchSpawn.py
+
+#/***************************************************************************
+# *   Copyright (C) 2014-2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Benchmarks for the latency of starting processes.
+
+  The benchmark compares starting a process using fork & exec with
+  starting it using posix_spawn. Because the cost of forking depends on
+  the size of the parent's address space, each backend is measured
+  while the benchmark process keeps an increasing amount of memory
+  resident.
+"""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.execute import (
+  execute,
+  findCommand,
+)
+from deso.execute.execute_ import (
+  posix_spawn,
+  _spawnFork,
+  _spawnPosix,
+)
+from resource import (
+  getpagesize,
+)
+from sys import (
+  argv,
+)
+from time import (
+  perf_counter,
+)
+from unittest.mock import (
+  patch,
+)
+
+
+TRUE = findCommand("true")
+MIB = 1024 * 1024
+
+BACKENDS = [
+  ("fork", _spawnFork),
+  ("posix_spawn", _spawnPosix),
+]
+
+
+def allocate(size):
+  """Allocate a buffer of the given size and make sure it is resident."""
+  buffer = bytearray(size)
+  # Touch every page, otherwise the memory might never actually be
+  # mapped in.
+  buffer[::getpagesize()] = b"x" * len(range(0, size, getpagesize()))
+  return buffer
+
+
+def measure(spawn, count):
+  """Measure the average time it takes to run a trivial command."""
+  with patch("deso.execute.execute_._spawn", spawn):
+    start = perf_counter()
+    for _ in range(count):
+      execute(TRUE, stderr=None)
+
+    return (perf_counter() - start) / count
+
+
+def main(args):
+  """Run the spawn benchmarks and print the results."""
+  parser = ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--quick", action="store_true",
+                      help="Use fewer and smaller parent sizes.")
+  parser.add_argument("--count", type=int, default=200,
+                      help="The number of processes to start per measurement.")
+  namespace = parser.parse_args(args)
+
+  sizes = [0, 64, 256] if namespace.quick else [0, 64, 256, 1024, 4096]
+  backends = [
+    (name, spawn) for name, spawn in BACKENDS
+    if spawn is not _spawnPosix or posix_spawn is not None
+  ]
+
+  row = "{:<12} {:>10} {:>12} {:>12}"
+  print(row.format("backend", "rss MiB", "latency us", "spawns/s"))
+
+  for size in sizes:
+    buffer = allocate(size * MIB)
+
+    for name, spawn in backends:
+      latency = measure(spawn, namespace.count)
+      print(row.format(name, size,
+                       "%.1f" % (latency * 1000000),
+                       "%.0f" % (1 / latency)))
+
+    del buffer
+
+  return 0
+
+
+if __name__ == "__main__":
+  exit(main(argv[1:]))
@@ -0,0 +1,102 @@
+# benchThroughput.py
+
+#/***************************************************************************
+# *   Copyright (C) 2016 Daniel Mueller (deso@posteo.net)                   *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Benchmarks for the throughput of reading the output of a pipeline.
+
+  The benchmark reads a large amount of data from a command for a
+  matrix of pipe capacities and read sizes (including the adaptive
+  one), reporting the throughput and the number of reads it took.
+"""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.execute import (
+  findCommand,
+  pipeline,
+)
+from deso.execute.execute_ import (
+  readv,
+)
+from sys import (
+  argv,
+)
+from time import (
+  perf_counter,
+)
+from unittest.mock import (
+  patch,
+)
+
+
+HEAD = findCommand("head")
+KIB = 1024
+MIB = 1024 * 1024
+
+PIPE_SIZES = [None, 256 * KIB, 1 * MIB]
+READ_SIZES = [4 * KIB, 64 * KIB, None]
+
+
+def measure(size, pipesize, readsize):
+  """Measure the throughput (in MB/s) of reading 'size' bytes and the number of reads needed."""
+  reads = 0
+
+  def count(fd, buffers):
+    """Count the reads performed."""
+    nonlocal reads
+    reads += 1
+    return readv(fd, buffers)
+
+  command = [HEAD, "-c", str(size), "/dev/zero"]
+
+  with patch("deso.execute.execute_.readv", count):
+    start = perf_counter()
+    pipeline([command], stdout=b"", stderr=None,
+             pipesize=pipesize, readsize=readsize)
+    rate = size / (perf_counter() - start) / 1000000
+
+  return rate, reads
+
+
+def main(args):
+  """Run the throughput benchmarks and print the results."""
+  parser = ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--size", type=int, default=512,
+                      help="The amount of data (in MiB) to read.")
+  namespace = parser.parse_args(args)
+
+  def kib(size):
+    """Format a size in KiB."""
+    return "default" if size is None else "%d" % (size // KIB)
+
+  row = "{:>14} {:>14} {:>10} {:>10}"
+  print(row.format("pipe KiB", "read KiB", "MB/s", "reads"))
+
+  for pipesize in PIPE_SIZES:
+    for readsize in READ_SIZES:
+      rate, reads = measure(namespace.size * MIB, pipesize, readsize)
+      print(row.format(kib(pipesize),
+                       "adaptive" if readsize is None else kib(readsize),
+                       "%.0f" % rate, reads))
+
+  return 0
+
+
+if __name__ == "__main__":
+  exit(main(argv[1:]))
@@ -0,0 +1,382 @@
+# coprocess.py
+
+#/***************************************************************************
+# *   Copyright (C) 2016 Daniel Mueller (deso@posteo.net)                   *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Functionality for keeping a command running to answer a series of requests.
+
+  Many tools provide a batch mode in which they read requests from
+  stdin and write a response for each of them to stdout (e.g., 'git
+  cat-file --batch' or 'git check-ignore --stdin'). Starting such a
+  command once and reusing it for all requests is a lot cheaper than
+  executing it for every single request. How requests and responses are
+  delimited is up to a framing object, which has to provide two methods:
+  - frame(request) returns the bytes to write for a request
+  - unframe(buffer, start) looks for a complete response at the
+    beginning of a bytearray and returns a (response, size) tuple with
+    'size' being the number of bytes the response occupies, or None if
+    the response is not complete yet; 'start' is the offset up to which
+    the buffer was examined by a previous invocation already
+"""
+
+from collections import (
+  deque,
+)
+from deso.cleanup import (
+  defer,
+)
+from deso.execute.execute_ import (
+  _abort,
+  _IN,
+  _OUT,
+  _spawn,
+  _TERMINATE_GRACE,
+  _waitpidUntil,
+  formatCommands,
+  ProcessError,
+)
+from os import (
+  O_CLOEXEC,
+  O_WRONLY,
+  close as close_,
+  devnull,
+  open as open_,
+  pipe2,
+  read,
+  write,
+)
+from select import (
+  PIPE_BUF,
+  POLLERR,
+  POLLHUP,
+  POLLNVAL,
+  poll,
+)
+from threading import (
+  Lock,
+)
+from time import (
+  monotonic,
+)
+
+
+class TerminatorFraming:
+  """A framing for requests and responses ending in a terminator.
+
+    The terminator is appended to each request. It is stripped from
+    responses.
+  """
+  def __init__(self, terminator):
+    """Create a framing using the given terminator."""
+    assert len(terminator) > 0, terminator
+    self._terminator = bytes(terminator)
+
+
+  def frame(self, request):
+    """Frame a request."""
+    return bytes(request) + self._terminator
+
+
+  def unframe(self, buffer, start):
+    """Find the first response in a buffer."""
+    # The terminator could have been partly received when we looked
+    # last time.
+    start = max(0, start - len(self._terminator) + 1)
+    end = buffer.find(self._terminator, start)
+    if end < 0:
+      return None
+
+    return bytes(buffer[:end]), end + len(self._terminator)
+
+
+class LineFraming(TerminatorFraming):
+  """A framing for requests and responses consisting of a single line each."""
+  def __init__(self):
+    """Create a line based framing."""
+    super().__init__(b"\n")
+
+
+class LengthFraming:
+  """A framing for requests and responses being prefixed with their length.
+
+    The length is encoded as an unsigned integer of 'size' bytes in the
+    given byte order.
+  """
+  def __init__(self, size=4, byteorder="big"):
+    """Create a length prefix based framing."""
+    self._size = size
+    self._byteorder = byteorder
+
+
+  def frame(self, request):
+    """Frame a request."""
+    return len(request).to_bytes(self._size, self._byteorder) + bytes(request)
+
+
+  def unframe(self, buffer, start):
+    """Find the first response in a buffer."""
+    if len(buffer) < self._size:
+      return None
+
+    length = int.from_bytes(buffer[:self._size], self._byteorder)
+    end = self._size + length
+    if len(buffer) < end:
+      return None
+
+    return bytes(buffer[self._size:end]), end
+
+
+# The amount of data to read from a coprocess at a time.
+_READ_SIZE = 64 * 1024
+
+
+class Coprocess:
+  """A command kept running to answer requests written to its stdin on its stdout.
+
+    The command is started right away. Should it terminate while
+    requests are outstanding, it is restarted and the requests not
+    answered yet are sent again. If it terminates again before answering
+    any of them, a ProcessError is raised (and the command is restarted
+    for subsequent requests). Objects of this class are meant to be
+    used as context managers; the command's stdin is closed upon exit,
+    after which it has a grace period to terminate before being killed.
+    Requests may be issued from multiple threads, in which case they
+    are serialized.
+  """
+  def __init__(self, command, framing=None, env=None, stderr=None):
+    """Start a command as a coprocess.
+
+      The framing defaults to a LineFraming. The stderr argument can be
+      a file descriptor to redirect the command's stderr to. By default
+      it is redirected to the null device.
+    """
+    self._command = command
+    self._framing = framing if framing is not None else LineFraming()
+    self._env = env
+    self._stderr = stderr
+    self._lock = Lock()
+    self._later = None
+    self._pid = None
+    self._status = None
+    self._start()
+
+
+  def __enter__(self):
+    """The block enter handler just returns a reference to this object."""
+    return self
+
+
+  def __exit__(self, type_, value, traceback):
+    """The block exit handler stops the command."""
+    self.close()
+
+
+  def _start(self):
+    """Start the command."""
+    later = defer()
+
+    with defer() as here:
+      # Should we fail to start the command, release everything set up
+      # so far.
+      destroy = here.defer(later.destroy)
+
+      # Note that functions deferred are invoked in reverse order. So we
+      # close the command's stdin before waiting for it to terminate.
+      later.defer(self._stop)
+
+      fd_in, self._in = pipe2(O_CLOEXEC)
+      here.defer(close_, fd_in)
+      later.defer(close_, self._in)
+
+      self._out, fd_out = pipe2(O_CLOEXEC)
+      here.defer(close_, fd_out)
+      later.defer(close_, self._out)
+
+      if self._stderr is None:
+        fd_err = open_(devnull, O_WRONLY | O_CLOEXEC)
+        here.defer(close_, fd_err)
+      else:
+        fd_err = self._stderr
+
+      self._pid = _spawn(self._command, self._env, fd_in, fd_out, fd_err)
+      destroy.release()
+
+    self._later = later
+
+
+  def _stop(self):
+    """Wait for the command to terminate and reap it, killing it if necessary."""
+    if self._pid is not None:
+      try:
+        self._status = _waitpidUntil(self._pid, monotonic() + _TERMINATE_GRACE)
+      except TimeoutError:
+        _abort([self._pid], _TERMINATE_GRACE)
+        self._status = None
+
+      self._pid = None
+
+
+  def _restart(self):
+    """Stop the command, if it is still running, and start it anew."""
+    self._later.destroy()
+    self._start()
+
+
+  def close(self):
+    """Stop the command."""
+    with self._lock:
+      self._later.destroy()
+
+
+  def request(self, request):
+    """Send a request and retrieve the response."""
+    for response in self.requests([request]):
+      return response
+
+
+  def requests(self, requests):
+    """Send a series of requests, yielding the responses in order.
+
+      Requests are pipelined, i.e., we write the next request while
+      still waiting for responses to earlier ones, without waiting for
+      each response in turn. Requests are taken from the iterable as
+      they can be written. If the iteration is stopped early, the
+      command is restarted, because it may still answer requests that
+      no one is going to read.
+    """
+    with self._lock:
+      yield from self._transfer(iter(requests))
+
+
+  def _transfer(self, requests):
+    """Write requests and read responses until all requests are answered."""
+    # The requests to write before taking any new ones from the
+    # iterable. Only requests that need to be sent again end up here.
+    pending = deque()
+    # The requests written entirely but not yet answered.
+    inflight = deque()
+    # The request currently being written and how much of it got written.
+    current = None
+    offset = 0
+    buffer = bytearray()
+    start = 0
+    exhausted = False
+    # Whether we got a response since the command was (re)started.
+    progress = True
+    poller = None
+
+    def crashed():
+      """Handle the termination of the command."""
+      nonlocal current, buffer, start, progress, poller
+
+      # Reap the command to get its status.
+      self._later.destroy()
+
+      if not progress:
+        status = self._status if self._status is not None else 1
+        raise ProcessError(status, formatCommands([self._command]))
+
+      self._start()
+
+      if current is not None:
+        inflight.append(current)
+
+      pending.extendleft(reversed(inflight))
+      inflight.clear()
+      current = None
+      buffer = bytearray()
+      start = 0
+      progress = False
+      poller = None
+
+    try:
+      while True:
+        if current is None:
+          if pending:
+            current = pending.popleft()
+          elif not exhausted:
+            request = next(requests, None)
+            if request is None:
+              exhausted = True
+            else:
+              current = self._framing.frame(request)
+
+          offset = 0
+
+        if current is None and not inflight:
+          return
+
+        if poller is None:
+          poller = poll()
+          poller.register(self._out, _IN)
+          writing = False
+
+        if current is not None and not writing:
+          poller.register(self._in, _OUT)
+          writing = True
+        elif current is None and writing:
+          poller.unregister(self._in)
+          writing = False
+
+        for fd, event in poller.poll():
+          if fd == self._in:
+            if event & (POLLERR | POLLHUP | POLLNVAL):
+              crashed()
+              break
+
+            # Having been notified of the pipe being writable, we are
+            # guaranteed to be able to write PIPE_BUF bytes without
+            # blocking.
+            try:
+              with memoryview(current) as view:
+                with view[offset:offset + PIPE_BUF] as chunk:
+                  offset += write(self._in, chunk)
+            except BrokenPipeError:
+              crashed()
+              break
+
+            if offset == len(current):
+              inflight.append(current)
+              current = None
+          else:
+            data = read(self._out, _READ_SIZE)
+            if not data:
+              crashed()
+              break
+
+            buffer += data
+            while inflight:
+              result = self._framing.unframe(buffer, start)
+              if result is None:
+                start = len(buffer)
+                break
+
+              response, size = result
+              # Note that removing data from the front of a bytearray
+              # does not copy the remaining data.
+              del buffer[:size]
+              start = 0
+
+              inflight.popleft()
+              progress = True
+              yield response
+    finally:
+      # If we did not read all responses (or did not write all of a
+      # request), the command's stdin and stdout are out of sync with
+      # us. Start over in that case.
+      if current is not None or inflight or self._pid is None:
+        self._restart()
@@ -31,7 +31,9 @@
   first element which is a list of commands itself. The idea is that
   this first set of commands is executed in a serial fashion and the
   output is accumulated and supplied to the remaining commands (which,
-  in turn, can be regarded as a pipeline.
+  in turn, can be regarded as a pipeline. Optionally, the first set of
+  commands can also be run concurrently, with their output still being
+  accumulated in order.
 
   A sample of a pipeline is:
   [
@@ -47,37 +49,108 @@
     ['/bin/dd', 'of=/tmp/output'],
   ]
 
+  Lastly, the output of a pipeline can be fanned out to several other
+  pipelines, the branches, each receiving a copy of it. To that end, the
+  last element of the pipeline is a Tee object containing the branches:
+  [
+    ['/bin/cat', '/tmp/input'],
+    Tee(
+      [['/bin/wc', '-l']],
+      [['/bin/grep', 'a'], ['/bin/wc', '-l']],
+    ),
+  ]
+
   Note that executed processes stay alive independently of their parents
   (i.e., the Python instance in our case). That is, if the parent is
   killed the child is unaffected. The prctl PR_SET_PDEATHSIG can be used
   to influence this behavior on a per-child basis.
 """
 
+from ctypes import (
+  CDLL,
+  c_int,
+  c_size_t,
+  c_ssize_t,
+  c_uint,
+  get_errno,
+)
 from deso.cleanup import (
   defer,
 )
+from errno import (
+  EINVAL,
+)
+from fcntl import (
+  F_SETPIPE_SZ,
+  fcntl,
+  ioctl,
+)
+from math import (
+  ceil,
+)
+from mmap import (
+  mmap,
+  PROT_READ,
+)
 from os import (
   O_RDWR,
   O_CLOEXEC,
+  P_PID,
   _exit,
   close as close_,
   devnull,
+  dup,
   dup2,
+  environ,
   execv,
   execve,
   fork,
+  kill,
   open as open_,
   pipe2,
   read,
-  waitpid as waitpid_,
+  readv,
+  strerror,
+  unlink,
+  wait4,
+  waitid,
   write,
+  WEXITED,
   WIFCONTINUED,
   WIFEXITED,
   WIFSIGNALED,
   WIFSTOPPED,
   WEXITSTATUS,
+  WNOHANG,
+  WNOWAIT,
   WTERMSIG,
 )
+try:
+  from os import (
+    POSIX_SPAWN_DUP2,
+    posix_spawn,
+  )
+except ImportError:
+  posix_spawn = None
+try:
+  from os import (
+    pidfd_open,
+  )
+except ImportError:
+  pidfd_open = None
+try:
+  from os import (
+    O_TMPFILE,
+  )
+except ImportError:
+  O_TMPFILE = None
+try:
+  from os import (
+    SPLICE_F_NONBLOCK,
+    splice,
+  )
+except ImportError:
+  splice = None
 from select import (
   PIPE_BUF,
   POLLERR,
@@ -88,11 +161,57 @@ from select import (
   POLLPRI,
   poll,
 )
+from signal import (
+  SIGKILL,
+  SIGPIPE,
+  SIGTERM,
+)
+from struct import (
+  pack,
+  unpack,
+)
 from sys import (
   stderr as stderr_,
   stdin as stdin_,
   stdout as stdout_,
 )
+from tempfile import (
+  gettempdir,
+  mkstemp,
+)
+from termios import (
+  FIONREAD,
+)
+from time import (
+  monotonic,
+  sleep,
+)
+
+
+def _libcTee():
+  """Retrieve the tee function of the C library, if it provides one."""
+  try:
+    function = CDLL(None, use_errno=True).tee
+  except (AttributeError, OSError):
+    return None
+
+  function.argtypes = [c_int, c_int, c_size_t, c_uint]
+  function.restype = c_ssize_t
+
+  def tee(fd_in, fd_out, count, flags=0):
+    """Duplicate data from one pipe to another without consuming it."""
+    result = function(fd_in, fd_out, count, flags)
+    if result < 0:
+      error = get_errno()
+      raise OSError(error, strerror(error))
+
+    return result
+
+  return tee
+
+
+# The os module does not expose tee(2), so we go through the C library.
+tee = _libcTee() if splice is not None else None
 
 
 class ProcessError(RuntimeError):
@@ -157,6 +276,136 @@ class ProcessError(RuntimeError):
     return self._stderr
 
 
+# The status reported for processes that got terminated because they
+# exceeded their time limit. It is the same as the one used by the
+# timeout(1) utility.
+_TIMEOUT_STATUS = 124
+
+
+class ProcessTimeoutError(ProcessError):
+  """An error indicating that processes did not finish within their time limit.
+
+    All processes still running at the time the limit was reached got
+    terminated. The data read from stdout and stderr up to that point is
+    made available through the stdout and stderr attributes.
+  """
+  def __init__(self, name, timeout, stdout=None, stderr=None):
+    super().__init__(_TIMEOUT_STATUS, name, stderr)
+
+    self._timeout = timeout
+    self._stdout = stdout
+
+
+  def __str__(self):
+    """Convert the error into a human readable string."""
+    s = "[Timed out after {timeout:.2f}s] {name}"
+    if self._stderr:
+      s += ": '{stderr}'"
+
+    s = s.format(timeout=self._timeout,
+                 name=self._name,
+                 stderr=self._stderr)
+    return s
+
+
+  @property
+  def timeout(self):
+    """Retrieve the time (in seconds) the processes were granted."""
+    return self._timeout
+
+
+  @property
+  def stdout(self):
+    """Retrieve the stdout data, if any, read before the processes got terminated."""
+    return self._stdout
+
+
+class CommandUsage:
+  """The resources used by a single command.
+
+    The 'wall' time spans from the start of the command until it got
+    reaped, 'user' and 'system' are the CPU times it consumed (all in
+    seconds), and 'max_rss' is its maximum resident set size in bytes.
+    All of them are None as long as the command did not terminate.
+  """
+  def __init__(self, command):
+    """Create a usage record for a command that just got started."""
+    self.command = command
+    self.status = None
+    self.wall = None
+    self.user = None
+    self.system = None
+    self.max_rss = None
+    self._start = monotonic()
+
+
+  def _finish(self, status, rusage):
+    """Fill in the usage of the command once it got reaped."""
+    self.status = status
+    self.wall = monotonic() - self._start
+    self.user = rusage.ru_utime
+    self.system = rusage.ru_stime
+    # Linux reports the maximum resident set size in KiB.
+    self.max_rss = rusage.ru_maxrss * 1024
+
+
+class Usage:
+  """The resource usage and timing of an execute, pipeline, or spring invocation.
+
+    'commands' is a list of CommandUsage objects, one for each command
+    started, in the order in which they were started. 'wall' is the time
+    (in seconds) the entire invocation took. 'stdin', 'stdout', and
+    'stderr' are the number of bytes transferred through the pipes we
+    serviced for the respective channel.
+  """
+  def __init__(self):
+    """Create an empty usage object."""
+    self.commands = []
+    self.wall = None
+    self.stdin = 0
+    self.stdout = 0
+    self.stderr = 0
+    self._start = monotonic()
+
+
+  def _finish(self, fds):
+    """Fill in the overall figures once the invocation is done."""
+    self.wall = monotonic() - self._start
+    self.stdin, self.stdout, self.stderr = fds.transferred()
+
+
+# The usage records of all processes whose resource usage is tracked,
+# by pid. A process is only entered here by its starter and removed
+# when it gets reaped, before its pid can be reused.
+_tracked = {}
+# The function invoked with the Usage object of every execute, pipeline,
+# and spring invocation, if any.
+_usage_hook = None
+
+
+def setUsageHook(hook):
+  """Install a function to be invoked with the Usage object of every execute, pipeline, and spring invocation.
+
+    The hook is also invoked for invocations that fail. None removes the
+    hook. The function returns the previously installed hook.
+  """
+  global _usage_hook
+
+  previous = _usage_hook
+  _usage_hook = hook
+  return previous
+
+
+def _report(usage, fds):
+  """Finish a Usage object and hand it to the usage hook, if any."""
+  if usage is not None:
+    usage._finish(fds)
+
+    hook = _usage_hook
+    if hook is not None:
+      hook(usage)
+
+
 def _exec(*args, env=None):
   """Convenience wrapper around the set of exec* functions."""
   # We do not use the exec*p* set of execution functions here, although
@@ -173,100 +422,292 @@ def _exec(*args, env=None):
 
 
 def _waitpid(pid):
-  """Convenience wrapper around the original waitpid invocation."""
+  """Convenience wrapper around the original waitpid invocation.
+
+    We use wait4 for reaping, which additionally reports the resources
+    used by the process. Those are recorded if the process is tracked.
+  """
   # 0 and -1 trigger a different behavior in waitpid. We disallow those
   # values.
   assert pid > 0
 
   while True:
-    pid_, status = waitpid_(pid, 0)
+    pid_, status, rusage = wait4(pid, 0)
     assert pid_ == pid
 
     if WIFEXITED(status):
-      return WEXITSTATUS(status)
+      status = WEXITSTATUS(status)
     elif WIFSIGNALED(status):
       # Signals are usually represented as the negated signal number.
-      return -WTERMSIG(status)
+      status = -WTERMSIG(status)
     elif WIFSTOPPED(status) or WIFCONTINUED(status):
       # In our current usage scenarios we can simply ignore SIGSTOP and
       # SIGCONT by restarting the wait.
       continue
     else:
       assert False
-      return 1
+      status = 1
+
+    record = _tracked.pop(pid, None)
+    if record is not None:
+      record._finish(status, rusage)
+
+    return status
+
+
+def _pidfd(pid):
+  """Retrieve a file descriptor becoming readable once a process terminated.
+
+    None is returned if the system does not support process file
+    descriptors.
+  """
+  if pidfd_open is not None:
+    try:
+      return pidfd_open(pid)
+    except OSError:
+      # The kernel might not support pidfds.
+      pass
+
+  return None
+
+
+def _deadline(timeout, deadline):
+  """Combine a timeout (in seconds) and a deadline (a time.monotonic value) into a single deadline.
+
+    None is returned if neither is given.
+  """
+  if timeout is not None:
+    expiry = monotonic() + timeout
+    deadline = expiry if deadline is None else min(deadline, expiry)
+
+  return deadline
+
+
+def _remaining(deadline):
+  """Retrieve the time (in milliseconds) left until a deadline, for use with poll."""
+  return max(0, ceil((deadline - monotonic()) * 1000))
 
 
-def execute(*args, env=None, stdin=None, stdout=None, stderr=b""):
+# The interval (in seconds) at which we check for the termination of a
+# process if we cannot get notified about it.
+_WAIT_INTERVAL = 0.01
+
+
+def _waitpidUntil(pid, deadline):
+  """Wait for a process like _waitpid does, but raise a TimeoutError once the deadline passed.
+
+    The process is left running and unreaped in case of a timeout. If
+    no deadline is given, the function behaves just like _waitpid.
+  """
+  if deadline is None:
+    return _waitpid(pid)
+
+  fd = _pidfd(pid)
+  if fd is not None:
+    try:
+      poller = poll()
+      poller.register(fd, _IN)
+      if not poller.poll(_remaining(deadline)):
+        raise TimeoutError("process {pid} still running".format(pid=pid))
+    finally:
+      close_(fd)
+  else:
+    # Without a pidfd we check periodically whether the process
+    # terminated, without reaping it.
+    while waitid(P_PID, pid, WEXITED | WNOHANG | WNOWAIT) is None:
+      if monotonic() >= deadline:
+        raise TimeoutError("process {pid} still running".format(pid=pid))
+      sleep(_WAIT_INTERVAL)
+
+  # The process terminated, so it can be reaped without blocking.
+  return _waitpid(pid)
+
+
+def _waitUntil(pids, statuses, deadline):
+  """Wait for a list of processes in order, appending their exit statuses to the given list.
+
+    If the deadline passes before all processes terminated, a
+    TimeoutError is raised. The processes not reaped are the ones
+    without a status in the list.
+  """
+  for pid in pids[len(statuses):]:
+    statuses += [_waitpidUntil(pid, deadline)]
+
+
+def execute(*args, env=None, stdin=None, stdout=None, stderr=b"",
+            timeout=None, deadline=None, usage=False, spill=None,
+            pipesize=None, readsize=None, executor=None):
   """Execute a program synchronously."""
   # Note that 'args' is a tuple. We do not want that so explicitly
   # convert it into a list. Then create another list out of this one to
   # effectively have a pipeline.
-  return pipeline([list(args)], env, stdin, stdout, stderr)
+  return pipeline([list(args)], env, stdin, stdout, stderr,
+                  timeout=timeout, deadline=deadline, usage=usage,
+                  spill=spill, pipesize=pipesize, readsize=readsize,
+                  executor=executor)
+
+
+def _spawnFork(command, env, fd_in, fd_out, fd_err):
+  """Start a command with the given standard file descriptors using fork & exec."""
+  pid = fork()
+  if pid == 0:
+    dup2(fd_in, stdin_.fileno())
+    dup2(fd_out, stdout_.fileno())
+    dup2(fd_err, stderr_.fileno())
+
+    _exec(*command, env=env)
+    # This statement should never be reached: either exec fails in
+    # which case a Python exception should be raised or the program is
+    # started in which case this process' image is overwritten anyway.
+    # Keep it to be absolutely safe.
+    _exit(-1)
+
+  return pid
+
+
+def _spawnPosix(command, env, fd_in, fd_out, fd_err):
+  """Start a command with the given standard file descriptors using posix_spawn.
+
+    Contrary to fork, posix_spawn does not duplicate the page tables of
+    the calling process (the C library uses vfork or an equivalent
+    under the hood), which makes starting a process from a large parent
+    considerably cheaper. Note that a failure to execute the command is
+    reported as an OSError in the calling process.
+  """
+  # All file descriptors we create are opened with O_CLOEXEC, so there
+  # is no need to close any of them explicitly.
+  file_actions = [
+    (POSIX_SPAWN_DUP2, fd_in, stdin_.fileno()),
+    (POSIX_SPAWN_DUP2, fd_out, stdout_.fileno()),
+    (POSIX_SPAWN_DUP2, fd_err, stderr_.fileno()),
+  ]
+  return posix_spawn(command[0], command, environ if env is None else env,
+                     file_actions=file_actions)
+
+
+# Start processes using posix_spawn, if the system supports it, and fall
+# back to fork & exec if it does not.
+_spawn = _spawnPosix if posix_spawn is not None else _spawnFork
+
+
+def _abort(pids, grace=None):
+  """Kill and reap a list of processes.
+
+    If a grace period (in seconds) is given, the processes are asked to
+    terminate by means of SIGTERM first and only killed if they did not
+    do so within that period.
+  """
+  pending = list(pids)
+
+  if grace is not None:
+    for pid in pending:
+      kill(pid, SIGTERM)
+
+    expiry = monotonic() + grace
+    try:
+      while pending:
+        _waitpidUntil(pending[0], expiry)
+        del pending[0]
+    except TimeoutError:
+      pass
+
+  for pid in pending:
+    kill(pid, SIGKILL)
+    _waitpid(pid)
 
 
-def _pipeline(commands, env, fd_in, fd_out, fd_err):
+# The time (in seconds) processes get to terminate on their own after
+# they exceeded their time limit, before they are killed.
+_TERMINATE_GRACE = 1.0
+
+
+def _pipe(size=None):
+  """Create a pipe, optionally trying to set its capacity to the given size.
+
+    Enlarging a pipe is best effort: unprivileged processes cannot go
+    beyond /proc/sys/fs/pipe-max-size, in which case the pipe keeps its
+    default capacity.
+  """
+  fd_in, fd_out = pipe2(O_CLOEXEC)
+
+  if size is not None:
+    try:
+      fcntl(fd_in, F_SETPIPE_SZ, size)
+    except OSError:
+      pass
+
+  return fd_in, fd_out
+
+
+def _pipeline(commands, env, fd_in, fd_out, fd_err, pipesize=None):
   """Run a series of commands connected by their stdout/stdin."""
+  # Only pipeline knows how to fan out the output of a pipeline.
+  if any(isinstance(command, Tee) for command in commands):
+    raise ValueError("A Tee is only supported as the last element of a "
+                     "pipeline run by pipeline()")
+
   pids = []
   first = True
 
-  for i, command in enumerate(commands):
-    last = i == len(commands) - 1
+  with defer() as d:
+    # In case we fail to start one of the commands, the ones we started
+    # already would have no one to talk to. Get rid of them.
+    abort = d.defer(_abort, pids)
 
-    # If there are more commands upcoming then we need to set up a pipe.
-    if not last:
-      fd_in_new, fd_out_new = pipe2(O_CLOEXEC)
+    for i, command in enumerate(commands):
+      last = i == len(commands) - 1
 
-    pids += [fork()]
-    child = pids[-1] == 0
+      # If there are more commands upcoming then we need to set up a
+      # pipe.
+      if not last:
+        fd_in_new, fd_out_new = _pipe(pipesize)
+        close_in_new = d.defer(close_, fd_in_new)
+        close_out_new = d.defer(close_, fd_out_new)
 
-    if child:
-      if not first:
-        # Establish communication channel with previous process.
-        dup2(fd_in_old, stdin_.fileno())
-        close_(fd_in_old)
-        close_(fd_out_old)
-      else:
-        dup2(fd_in, stdin_.fileno())
+      # Establish the communication channels with the previous and the
+      # next process, respectively.
+      pids += [_spawn(command, env,
+                      fd_in if first else fd_in_old,
+                      fd_out if last else fd_out_new,
+                      fd_err)]
 
-      if not last:
-        # Establish communication channel with next process.
-        close_(fd_in_new)
-        dup2(fd_out_new, stdout_.fileno())
-        close_(fd_out_new)
-      else:
-        dup2(fd_out, stdout_.fileno())
-
-      # Stderr is redirected for all commands in the pipeline because each
-      # process' output should be rerouted and stderr is not affected by
-      # the pipe between the processes in any way.
-      dup2(fd_err, stderr_.fileno())
-
-      _exec(*command, env=env)
-      # This statement should never be reached: either exec fails in
-      # which case a Python exception should be raised or the program is
-      # started in which case this process' image is overwritten anyway.
-      # Keep it to be absolutely safe.
-      _exit(-1)
-    else:
       if not first:
-        close_(fd_in_old)
-        close_(fd_out_old)
+        close_in_old()
+        close_out_old()
       else:
         first = False
 
       # If there are further commands then update the "old" pipe file
       # descriptors for future reference.
       if not last:
-        fd_in_old = fd_in_new
-        fd_out_old = fd_out_new
+        fd_in_old, close_in_old = fd_in_new, close_in_new
+        fd_out_old, close_out_old = fd_out_new, close_out_new
+
+    abort.release()
 
   return pids
 
 
+class Tee(list):
+  """A list of pipelines that the output of a pipeline is duplicated to.
+
+    A Tee can only be the last element of a pipeline. Each of its
+    elements, the branches, is a pipeline itself (i.e., a list of
+    commands).
+  """
+  def __init__(self, *branches):
+    """Create a Tee out of the given branches."""
+    super().__init__(branches)
+
+
 def formatCommands(commands):
   """Convert a command, pipeline, or spring into a string."""
   def depth(l, d):
     """Determine the maximum nesting depth of lists."""
+    # A Tee is formatted on its own and takes the place of a command.
+    if isinstance(l, Tee):
+      return d + 1
+
     if not isinstance(l, list):
       return d
 
@@ -289,6 +730,10 @@ def formatCommands(commands):
       in our command set as input parameter and use that as the base to
       determine how to properly format the commands at each level.
     """
+    if isinstance(commands, Tee):
+      branches = ", ".join(map(formatCommands, commands))
+      commands = ["tee(%s)" % branches]
+
     # We have reached a string (or something else "atomic" in our
     # sense). We can stop here.
     if not isinstance(commands, list):
@@ -349,10 +794,14 @@ def _wait(pids, commands, data_err, status=0, failed=None):
   # command.
   assert status == 0 or len(failed) > 0
 
-  for i, pid in enumerate(pids):
-    this_status = _waitpid(pid)
+  _check([_waitpid(pid) for pid in pids], commands, data_err, status, failed)
+
+
+def _check(statuses, commands, data_err, status=0, failed=None):
+  """Raise a ProcessError if a command failed, based on the exit status of each process."""
+  for i, this_status in enumerate(statuses):
     if this_status != 0 and status == 0:
-      # Only remember the first failure here, then continue clean up.
+      # Only remember the first failure here.
       failed = formatCommands([commands[i]])
       status = this_status
 
@@ -361,33 +810,183 @@ def _wait(pids, commands, data_err, status=0, failed=None):
     raise ProcessError(status, failed, error)
 
 
+# We use 4 KiB as the initial amount of data to read at a time. This is
+# quite a bit smaller than the 64 KiB that /bin/cat apparently uses (and
+# that seem to be the default buffer size of pipes on some systems) but
+# we expect way less high-volume data to be read here (it should be
+# piped directly to the next process instead of going through a Python
+# buffer). Whenever a read fills the entire chunk, i.e., data arrives
+# faster than we consume it, we double the amount, up to _READ_MAX.
+_READ_SIZE = 4 * 1024
+_READ_MAX = 1024 * 1024
+
+# The amount of data to move from a pipe to the temporary file at a time,
+# once we spilled the output of a command to disk.
+_SPILL_SIZE = 64 * 1024
+
+
+# The amount of data to read from a file object supplied as stdin at a
+# time. We only ever hold a single such chunk in memory.
+_STREAM_SIZE = 64 * 1024
+
+
+def _chunks(file_):
+  """Read a file object in chunks."""
+  while True:
+    chunk = file_.read(_STREAM_SIZE)
+    if not chunk:
+      break
+
+    yield chunk
+
+
+def _pull(data):
+  """Replace the fully written chunk of a streaming pipe dict with the next one.
+
+    The function returns False once the stream is exhausted.
+  """
+  data["written"] += data["offset"]
+  data["offset"] = 0
+  data["view"].release()
+
+  for chunk in data["chunks"]:
+    view = memoryview(chunk).cast("B")
+    if len(view) > 0:
+      data["view"] = view
+      return True
+
+    view.release()
+
+  return False
+
+
+def _release(data):
+  """Release the view of the data to write of one of our pipe dicts."""
+  data["view"].release()
+
+
 def _write(data):
   """Write data to one of our pipe dicts."""
   # Note that we are only guaranteed to write PIPE_BUF bytes at a time
-  # without blocking.
-  count = write(data["out"], data["data"][:PIPE_BUF])
+  # without blocking. We never slice the actual data, as that would copy
+  # all the remaining bytes with every write. Rather, we advance an
+  # offset into a view of it.
+  offset = data["offset"]
+  view = data["view"]
 
-  data["data"] = data["data"][count:]
-  return not data["data"]
+  with view[offset:offset + PIPE_BUF] as chunk:
+    count = write(data["out"], chunk)
+
+  data["offset"] = offset + count
+  if data["offset"] < len(view):
+    return False
+
+  # Data from a stream is pulled in lazily, only once the previous chunk
+  # was written entirely.
+  return "chunks" not in data or not _pull(data)
 
 
 def _read(data):
   """Read data from one of our pipe dicts."""
-  # We use 4 KiB as the maximum buffer size. This is quite a bit smaller
-  # than the 64 KiB that /bin/cat apparently uses (and that seem to be
-  # the default buffer size of pipes on some systems) but we expect way
-  # less high-volume data to be read here (it should be piped directly
-  # to the next process instead of going through a Python buffer). It
-  # still is kind of an arbitrary value. We could also start of with a
-  # small(er) value and increase it with every iteration or, if
-  # performance measurements suggest it, just pick a larger value
-  # altogether.
-  buf = read(data["in"], 4 * 1024)
-  if buf:
-    data["data"] += buf
-    return False
+  if "file" in data:
+    return _readFile(data)
+
+  # We accumulate all data in a bytearray that we grow geometrically
+  # ahead of time and read directly into its unused tail. Appending to a
+  # bytes object instead would copy the entire data read so far for
+  # every new chunk.
+  buf = data["data"]
+  size = data["size"]
+  amount = data["read"]
+
+  if len(buf) - size < amount:
+    buf.extend(bytes(max(size, amount)))
+
+  with memoryview(buf) as view:
+    with view[size:size + amount] as chunk:
+      count = readv(data["in"], [chunk])
+
+  data["size"] = size + count
+
+  if count == amount and data["adapt"] and amount < _READ_MAX:
+    data["read"] = amount * 2
+
+  if data["size"] > data["spill"]:
+    _spill(data)
+
+  return count == 0
+
+
+def _tmpfile():
+  """Create an anonymous temporary file and retrieve its file descriptor."""
+  directory = gettempdir()
+
+  if O_TMPFILE is not None:
+    try:
+      return open_(directory, O_TMPFILE | O_RDWR | O_CLOEXEC, 0o600)
+    except OSError:
+      # Not all file systems support O_TMPFILE.
+      pass
+
+  fd, path = mkstemp(dir=directory)
+  unlink(path)
+  return fd
+
+
+def _spill(data):
+  """Move the data read into one of our pipe dicts to an anonymous temporary file."""
+  data["file"] = _tmpfile()
+
+  with memoryview(data["data"]) as view:
+    offset = 0
+    while offset < data["size"]:
+      with view[offset:data["size"]] as chunk:
+        offset += write(data["file"], chunk)
+
+  # From now on the data goes to the file. We keep a buffer for copying
+  # it there, in case we cannot splice.
+  data["data"] = bytearray(_SPILL_SIZE)
+
+
+def _unspill(data):
+  """Close the temporary file of one of our pipe dicts, if any."""
+  if "file" in data:
+    close_(data.pop("file"))
+
+
+def _readFile(data):
+  """Read data from one of our pipe dicts into its temporary file."""
+  if splice is not None:
+    # Move the data from the pipe to the file in the kernel, without
+    # copying it to user space.
+    count = splice(data["in"], data["file"], _SPILL_SIZE)
   else:
-    return True
+    with memoryview(data["data"]) as view:
+      count = readv(data["in"], [view])
+      offset = 0
+      while offset < count:
+        with view[offset:count] as chunk:
+          offset += write(data["file"], chunk)
+
+  data["size"] += count
+  return count == 0
+
+
+def _collect(data):
+  """Retrieve the data read into one of our pipe dicts as bytes.
+
+    If the data got spilled to a temporary file, a read-only memory map
+    of the file is returned instead. It stays valid after the file got
+    closed.
+  """
+  if "file" in data:
+    return mmap(data["file"], data["size"], prot=PROT_READ)
+
+  buf = data["data"]
+  # Get rid of the preallocated but unused space first, so that we only
+  # need to copy what was actually read.
+  del buf[data["size"]:]
+  return bytes(buf)
 
 
 # The event mask for which to poll for a write channel (such as stdin).
@@ -409,33 +1008,138 @@ def eventToString(events):
   return "|".join([v for k, v in errors.items() if k & events])
 
 
+def _service(data, event):
+  """Handle a poll event for one of our pipe dicts.
+
+    The function returns True if the pipe is done, in which case it got
+    closed and unregistered from polling already.
+  """
+  close = False
+
+  # Note that reading (POLLIN or POLLPRI) and writing (POLLOUT) are
+  # mutually exclusive operations on a pipe. All can be combined with a
+  # HUP or with other errors (POLLERR or POLLNVAL; even though we did
+  # not subscribe to them), though.
+  if event & POLLOUT:
+    close = _write(data)
+  elif event & POLLIN or event & POLLPRI:
+    if event & POLLHUP:
+      # In case we received a combination of a data-is-available and a
+      # HUP event we need to make sure that we flush the entire pipe
+      # buffer before we stop the polling. Otherwise we might leave data
+      # unread that was successfully sent to us.
+      # Note that from a logical point of view this problem occurs only
+      # in the receive case. In the write case we have full control over
+      # the file descriptor ourselves and if the remote side closes its
+      # part there is no point in sending any more data.
+      while not _read(data):
+        pass
+    else:
+      close = _read(data)
+
+  # We explicitly (and early, compared to the defers we scheduled
+  # previously) close the file descriptor on POLLHUP, when we received
+  # EOF (for reading), or run out of data to send (for writing).
+  done = event & POLLHUP or close
+  if done:
+    data["close"]()
+    data["unreg"]()
+
+  # All error codes are reported to clients such that they can deal
+  # with potentially incomplete data.
+  if event & (POLLERR | POLLNVAL):
+    string = eventToString(event)
+    error = "Error while polling for new data, event: {s} ({e})"
+    error = error.format(s=string, e=event)
+    raise ConnectionError(error)
+
+  return bool(done)
+
+
 class _PipelineFileDescriptors:
   """This class manages file descriptors for use with any pipeline of commands."""
-  def __init__(self, later, here, stdin, stdout, stderr):
-    """Initialize the pipe infrastructure on demand."""
+  def __init__(self, later, here, stdin, stdout, stderr, spill=None,
+               pipesize=None, readsize=None, executor=None, fanout=None):
+    """Initialize the pipe infrastructure on demand.
+
+      If 'spill' is given, stdout data exceeding that many bytes is moved
+      to an anonymous temporary file instead of being kept in memory.
+      The 'pipesize' is the capacity to set for the pipes created, if
+      any. The 'readsize' is the fixed amount of data to read at a time,
+      if given; by default it adapts to the rate at which data arrives.
+      If an Executor is given, the null device and the poll object it
+      keeps are used instead of setting up our own.
+      If 'fanout' is given, stdout data is read separately for that
+      many branches of a Tee.
+    """
     # We got two defer objects here. So here is how it works: Some of
     # the resources should be freed latest after the pipeline finished
     # its work. That is what 'here' is for. Others need to be freed
     # later (by 'later'), think, the file descriptors we need to poll.
     def pipeWrite(argument, data):
       """Setup a pipe for writing data."""
-      data["in"], data["out"] = pipe2(O_CLOEXEC)
+      # We write the data out piece by piece by advancing an offset into
+      # a byte view of it. Anything that is not a bytes-like object is
+      # treated as a stream: a readable file object or an iterable of
+      # bytes-like objects that we consume one chunk at a time.
+      try:
+        data["view"] = memoryview(argument).cast("B")
+      except TypeError:
+        if hasattr(argument, "read"):
+          data["chunks"] = _chunks(argument)
+        else:
+          data["chunks"] = iter(argument)
+
+        data["view"] = memoryview(b"")
+
+      data["in"], data["out"] = _pipe(pipesize)
       data["data"] = argument
+      data["offset"] = 0
+      # The amount of data of previous chunks of a stream written.
+      data["written"] = 0
+      later.defer(_release, data)
       data["close"] = later.defer(close_, data["out"])
       here.defer(close_, data["in"])
 
-    def pipeRead(argument, data):
+    def pipeRead(argument, data, spill=None):
       """Setup a pipe for reading data."""
-      data["in"], data["out"] = pipe2(O_CLOEXEC)
-      data["data"] = argument
+      data["in"], data["out"] = _pipe(pipesize)
+      # The argument is the initial content of the buffer to read into.
+      data["data"] = bytearray(argument)
+      data["size"] = len(data["data"])
+      data["start"] = data["size"]
+      data["read"] = readsize if readsize is not None else _READ_SIZE
+      data["adapt"] = readsize is None
+      data["spill"] = spill if spill is not None else float("inf")
+      later.defer(_unspill, data)
       data["close"] = later.defer(close_, data["in"])
       here.defer(close_, data["out"])
 
+    # The poll object and the functions handling the events of each
+    # file descriptor being watched.
+    self._poll = None
+    self._handlers = {}
+
+    if executor is not None:
+      self._poll = executor._poll
+      # Should we bail out while watching file descriptors, the shared
+      # poll object must not keep them registered.
+      later.defer(self._unwatchAll)
     # By default we are blockable, i.e., we invoke poll without a
     # timeout. This property has to be an attribute of the object
     # because we might want to change it during an invocation of the
     # poll method that yielded.
     self._timeout = None
+    # When streaming data we yield after every batch of events, even in
+    # blocking mode, to hand out the data read so far.
+    self._yield = False
+    # The deadline (a time.monotonic value) after which polling fails,
+    # if any.
+    self._deadline = None
+    # The Usage object recording the commands we started, if any.
+    self._usage = None
+    # The capacity to set for the pipes between commands, if any.
+    self._pipesize = pipesize
 
     # We need three dict objects, each representing one of the available
     # data channels. Depending on whether the channel is actually used
@@ -443,6 +1147,9 @@ class _PipelineFileDescriptors:
     self._stdin = {}
     self._stdout = {}
     self._stderr = {}
+    # The stdout pipe dicts of the branches of a Tee, if any.
+    self._fanout = fanout
+    self._branches = []
 
     # We want to redirect all file descriptors that we do not want
     # anything from to /dev/null. But we only want to open the latter
@@ -450,8 +1157,11 @@ class _PipelineFileDescriptors:
     # channels are connected to pipes or user-defined file descriptors
     # anyway.
     if stdin is None or stdout is None or stderr is None:
-      null = open_(devnull, O_RDWR | O_CLOEXEC)
-      here.defer(close_, null)
+      if executor is not None:
+        null = executor._null
+      else:
+        null = open_(devnull, O_RDWR | O_CLOEXEC)
+        here.defer(close_, null)
 
       if stdin is None:
         stdin = null
@@ -473,8 +1183,13 @@ class _PipelineFileDescriptors:
 
     if isinstance(stdout, int):
       self._file_out = stdout
+    elif fanout is not None:
+      for _ in range(fanout):
+        data = {}
+        pipeRead(stdout, data, spill)
+        self._branches += [data]
     else:
-      pipeRead(stdout, self._stdout)
+      pipeRead(stdout, self._stdout, spill)
 
     if isinstance(stderr, int):
       self._file_err = stderr
@@ -491,7 +1206,8 @@ class _PipelineFileDescriptors:
       data is currently available but can resume polling later. The
       blocking mode can be influenced via the blockable member function.
       Note that this change can even happen after we yielded execution
-      in the non blockable case.
+      in the non blockable case. In either mode a TimeoutError is raised
+      once the deadline set via the expiring member function passed.
 
       Note that because we require non-blocking behavior in order to
       support springs, this function uses 'yield' instead of 'return'
@@ -504,91 +1220,117 @@ class _PipelineFileDescriptors:
     def pollWrite(data):
       """Conditionally set up polling for write events."""
       if data:
-        poll_.register(data["out"], _OUT)
-        data["unreg"] = d.defer(poll_.unregister, data["out"])
-        polls[data["out"]] = data
+        self.watch(data["out"], _OUT, _service, data)
+        data["unreg"] = d.defer(self.unwatch, data["out"])
 
     def pollRead(data):
       """Conditionally set up polling for read events."""
       if data:
-        poll_.register(data["in"], _IN)
-        data["unreg"] = d.defer(poll_.unregister, data["in"])
-        polls[data["in"]] = data
-
-    # We need a poll object if we want to send any data to stdin or want
-    # to receive any data from stdout or stderr.
-    if self._stdin or self._stdout or self._stderr:
-      poll_ = poll()
-
-    # We use a dictionary here to elegantly look up the entry (which is,
-    # another dictionary) for the respective file descriptor we received
-    # an event for and to decide if we need to poll more.
-    polls = {}
+        self.watch(data["in"], _IN, _service, data)
+        data["unreg"] = d.defer(self.unwatch, data["in"])
 
     with defer() as d:
       # Set up the polling infrastructure.
       pollWrite(self._stdin)
       pollRead(self._stdout)
       pollRead(self._stderr)
+      for data in self._branches:
+        pollRead(data)
+
+      # Each handler stops watching its file descriptor once it is done
+      # with it.
+      while self._handlers:
+        timeout = self._timeout
+        if self._deadline is not None:
+          remaining = _remaining(self._deadline)
+          if remaining == 0:
+            raise TimeoutError("deadline passed while polling")
 
-      while polls:
-        events = poll_.poll(self._timeout)
+          timeout = remaining if timeout is None else min(timeout, remaining)
+
+        events = self._poll.poll(timeout)
 
         for fd, event in events:
-          close = False
-          data = polls[fd]
-
-          # Note that reading (POLLIN or POLLPRI) and writing (POLLOUT)
-          # are mutually exclusive operations on a pipe. All can be
-          # combined with a HUP or with other errors (POLLERR or
-          # POLLNVAL; even though we did not subscribe to them), though.
-          if event & POLLOUT:
-            close = _write(data)
-          elif event & POLLIN or event & POLLPRI:
-            if event & POLLHUP:
-              # In case we received a combination of a data-is-available
-              # and a HUP event we need to make sure that we flush the
-              # entire pipe buffer before we stop the polling. Otherwise
-              # we might leave data unread that was successfully sent to
-              # us.
-              # Note that from a logical point of view this problem
-              # occurs only in the receive case. In the write case we
-              # have full control over the file descriptor ourselves and
-              # if the remote side closes its part there is no point in
-              # sending any more data.
-              while not _read(data):
-                pass
-            else:
-              close = _read(data)
-
-          # We explicitly (and early, compared to the defers we
-          # scheduled previously) close the file descriptor on POLLHUP,
-          # when we received EOF (for reading), or run out of data to
-          # send (for writing).
-          if event & POLLHUP or close:
-            data["close"]()
-            data["unreg"]()
-            del polls[fd]
-
-          # All error codes are reported to clients such that they can
-          # deal with potentially incomplete data.
-          if event & (POLLERR | POLLNVAL):
-            string = eventToString(event)
-            error = "Error while polling for new data, event: {s} ({e})"
-            error = error.format(s=string, e=event)
-            raise ConnectionError(error)
-
-        if self._timeout is not None:
+          # A handler invoked earlier might have caused another file
+          # descriptor to not be watched anymore.
+          handler = self._handlers.get(fd)
+          if handler is not None:
+            function, args = handler
+            function(*args, event)
+
+        if self._timeout is not None or self._yield:
           yield
 
       yield
 
 
+  def watch(self, fd, events, function, *args):
+    """Watch an additional file descriptor while polling.
+
+      For each event reported for the file descriptor the given function
+      is invoked with the supplied arguments and the event. It is
+      expected to stop watching the file descriptor once done with it.
+    """
+    # We only need a poll object if there actually is something to poll
+    # for.
+    if self._poll is None:
+      self._poll = poll()
+
+    self._poll.register(fd, events)
+    self._handlers[fd] = function, args
+
+
+  def unwatch(self, fd):
+    """Stop watching a file descriptor."""
+    self._poll.unregister(fd)
+    del self._handlers[fd]
+
+
+  def _unwatchAll(self):
+    """Stop watching all file descriptors."""
+    for fd in list(self._handlers):
+      self.unwatch(fd)
+
+
   def blockable(self, can_block):
     """Set whether or not polling is allowed to block."""
     self._timeout = None if can_block else 0
 
 
+  def yielding(self, can_yield):
+    """Set whether or not polling yields after every batch of events."""
+    self._yield = can_yield
+
+
+  def expiring(self, deadline):
+    """Set the deadline after which polling raises a TimeoutError."""
+    self._deadline = deadline
+
+
+  def measuring(self, usage):
+    """Set the Usage object to record the resource usage of started commands in."""
+    self._usage = usage
+
+
+  def started(self, pid, command):
+    """Track the resource usage of a command that got started, if desired."""
+    if self._usage is not None:
+      record = CommandUsage(command)
+      self._usage.commands += [record]
+      _tracked[pid] = record
+
+
+  def transferred(self):
+    """Retrieve the number of bytes transferred as a (stdin, stdout, stderr) tuple."""
+    def count(data):
+      """Retrieve the number of bytes read from one of our pipe dicts."""
+      return data["size"] - data["start"] if data else 0
+
+    stdin = self._stdin["written"] + self._stdin["offset"] if self._stdin else 0
+    stdout = count(self._stdout) + sum(map(count, self._branches))
+    return stdin, stdout, count(self._stderr)
+
+
   def stdin(self):
     """Retrieve the stdin file descriptor ready to be handed to a process."""
     return self._stdin["in"] if self._stdin else self._file_in
@@ -604,13 +1346,335 @@ class _PipelineFileDescriptors:
     return self._stderr["out"] if self._stderr else self._file_err
 
 
+  def branch(self, index):
+    """Retrieve the stdout file descriptor of a branch of a Tee ready to be handed to a process."""
+    return self._branches[index]["out"] if self._branches else self._file_out
+
+
+  def pipesize(self):
+    """Retrieve the capacity to set for the pipes between commands, if any."""
+    return self._pipesize
+
+
+  def channels(self):
+    """Retrieve the pipe dicts to write to and to read from as a (writes, reads) tuple."""
+    return [d for d in (self._stdin,) if d], [d for d in (self._stdout, self._stderr) if d]
+
+
+  def take(self):
+    """Retrieve the stdout data polled so far and remove it from the buffer."""
+    data = _collect(self._stdout)
+    self._stdout["data"] = bytearray()
+    self._stdout["size"] = 0
+    return data
+
+
   def data(self):
-    """Retrieve the data polled so far as a (stdout, stderr) tuple."""
-    return self._stdout["data"] if self._stdout else b"",\
-           self._stderr["data"] if self._stderr else b""
+    """Retrieve the data polled so far as a (stdout, stderr) tuple.
+
+      If stdout is fanned out, a list with the data of each branch is
+      retrieved for it.
+    """
+    if self._fanout is not None:
+      if self._branches:
+        stdout = [_collect(data) for data in self._branches]
+      else:
+        stdout = [b""] * self._fanout
+    else:
+      stdout = _collect(self._stdout) if self._stdout else b""
+
+    return stdout, _collect(self._stderr) if self._stderr else b""
+
+
+def _output(stdout, stderr, data_out, data_err):
+  """Select the data to return to the caller based on the channels read from."""
+  if stdout is not None and stderr is not None:
+    return data_out, data_err
+  elif stdout is not None:
+    return data_out
+  elif stderr is not None:
+    return data_err
+
 
+def _withUsage(output, usage):
+  """Add a Usage object to the output to return to the caller."""
+  if output is None:
+    return usage
+  elif isinstance(output, tuple):
+    return output + (usage,)
+  else:
+    return output, usage
+
+
+def _timedOut(fds, commands, pids, timeout):
+  """Terminate the processes still running after a timeout and create the error to report."""
+  _abort(pids, _TERMINATE_GRACE)
+
+  data_out, data_err = fds.data()
+  error = data_err.decode("utf-8") if data_err else None
+  return ProcessTimeoutError(formatCommands(commands), timeout, data_out, error)
+
+
+class _Reaper:
+  """Reap the processes of a pipeline from the poll loop as they terminate.
+
+    In fail-fast mode, once one of the processes failed, all others are
+    killed. That way a failure is reported right away instead of only
+    once the slowest command of the pipeline finished. Processes are
+    watched through pidfds; on systems not supporting them, they are
+    only waited for after polling.
+  """
+  def __init__(self, fds, later, pids, commands, failfast=True):
+    """Start watching the given processes."""
+    self._fds = fds
+    self._pids = pids
+    self._commands = commands
+    self._failfast = failfast
+    self._statuses = {}
+    self._exits = {}
+    self.result = {"status": 0, "failed": None}
+
+    for index, pid in enumerate(pids):
+      fd = _pidfd(pid)
+      if fd is not None:
+        self._exits[index] = fd, later.defer(close_, fd)
+        fds.watch(fd, _IN, self._exited, index)
+
+
+  def _exited(self, index, event):
+    """Handle the termination of a process."""
+    fd, close = self._exits.pop(index)
+    self._fds.unwatch(fd)
+    close()
+
+    # The process terminated, so it can be reaped without blocking.
+    status = _waitpid(self._pids[index])
+    self._statuses[index] = status
+
+    if self._failfast and status != 0 and self.result["status"] == 0:
+      # Remember the failure that caused us to kill the remaining
+      # processes, which will be reported as failed as well.
+      self.result["status"] = status
+      self.result["failed"] = formatCommands([self._commands[index]])
+
+      for i, pid in enumerate(self._pids):
+        if i not in self._statuses:
+          kill(pid, SIGKILL)
+
+
+  def _unwatch(self):
+    """Stop watching all processes."""
+    for index in list(self._exits):
+      fd, close = self._exits.pop(index)
+      self._fds.unwatch(fd)
+      close()
+
+
+  def wait(self, deadline=None):
+    """Wait for all processes not reaped yet and retrieve the exit statuses of all of them.
+
+      If a deadline is given and passes before all processes terminated,
+      a TimeoutError is raised.
+    """
+    self._unwatch()
+
+    for i, pid in enumerate(self._pids):
+      if i not in self._statuses:
+        if deadline is None:
+          self._statuses[i] = _waitpid(pid)
+        else:
+          self._statuses[i] = _waitpidUntil(pid, deadline)
+
+    return [self._statuses[i] for i in range(len(self._pids))]
+
+
+  def take(self):
+    """Stop watching and retrieve the pids of all processes not reaped yet."""
+    self._unwatch()
+
+    pids = []
+    for i, pid in enumerate(self._pids):
+      if i not in self._statuses:
+        # The caller is now responsible for the process.
+        self._statuses[i] = None
+        pids += [pid]
 
-def pipeline(commands, env=None, stdin=None, stdout=None, stderr=b""):
+    return pids
+
+
+  def abort(self):
+    """Kill and reap all processes not reaped yet."""
+    _abort(self.take())
+
+
+def _available(fd):
+  """Retrieve the amount of data that can be read from a pipe."""
+  return unpack("i", ioctl(fd, FIONREAD, pack("i", 0)))[0]
+
+
+class _Tee:
+  """Duplicate the output of a pipeline to the pipelines of the branches of a Tee.
+
+    Where supported, the data is duplicated using tee(2), which merely
+    references the pipe buffers holding it, and the last branch gets it
+    spliced, consuming it. That way the data is never copied to user
+    space. Only if a branch cannot take all of the data right away (or
+    if tee is not supported at all) we read it and write it out to the
+    branches still lacking it ourselves. Until they received it we do
+    not read any more data.
+  """
+  def __init__(self, fds, later, here, count, pipesize):
+    """Create the pipes for the given number of branches and start watching the input."""
+    self._fds = fds
+    self._teeing = tee is not None
+    self._branches = []
+    # The number of branches we still write data to from user space.
+    self._pending = 0
+
+    self._in, self.stdout = _pipe(pipesize)
+    self._close_in = later.defer(close_, self._in)
+    here.defer(close_, self.stdout)
+
+    # The read ends of the branches' pipes, to be handed to their first
+    # commands.
+    self.stdins = []
+    for _ in range(count):
+      fd_in, fd_out = _pipe(pipesize)
+      here.defer(close_, fd_in)
+      self.stdins += [fd_in]
+
+      self._branches += [{
+        "out": fd_out,
+        "close": later.defer(close_, fd_out),
+        "view": None,
+        "done": False,
+      }]
+
+    fds.watch(self._in, _IN, self._receive)
+
+
+  def _copy(self, function, branch, count):
+    """Duplicate or move data to a branch in the kernel, retrieving the amount of data transferred."""
+    try:
+      return function(self._in, branch["out"], count, flags=SPLICE_F_NONBLOCK)
+    except BlockingIOError:
+      # The branch's pipe is full.
+      return 0
+    except BrokenPipeError:
+      # The branch does not read any more data, e.g., because it
+      # terminated early. Let the others continue.
+      self._drop(branch)
+      return 0
+
+
+  def _receive(self, event):
+    """Handle a poll event for the pipe of the pipeline."""
+    count = _available(self._in)
+    if count == 0:
+      if event & POLLHUP:
+        self._finish()
+      return
+
+    *others, last = self._branches
+    if self._teeing:
+      copied = [self._copy(tee, branch, count) for branch in others]
+      # Moving the data to the last branch consumes it. So we can only
+      # do that if all others got it in its entirety.
+      if all(c == count or b["done"] for c, b in zip(copied, others)):
+        moved = self._copy(splice, last, count)
+      else:
+        moved = 0
+    else:
+      copied = [0] * len(others)
+      moved = 0
+
+    if moved < count:
+      # Note that the data read starts at the offset of what we moved.
+      view = memoryview(read(self._in, count - moved))
+      for branch, copy in zip(self._branches, copied + [moved]):
+        if copy < count and not branch["done"]:
+          branch["view"] = view[copy - moved:]
+          self._fds.watch(branch["out"], _OUT, self._send, branch)
+          self._pending += 1
+
+    self._branches = [branch for branch in self._branches if not branch["done"]]
+    if not self._branches:
+      # Just like a command would, we stop reading once no one is
+      # interested in the data anymore.
+      self._finish()
+    elif self._pending > 0:
+      self._fds.unwatch(self._in)
+
+
+  def _send(self, branch, event):
+    """Handle a poll event for the pipe of a branch we write data to."""
+    view = branch["view"]
+
+    try:
+      with view[:PIPE_BUF] as chunk:
+        count = write(branch["out"], chunk)
+    except BrokenPipeError:
+      self._drop(branch)
+      count = len(view)
+
+    branch["view"] = view[count:]
+    view.release()
+
+    if not branch["view"]:
+      branch["view"].release()
+      branch["view"] = None
+      self._fds.unwatch(branch["out"])
+      self._pending -= 1
+
+      if self._pending == 0:
+        self._branches = [b for b in self._branches if not b["done"]]
+        if self._branches:
+          self._fds.watch(self._in, _IN, self._receive)
+        else:
+          self._close_in()
+
+
+  def _drop(self, branch):
+    """Stop writing to a branch."""
+    branch["close"]()
+    branch["done"] = True
+
+
+  def _finish(self):
+    """Stop reading and signal the end of the data to all branches."""
+    self._fds.unwatch(self._in)
+    self._close_in()
+
+    for branch in self._branches:
+      self._drop(branch)
+
+
+def _fanout(commands, env, fds, later, here):
+  """Run a pipeline whose last element is a Tee, retrieving the pids of all commands started."""
+  *producer, branches = commands
+  if not producer:
+    raise ValueError("A Tee cannot be the first element of a pipeline")
+
+  tee_ = _Tee(fds, later, here, len(branches), fds.pipesize())
+  pids = []
+
+  with defer() as d:
+    abort = d.defer(_abort, pids)
+
+    pids += _pipeline(producer, env, fds.stdin(), tee_.stdout, fds.stderr(),
+                      fds.pipesize())
+    for i, (branch, fd_in) in enumerate(zip(branches, tee_.stdins)):
+      pids += _pipeline(branch, env, fd_in, fds.branch(i), fds.stderr(),
+                        fds.pipesize())
+
+    abort.release()
+
+  return pids
+
+
+def pipeline(commands, env=None, stdin=None, stdout=None, stderr=b"",
+             failfast=False, timeout=None, deadline=None, usage=False,
+             spill=None, pipesize=None, readsize=None, executor=None):
   """Execute a pipeline, supplying the given data to stdin and reading from stdout & stderr.
 
     This function executes a pipeline of commands and connects their
@@ -622,183 +1686,819 @@ def pipeline(commands, env=None, stdin=None, stdout=None, stderr=b""):
     or be used as the initial buffer content of data to read (stdout and
     stderr) of the last command (which means all actually read data will
     just be appended).
+    Instead of data, stdin can also be a readable file object or an
+    iterable (e.g., a generator) of byte-like objects. Such a stream is
+    read lazily, one chunk at a time, as the first command consumes its
+    input. That way, arbitrarily large inputs can be supplied without
+    holding them in memory.
+    If 'failfast' is True, the processes are watched while the pipeline
+    is running and all of them are killed as soon as one fails, instead
+    of waiting for each of them to finish on its own.
+    A 'timeout' (in seconds) and/or a 'deadline' (a time.monotonic
+    value) limit the time the pipeline may take. Once the limit is
+    reached, all processes still running are sent SIGTERM and, if they
+    do not terminate within a grace period, SIGKILL. A
+    ProcessTimeoutError carrying the output read so far is raised then.
+    If 'usage' is True, a Usage object describing the resources used by
+    each command is returned in addition to (after) the output. The
+    usage hook installed via setUsageHook, if any, receives this object
+    irrespective of the 'usage' argument.
+    If 'spill' is given, stdout data exceeding that many bytes is moved
+    to an anonymous temporary file as it is read, keeping memory usage
+    constant. In that case a read-only mmap.mmap object of the file is
+    returned instead of bytes; closing it releases the file. Smaller
+    outputs are unaffected.
+    If 'pipesize' is given, the capacity of all pipes created is set to
+    that many bytes, if permitted. Larger pipes let the commands run
+    longer without us having to service them. Data is read from stdout
+    and stderr in chunks that grow as long as more data is available
+    than fits into a chunk. If 'readsize' is given, that fixed chunk
+    size is used instead.
+    The 'executor' argument is used by Executor objects to share their
+    resources; use their methods instead of passing it.
+    If the last element of the pipeline is a Tee, the output of the
+    commands before it is duplicated to each of its branches. The stdout
+    data is then retrieved as a list containing the data of each branch.
+    The stderr data of all commands is still read together.
   """
+  deadline = _deadline(timeout, deadline)
+  start = monotonic()
+  measured = Usage() if usage or _usage_hook is not None else None
+  statuses = []
+
+  def running():
+    """Retrieve the pids of all processes not reaped yet."""
+    return reaper.take() if reaper is not None else pids[len(statuses):]
+
   with defer() as later:
     with defer() as here:
       # Set up the file descriptors to pass to our execution pipeline.
-      fds = _PipelineFileDescriptors(later, here, stdin, stdout, stderr)
+      fanout = len(commands[-1]) if isinstance(commands[-1], Tee) else None
+      fds = _PipelineFileDescriptors(later, here, stdin, stdout, stderr, spill,
+                                     pipesize, readsize, executor, fanout)
+      fds.measuring(measured)
 
       # Finally execute our pipeline and pass in the prepared file
       # descriptors to use.
-      pids = _pipeline(commands, env, fds.stdin(), fds.stdout(), fds.stderr())
+      if fanout is not None:
+        pids = _fanout(commands, env, fds, later, here)
+        # The commands run by each of the processes, in order.
+        processes = commands[:-1] + [c for branch in commands[-1] for c in branch]
+      else:
+        pids = _pipeline(commands, env, fds.stdin(), fds.stdout(), fds.stderr(),
+                         fds.pipesize())
+        processes = commands
 
-    for _ in fds.poll():
-      pass
+      for pid, command in zip(pids, processes):
+        fds.started(pid, command)
+
+    fds.expiring(deadline)
+
+    with defer() as d:
+      # Servicing the pipes can fail, e.g., if reading a stream supplied
+      # as stdin raises. Do not leave the processes behind in that case.
+      # When measuring, we reap the processes as they terminate, so that
+      # their wall time is not skewed by the others.
+      if failfast or measured is not None:
+        reaper = _Reaper(fds, later, pids, processes, failfast)
+      else:
+        reaper = None
+
+      abort = d.defer(lambda: _abort(running()))
+
+      # We have read or written all data that was available, the last
+      # thing to do is to wait for all the processes to finish and to
+      # clean them up.
+      try:
+        for _ in fds.poll():
+          pass
+
+        if reaper is not None:
+          statuses = reaper.wait(deadline)
+        else:
+          _waitUntil(pids, statuses, deadline)
+      except TimeoutError:
+        abort.release()
+        error = _timedOut(fds, commands, running(), deadline - start)
+        _report(measured, fds)
+        raise error
+
+      abort.release()
 
     data_out, data_err = fds.data()
+    _report(measured, fds)
 
-  # We have read or written all data that was available, the last thing
-  # to do is to wait for all the processes to finish and to clean them
-  # up.
-  _wait(pids, commands, data_err)
+  if reaper is not None:
+    _check(statuses, processes, data_err,
+           reaper.result["status"], reaper.result["failed"])
+  else:
+    _check(statuses, processes, data_err)
 
-  if stdout is not None and stderr is not None:
-    return data_out, data_err
-  elif stdout is not None:
-    return data_out
-  elif stderr is not None:
-    return data_err
+  output = _output(stdout, stderr, data_out, data_err)
+  return _withUsage(output, measured) if usage else output
+
+
+def _lines(chunks, errors):
+  """Split a sequence of data chunks into decoded lines (without line terminator)."""
+  line = bytearray()
+
+  for chunk in chunks:
+    # We only search the new chunk for a line break, so that very long
+    # lines arriving in many chunks do not get scanned over and over.
+    end = chunk.rfind(b"\n")
+    if end < 0:
+      line += chunk
+      continue
+
+    line += chunk[:end]
+    for string in line.split(b"\n"):
+      yield string.decode("utf-8", errors)
+
+    line = bytearray(chunk[end + 1:])
+
+  if line:
+    yield line.decode("utf-8", errors)
+
+
+def _stream(fds, poller, pids, commands, result=None):
+  """Yield the stdout data of a running pipeline or spring as it arrives.
+
+    The result of a spring is a dict that contains the status and the
+    command of a failed command of the spring, if any, once polling is
+    done.
+  """
+  with defer() as d:
+    # If the consumer stops iterating early we have no one to hand the
+    # data to. Kill all the processes in that case.
+    abort = d.defer(_abort, pids)
+
+    # We only poll for more data once the consumer asked for it. That
+    # way a slow consumer causes the pipes to fill up and the processes
+    # to block, instead of us buffering all the data.
+    for _ in poller:
+      data = fds.take()
+      if data:
+        yield data
+
+    _, data_err = fds.data()
+    abort.release()
+
+  if result is None:
+    _wait(pids, commands, data_err)
+  else:
+    _wait(pids, commands, data_err, result["status"], result["failed"])
+
+
+def pipelineIter(commands, env=None, stdin=None, stderr=b"", lines=False,
+                 errors="strict", pipesize=None, readsize=None):
+  """Execute a pipeline and yield its output as it is produced.
+
+    Instead of returning all stdout data at the end, this function is a
+    generator yielding chunks of data as soon as they are read or, if
+    'lines' is True, the individual lines decoded as UTF-8 (without the
+    line terminator). The 'errors' argument is the error handler used
+    for decoding, e.g., "surrogateescape" for output that is not
+    necessarily valid UTF-8. Once all data is read, a ProcessError is
+    raised if one of the commands failed. If the iteration is stopped early,
+    all processes are killed. Please refer to pipeline for a
+    description of the remaining parameters.
+  """
+  with defer() as later:
+    with defer() as here:
+      fds = _PipelineFileDescriptors(later, here, stdin, b"", stderr,
+                                     pipesize=pipesize, readsize=readsize)
+      fds.yielding(True)
+      pids = _pipeline(commands, env, fds.stdin(), fds.stdout(), fds.stderr(),
+                       fds.pipesize())
+
+    chunks = _stream(fds, fds.poll(), pids, commands)
+    yield from _lines(chunks, errors) if lines else chunks
+
+
+class _Sequencer:
+  """Run the commands of a spring one after the other from the poll loop.
+
+    Once a command is started, we get notified about its termination
+    through a process file descriptor (pidfd) watched by the same poll
+    loop that services the pipes. That way output is drained while we
+    wait for the command, and the next command is started without
+    blocking. On systems not supporting pidfds we fall back to blocking
+    in waitpid.
+  """
+  def __init__(self, commands, env, fds, later, pids, fd_in, fd_out, fd_err):
+    """Create a sequencer for the given spring commands.
+
+      All file descriptors are duplicated, so that the caller may close
+      them while the sequencer is still starting commands.
+    """
+    self._commands = commands
+    self._env = env
+    self._fds = fds
+    self._later = later
+    self._pids = pids
+    self._index = 0
+    self._pid = None
+    self._exit = None
+    self._fd_in = dup(fd_in)
+    self._fd_out = dup(fd_out)
+    self._fd_err = dup(fd_err)
+    # Once all commands are started (or one failed) we close our copies
+    # of the file descriptors. In case of a pipeline following the
+    # spring, that is what causes it to see the end of its input.
+    self._closes = [
+      later.defer(close_, self._fd_in),
+      later.defer(close_, self._fd_out),
+      later.defer(close_, self._fd_err),
+    ]
+    self.result = {"status": 0, "failed": None}
+
+
+  def hold(self, fd):
+    """Keep a file descriptor open until all commands are started."""
+    fd = dup(fd)
+    self._closes += [self._later.defer(close_, fd)]
+
+
+  def start(self):
+    """Start the current command of the spring."""
+    command = self._commands[self._index]
+    pid = _spawn(command, self._env, self._fd_in, self._fd_out, self._fd_err)
+    self._fds.started(pid, command)
+
+    if self._index == len(self._commands) - 1:
+      # The last command can just run in background; it is waited for
+      # along with the pipeline. We insert the pid just before the pids
+      # of the pipeline. The pipeline is started early but it runs the
+      # longest (because it processes the output of the spring) and we
+      # must keep this order in the pid list.
+      self._pids.insert(0, pid)
+      self._close()
+    else:
+      self._pid = pid
+
+
+  def watch(self):
+    """Watch the current command until all commands are started."""
+    while self._pid is not None:
+      fd = _pidfd(self._pid)
+      if fd is not None:
+        self._exit = fd, self._later.defer(close_, fd)
+        self._fds.watch(fd, _IN, self._exited)
+        return
+
+      # Without a pidfd we have no way of getting notified.
+      if not self._next(_waitpid(self._pid)):
+        return
+
+
+  def _exited(self, event):
+    """Handle the termination of the current command."""
+    fd, close = self._exit
+    self._fds.unwatch(fd)
+    close()
+    self._exit = None
+
+    # The process terminated, so it can be reaped without blocking.
+    if self._next(_waitpid(self._pid)):
+      self.watch()
+
+
+  def _next(self, status):
+    """Start the next command, if the current one succeeded.
+
+      The function returns False if there is no further command to
+      watch.
+    """
+    command = self._commands[self._index]
+    self._pid = None
+
+    if status != 0:
+      # One command failed. Do not start any more commands and indicate
+      # failure to the caller.
+      self.result["status"] = status
+      self.result["failed"] = formatCommands(command)
+      self._close()
+      return False
+
+    self._index += 1
+    self.start()
+    return self._pid is not None
+
+
+  def _close(self):
+    """Close our copies of the file descriptors."""
+    for close in self._closes:
+      close()
+
+
+  def take(self):
+    """Stop watching and retrieve the pid of the current command, if it is still running."""
+    if self._exit is not None:
+      fd, close = self._exit
+      self._fds.unwatch(fd)
+      close()
+      self._exit = None
 
+    pids = [self._pid] if self._pid is not None else []
+    self._pid = None
+    return pids
 
-def _spring(commands, env, fds):
+
+  def abort(self):
+    """Kill and reap the current command, if it is still running."""
+    _abort(self.take())
+
+
+def _spring(commands, env, fds, later):
   """Execute a series of commands and accumulate their output to a single destination.
 
-    Due to the nature of springs control flow here is a bit tricky. We
-    want to execute the first set of commands in a serial manner.
+    We want to execute the first set of commands in a serial manner.
     However, we need to get the remaining processes running in order to
     not stall everything (because nobody consumes any of the output).
-    Furthermore, we need to poll for incoming data to be processed. That
-    in turn is a process that must not block. Last but not least,
-    because the first set of commands runs in a serial manner, we need
-    to wait for each process to finish, which might be done with an
-    error code. In such a case we return early but still let the _wait
-    function handle the error propagation.
+    To that end, we start the first command of the spring along with the
+    pipeline following it. All subsequent commands are started from the
+    poll loop as their predecessor terminated. If one of them fails, we
+    start no more commands but still let the _wait function handle the
+    error propagation.
+    The function returns the list of pids to wait for, the poller to
+    use, and the sequencer running the spring. The latter's result dict
+    is only valid once polling is done.
   """
-  def pollData(poller):
-    """Poll for new data."""
-    # The poller might become exhausted here under certain
-    # circumstances. We do not care, it will always quit with an
-    # StopIteration exception which we kindly ignore.
-    try:
-      next(poller)
-    except StopIteration:
-      pass
-
   assert len(commands) > 0, commands
   assert len(commands[0]) > 0, commands
   assert isinstance(commands[0][0], list), commands
 
   pids = []
-  first = True
-  status = 0
-  failed = None
-  poller = None
-
-  fd_in = fds.stdin()
-  fd_out = fds.stdout()
-  fd_err = fds.stderr()
 
   # A spring consists of a number of commands executed in a serial
   # fashion with their output accumulated to a single destination and a
   # (possibly empty) pipeline that processes the output of the spring.
   spring_cmds = commands[0]
   pipe_cmds = commands[1:]
-  pipe_len = len(pipe_cmds)
 
-  # We need a pipe to connect the spring's output with the pipeline's
-  # input, if there is a pipeline following the spring.
-  if pipe_cmds:
-    fd_in_new, fd_out_new = pipe2(O_CLOEXEC)
-  else:
-    fd_in_new = fd_in
-    fd_out_new = fd_out
+  with defer() as d:
+    # If anything goes wrong while starting the commands we kill all the
+    # processes we started so far.
+    abort = d.defer(_abort, pids)
+
+    # We need a pipe to connect the spring's output with the pipeline's
+    # input, if there is a pipeline following the spring.
+    if pipe_cmds:
+      fd_in_new, fd_out_new = _pipe(fds.pipesize())
+      d.defer(close_, fd_in_new)
+      d.defer(close_, fd_out_new)
+    else:
+      fd_out_new = fds.stdout()
+
+    sequencer = _Sequencer(spring_cmds, env, fds, later, pids,
+                           fds.stdin(), fd_out_new, fds.stderr())
+    later.defer(sequencer.abort)
+
+    if pipe_cmds:
+      # Should the pipeline terminate early, the commands of the spring
+      # would be unable to write their output and fail. As the failure
+      # of the pipeline is what we want to report in this case, we keep
+      # the pipe open for reading until all commands are started.
+      sequencer.hold(fd_in_new)
+
+    sequencer.start()
+
+    # After we started the first command from the spring we need to make
+    # sure that there is a consumer of the output data. If there were
+    # none, the new process could potentially block forever trying to
+    # write data. To that end, start the remaining commands in the form
+    # of a pipeline.
+    if pipe_cmds:
+      pipe_pids = _pipeline(pipe_cmds, env,
+                            fd_in_new, fds.stdout(), fds.stderr(),
+                            fds.pipesize())
+      for pid, command in zip(pipe_pids, pipe_cmds):
+        fds.started(pid, command)
+
+      pids += pipe_pids
+
+    abort.release()
+
+  sequencer.watch()
+  return pids, fds.poll(), sequencer
+
+
+# The default maximum amount of data we buffer for the commands of a
+# parallel spring whose output cannot be forwarded yet.
+_SPRING_LIMIT = 16 * 1024 * 1024
+# The amount of data to read from a command of a parallel spring at a
+# time.
+_FORWARD_SIZE = 64 * 1024
+
+
+class _Forwarder:
+  """Forward the output of the concurrently running commands of a spring in order.
+
+    Each command writes into a pipe of its own. The output of the
+    current command (the first one not yet forwarded entirely) is
+    written to the sink as it arrives, whereas that of all subsequent
+    commands is buffered until it is their turn. Once the buffered data
+    exceeds the limit we stop reading from the pipes of the latter,
+    eventually causing the commands to block.
+    Where supported, output of the current command that does not have
+    to be buffered is spliced from its pipe to the sink directly,
+    without ever being copied to user space.
+  """
+  def __init__(self, fds, later, commands, sink, close_sink, limit):
+    """Create a forwarder for the given spring commands."""
+    assert limit > 0, limit
+
+    self._fds = fds
+    self._later = later
+    self._commands = commands
+    self._sink = sink
+    self._close_sink = close_sink
+    self._limit = limit
+    self._producers = []
+    self._current = 0
+    # The amount of data buffered for all but the current command.
+    self._buffered = 0
+    self._writing = False
+    self._splicing = splice is not None
+    self.result = {"status": 0, "failed": None}
+
+
+  def add(self, pid, fd, close):
+    """Add a started command writing into the pipe with the given read end."""
+    producer = {
+      "pid": pid,
+      "in": fd,
+      "close": close,
+      "data": bytearray(),
+      "eof": False,
+      "reading": False,
+      "exit": None,
+      "status": None,
+    }
+    self._producers += [producer]
+    self._read(producer)
+
+
+  def _read(self, producer):
+    """Start reading the output of a command."""
+    self._fds.watch(producer["in"], _IN, self._receive, producer)
+    producer["reading"] = True
+
+
+  def _pause(self, producer):
+    """Stop reading the output of a command."""
+    self._fds.unwatch(producer["in"])
+    producer["reading"] = False
+
+
+  def _eof(self, producer):
+    """Handle the end of the output of a command."""
+    self._pause(producer)
+    producer["close"]()
+    producer["eof"] = True
+
+    if producer is self._producers[self._current]:
+      self._advance()
+
+
+  def _splice(self, producer):
+    """Move output of the current command to the sink directly.
+
+      The function returns False if the sink does not support splicing.
+    """
+    try:
+      count = splice(producer["in"], self._sink, _FORWARD_SIZE,
+                     flags=SPLICE_F_NONBLOCK)
+    except BlockingIOError:
+      # The sink is full. Continue once it is writable again.
+      self._pause(producer)
+      self._fds.watch(self._sink, _OUT, self._send)
+      self._writing = True
+      return True
+    except BrokenPipeError:
+      self._fail(-SIGPIPE)
+      return True
+    except OSError as e:
+      # Splicing is not supported for all kinds of files (and not if
+      # the sink was opened with O_APPEND, for instance).
+      if e.errno != EINVAL:
+        raise
+
+      self._splicing = False
+      return False
+
+    if count == 0:
+      self._eof(producer)
 
-  for i, command in enumerate(spring_cmds):
-    last = i == len(spring_cmds) - 1
+    return True
 
-    pid = fork()
-    child = pid == 0
 
-    if child:
-      dup2(fd_in, stdin_.fileno())
-      dup2(fd_out_new, stdout_.fileno())
-      dup2(fd_err, stderr_.fileno())
+  def _receive(self, producer, event):
+    """Handle a poll event for the pipe of a command."""
+    if self._splicing and not producer["data"] and\
+       producer is self._producers[self._current]:
+      if self._splice(producer):
+        return
 
-      if pipe_cmds:
-        close_(fd_in_new)
-        close_(fd_out_new)
+    chunk = read(producer["in"], _FORWARD_SIZE)
+    if not chunk:
+      self._eof(producer)
+      return
 
-      _exec(*command, env=env)
-      _exit(-1)
+    producer["data"] += chunk
+
+    if producer is self._producers[self._current]:
+      if not self._writing:
+        self._fds.watch(self._sink, _OUT, self._send)
+        self._writing = True
+
+      if len(producer["data"]) >= self._limit:
+        self._pause(producer)
+    else:
+      self._buffered += len(chunk)
+      if self._buffered >= self._limit:
+        self._pause(producer)
+
+
+  def _send(self, event):
+    """Handle a poll event for the sink."""
+    producer = self._producers[self._current]
+    data = producer["data"]
+
+    # If we spliced the command's output there is no data; we just
+    # waited for the sink to become writable.
+    if data:
+      try:
+        with memoryview(data) as view, view[:PIPE_BUF] as chunk:
+          count = write(self._sink, chunk)
+      except BrokenPipeError:
+        # Had the command written to the sink directly, it would have
+        # been killed by SIGPIPE.
+        self._fail(-SIGPIPE)
+        return
+
+      # Note that removing data from the front of a bytearray does not
+      # copy the remaining data.
+      del data[:count]
+
+    if not data:
+      self._fds.unwatch(self._sink)
+      self._writing = False
+
+      if producer["eof"]:
+        self._advance()
+      elif not producer["reading"]:
+        self._read(producer)
+
+
+  def _advance(self):
+    """Move on to the next command once the current one is forwarded entirely."""
+    while self._current < len(self._producers):
+      producer = self._producers[self._current]
+      if not producer["eof"] or producer["data"]:
+        break
+
+      if producer["pid"] is not None:
+        # We get notified about the termination of the command through a
+        # pidfd, if possible. Otherwise we have to block.
+        fd = _pidfd(producer["pid"])
+        if fd is not None:
+          producer["exit"] = fd, self._later.defer(close_, fd)
+          self._fds.watch(fd, _IN, self._exited, producer)
+          return
+
+        producer["status"] = _waitpid(producer["pid"])
+        producer["pid"] = None
+
+      if producer["status"] != 0:
+        self._fail(producer["status"])
+        return
+
+      self._current += 1
+      if self._current < len(self._producers):
+        producer = self._producers[self._current]
+        self._buffered -= len(producer["data"])
+
+        if producer["data"]:
+          self._fds.watch(self._sink, _OUT, self._send)
+          self._writing = True
     else:
-      # After we started the first command from the spring we need to
-      # make sure that there is a consumer of the output data. If there
-      # were none, the new process could potentially block forever
-      # trying to write data. To that end, start the remaining commands
-      # in the form of a pipeline.
-      if first:
-        if pipe_cmds:
-          pids += _pipeline(pipe_cmds, env, fd_in_new, fd_out, fd_err)
+      # All output got forwarded.
+      self._close_sink()
+      return
+
+    # Now that the current command changed we may be able to read from
+    # commands we paused earlier.
+    for i, producer in enumerate(self._producers[self._current:]):
+      if not producer["eof"] and not producer["reading"]:
+        if i == 0 and len(producer["data"]) < self._limit or\
+           i > 0 and self._buffered < self._limit:
+          self._read(producer)
+
+
+  def _exited(self, producer, event):
+    """Handle the termination of the current command."""
+    self._unwatchExit(producer)
+
+    # The process terminated, so it can be reaped without blocking.
+    producer["status"] = _waitpid(producer["pid"])
+    producer["pid"] = None
+    self._advance()
+
+
+  def _unwatchExit(self, producer):
+    """Stop watching for the termination of a command."""
+    fd, close = producer["exit"]
+    self._fds.unwatch(fd)
+    close()
+    producer["exit"] = None
+
+
+  def _fail(self, status):
+    """Stop forwarding because the current command failed."""
+    # We report the failure just like a serial spring would. Note that
+    # the last command of a serial spring is waited for along with the
+    # pipeline, so its failure is attributed to the spring as a whole.
+    if self._current == len(self._producers) - 1:
+      failed = formatCommands([self._commands])
+    else:
+      failed = formatCommands(self._commands[self._current])
 
-        first = False
+    self.result["status"] = status
+    self.result["failed"] = failed
 
-      # The pipeline could still be stalled at some point if there is no
-      # final consumer of the data. We are required here to poll for
-      # data in order to prevent starvation.
-      if not poller:
-        poller = fds.poll()
-      else:
-        pollData(poller)
+    # A serial spring would not have started any of the subsequent
+    # commands. Get rid of them.
+    self.abort()
 
-      if not last:
-        status = _waitpid(pid)
-        if status != 0:
-          # One command failed. Do not start any more commands and
-          # indicate failure to the caller. He may try reading data from
-          # stderr (if any and if reading from it is enabled) and will
-          # raise an exception.
-          failed = formatCommands(command)
-          break
-      else:
-        # If we reached the last command in the spring we can just have
-        # it run in background and wait for it to finish later on -- no
-        # more serialization is required at that point.
-        # We insert the pid just before the pids for the pipeline. The
-        # pipeline is started early but it runs the longest (because it
-        # processes the output of the spring) and we must keep this
-        # order in the pid list.
-        pids[-pipe_len:-pipe_len] = [pid]
+    if self._writing:
+      self._fds.unwatch(self._sink)
+      self._writing = False
+
+    self._close_sink()
+
+
+  def take(self):
+    """Stop forwarding and retrieve the pids of all commands not reaped yet."""
+    pids = []
+    for producer in self._producers:
+      if producer["reading"]:
+        self._pause(producer)
+
+      if producer["exit"] is not None:
+        self._unwatchExit(producer)
+
+      if producer["pid"] is not None:
+        pids += [producer["pid"]]
+        producer["pid"] = None
 
-  if pipe_cmds:
-    close_(fd_in_new)
-    close_(fd_out_new)
+    return pids
 
-  assert poller
-  return pids, poller, status, failed
 
+  def abort(self):
+    """Kill and reap all commands still running."""
+    _abort(self.take())
+
+
+def _springParallel(commands, env, fds, later, limit):
+  """Execute the first set of commands of a spring concurrently.
+
+    The function returns the list of pids of the pipeline processing
+    the spring's output, the poller to use, and the forwarder running
+    the spring. The latter's result dict is only valid once polling is
+    done.
+  """
+  assert len(commands) > 0, commands
+  assert len(commands[0]) > 0, commands
+  assert isinstance(commands[0][0], list), commands
+
+  pids = []
+  spring_cmds = commands[0]
+  pipe_cmds = commands[1:]
+
+  with defer() as d:
+    # If anything goes wrong while starting the commands we kill all the
+    # processes we started so far.
+    abort = d.defer(_abort, pids)
+
+    # We forward the output of the spring to the pipeline or directly to
+    # its final destination. Either way, the file descriptor has to stay
+    # open until the output of all commands got forwarded.
+    if pipe_cmds:
+      fd_in_new, sink = _pipe(fds.pipesize())
+      d.defer(close_, fd_in_new)
+      close_sink = later.defer(close_, sink)
+      pids += _pipeline(pipe_cmds, env, fd_in_new, fds.stdout(), fds.stderr(),
+                        fds.pipesize())
+      for pid, command in zip(pids, pipe_cmds):
+        fds.started(pid, command)
+    else:
+      sink = dup(fds.stdout())
+      close_sink = later.defer(close_, sink)
+
+    forwarder = _Forwarder(fds, later, spring_cmds, sink, close_sink, limit)
+    later.defer(forwarder.abort)
+
+    for command in spring_cmds:
+      fd_in, fd_out = _pipe(fds.pipesize())
+      close_in = later.defer(close_, fd_in)
+      d.defer(close_, fd_out)
+
+      pid = _spawn(command, env, fds.stdin(), fd_out, fds.stderr())
+      fds.started(pid, command)
+      forwarder.add(pid, fd_in, close_in)
+
+    abort.release()
+
+  return pids, fds.poll(), forwarder
+
+
+def spring(commands, env=None, stdout=None, stderr=b"", parallel=False,
+           limit=_SPRING_LIMIT, timeout=None, deadline=None, usage=False,
+           spill=None, pipesize=None, readsize=None, executor=None):
+  """Execute a series of commands and accumulate their output to a single destination.
+
+    If 'parallel' is True, all commands of the spring are started at
+    once, each writing into a pipe of its own. Their output is still
+    forwarded in the order of the commands, with at most 'limit' bytes
+    of output being buffered for commands whose turn has not come yet.
+    The outcome, including the reporting of the first failing command,
+    is the same as when running the commands one after the other.
+    Please refer to pipeline for the semantics of 'timeout',
+    'deadline', 'usage', 'spill', 'pipesize', 'readsize', and
+    'executor'.
+  """
+  deadline = _deadline(timeout, deadline)
+  start = monotonic()
+  measured = Usage() if usage or _usage_hook is not None else None
+  statuses = []
 
-def spring(commands, env=None, stdout=None, stderr=b""):
-  """Execute a series of commands and accumulate their output to a single destination."""
   with defer() as later:
     with defer() as here:
       # A spring never receives any input from stdin, i.e., we always
       # want it to be redirected from /dev/null.
-      fds = _PipelineFileDescriptors(later, here, None, stdout, stderr)
-      # When running the spring we need to alternate between spawning
-      # new processes and polling for data. In that scenario, we do not
-      # want the polling to block until we started processes for all
-      # commands passed in.
-      fds.blockable(False)
+      fds = _PipelineFileDescriptors(later, here, None, stdout, stderr, spill,
+                                     pipesize, readsize, executor)
+      fds.measuring(measured)
 
       # Finally execute our spring and pass in the prepared file
       # descriptors to use.
-      pids, poller, status, failed = _spring(commands, env, fds)
+      if parallel:
+        pids, poller, owner = _springParallel(commands, env, fds, later, limit)
+      else:
+        pids, poller, owner = _spring(commands, env, fds, later)
 
-    # We started all processes and will wait for them to finish. From
-    # now on we can allow any invocation of poll to block.
-    fds.blockable(True)
+    fds.expiring(deadline)
 
-    # Poll until there is no more data.
-    for _ in poller:
-      pass
+    with defer() as d:
+      # Starting a command of the spring from the poll loop may fail. Do
+      # not leave the processes behind in that case.
+      abort = d.defer(lambda: _abort(pids[len(statuses):]))
+
+      try:
+        # Poll until there is no more data and all commands are started.
+        for _ in poller:
+          pass
+
+        _waitUntil(pids, statuses, deadline)
+      except TimeoutError:
+        abort.release()
+        running = owner.take() + pids[len(statuses):]
+        error = _timedOut(fds, commands, running, deadline - start)
+        _report(measured, fds)
+        raise error
+
+      abort.release()
 
     data_out, data_err = fds.data()
+    _report(measured, fds)
 
-  _wait(pids, commands, data_err, status=status, failed=failed)
+  result = owner.result
+  _check(statuses, commands, data_err, result["status"], result["failed"])
 
-  if stdout is not None and stderr is not None:
-    return data_out, data_err
-  elif stdout is not None:
-    return data_out
-  elif stderr is not None:
-    return data_err
+  output = _output(stdout, stderr, data_out, data_err)
+  return _withUsage(output, measured) if usage else output
+
+
+def springIter(commands, env=None, stderr=b"", lines=False, errors="strict",
+               parallel=False, limit=_SPRING_LIMIT, pipesize=None,
+               readsize=None):
+  """Execute a spring and yield its output as it is produced.
+
+    Please refer to pipelineIter for the semantics of the result and to
+    spring for the remaining parameters.
+  """
+  with defer() as later:
+    with defer() as here:
+      fds = _PipelineFileDescriptors(later, here, None, b"", stderr,
+                                     pipesize=pipesize, readsize=readsize)
+
+      if parallel:
+        pids, poller, owner = _springParallel(commands, env, fds, later, limit)
+      else:
+        pids, poller, owner = _spring(commands, env, fds, later)
+
+    fds.yielding(True)
+
+    chunks = _stream(fds, poller, pids, commands, owner.result)
+    yield from _lines(chunks, errors) if lines else chunks
@@ -0,0 +1,126 @@
+# executor.py
+
+#/***************************************************************************
+# *   Copyright (C) 2016 Daniel Mueller (deso@posteo.net)                   *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""A reusable context for executing many commands.
+
+  Each invocation of execute, pipeline, or spring sets up everything it
+  needs from scratch: it opens the null device, creates a poll object,
+  and has the environment converted for every process it starts.
+  Programs running a large number of short lived commands pay for that
+  over and over again. An Executor acquires these resources once and
+  shares them between all the commands executed through it.
+"""
+
+from deso.cleanup import (
+  defer,
+)
+from deso.execute.execute_ import (
+  execute,
+  pipeline,
+  spring,
+)
+from deso.execute.util import (
+  findCommand,
+)
+from os import (
+  O_CLOEXEC,
+  O_RDWR,
+  close as close_,
+  devnull,
+  environb,
+  fsencode,
+  open as open_,
+)
+from select import (
+  poll,
+)
+
+
+class Executor:
+  """A context for executing commands that pools the resources they need.
+
+    The environment is captured when the object is created: later
+    changes to os.environ are not seen by the commands executed. An
+    Executor must not be used from multiple threads concurrently.
+    Objects of this class are meant to be used as context managers;
+    the resources are released upon exit.
+  """
+  def __init__(self, env=None):
+    """Create an execution context for commands using the given environment.
+
+      By default the environment of the current process is used.
+    """
+    if env is None:
+      env = environb
+    # Convert the environment into the representation handed to the
+    # kernel once, instead of for every process started.
+    self._env = {fsencode(key): fsencode(value) for key, value in env.items()}
+    self._commands = {}
+    self._later = defer()
+
+    with defer() as here:
+      destroy = here.defer(self._later.destroy)
+
+      self._null = open_(devnull, O_RDWR | O_CLOEXEC)
+      self._later.defer(close_, self._null)
+      self._poll = poll()
+      destroy.release()
+
+
+  def __enter__(self):
+    """The block enter handler just returns a reference to this object."""
+    return self
+
+
+  def __exit__(self, type_, value, traceback):
+    """The block exit handler releases all resources."""
+    self.close()
+
+
+  def close(self):
+    """Release all resources."""
+    self._later.destroy()
+
+
+  def findCommand(self, name):
+    """Given a name, find the path to a command, caching the result."""
+    try:
+      return self._commands[name]
+    except KeyError:
+      path = findCommand(name)
+      self._commands[name] = path
+      return path
+
+
+  def execute(self, *args, env=None, **kwargs):
+    """Execute a program synchronously, see execute."""
+    return execute(*args, env=self._env if env is None else env,
+                   executor=self, **kwargs)
+
+
+  def pipeline(self, commands, env=None, **kwargs):
+    """Execute a pipeline, see pipeline."""
+    return pipeline(commands, self._env if env is None else env,
+                    executor=self, **kwargs)
+
+
+  def spring(self, commands, env=None, **kwargs):
+    """Execute a series of commands feeding a pipeline, see spring."""
+    return spring(commands, self._env if env is None else env,
+                  executor=self, **kwargs)
@@ -0,0 +1,260 @@
+# many.py
+
+#/***************************************************************************
+# *   Copyright (C) 2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Functions for executing a large number of independent commands.
+
+  Running many (typically short lived) commands one after the other
+  using execute means waiting for each of them in turn. The functions
+  provided here run up to a given number of commands concurrently,
+  service the pipes of all of them from a single poll loop, and reap
+  each process as soon as it terminated, regardless of the order in
+  which the commands were supplied.
+"""
+
+from deso.cleanup import (
+  defer,
+)
+from deso.execute.execute_ import (
+  _abort,
+  _check,
+  _IN,
+  _OUT,
+  _output,
+  _pidfd,
+  _PipelineFileDescriptors,
+  _service,
+  _spawn,
+  _waitpid,
+  formatCommands,
+  ProcessError,
+)
+from os import (
+  close as close_,
+  cpu_count,
+)
+from select import (
+  poll,
+)
+
+
+class _Job:
+  """A single command executed as part of a batch of commands."""
+  def __init__(self, index, command, env, stdin, stdout, stderr):
+    """Start a command."""
+    self.index = index
+    self.command = command
+    self.pending = 0
+
+    self._stdout = stdout
+    self._stderr = stderr
+    self._later = defer()
+    self._pid = None
+
+    with defer() as here:
+      # Should we fail to start the command, release everything set up
+      # so far.
+      destroy = here.defer(self._later.destroy)
+
+      self._fds = _PipelineFileDescriptors(self._later, here, stdin, stdout, stderr)
+      self._pid = _spawn(command, env,
+                         self._fds.stdin(), self._fds.stdout(), self._fds.stderr())
+      destroy.release()
+
+
+  def register(self, poll_, handlers):
+    """Register the job's pipes and, if possible, a pidfd for polling."""
+    def pollPipe(fd, events, data):
+      """Set up polling for a pipe dict."""
+      poll_.register(fd, events)
+      data["unreg"] = self._later.defer(poll_.unregister, fd)
+      handlers[fd] = self, data
+      self.pending += 1
+
+    writes, reads = self._fds.channels()
+    for data in writes:
+      pollPipe(data["out"], _OUT, data)
+
+    for data in reads:
+      pollPipe(data["in"], _IN, data)
+
+    # If the system supports pidfds we get notified about the process'
+    # termination through the same poll object. Otherwise we will wait
+    # for it once all its pipes are done.
+    fd = _pidfd(self._pid)
+    if fd is not None:
+      data = {
+        "close": self._later.defer(close_, fd),
+      }
+      pollPipe(fd, _IN, data)
+
+
+  def handle(self, data, event):
+    """Handle a poll event for one of the job's file descriptors.
+
+      The method returns True if the file descriptor is done.
+    """
+    if "in" in data or "out" in data:
+      done = _service(data, event)
+    else:
+      # A pidfd only ever signals readability once the process
+      # terminated.
+      data["unreg"]()
+      data["close"]()
+      done = True
+
+    if done:
+      self.pending -= 1
+
+    return done
+
+
+  def finish(self):
+    """Reap the job's process and retrieve its result."""
+    try:
+      status = _waitpid(self._pid)
+      self._pid = None
+
+      data_out, data_err = self._fds.data()
+    finally:
+      self._later.destroy()
+
+    try:
+      _check([status], [self.command], data_err)
+    except ProcessError as e:
+      return e
+
+    return _output(self._stdout, self._stderr, data_out, data_err)
+
+
+  def abort(self):
+    """Kill the job's process, if it is still running, and release all resources."""
+    if self._pid is not None:
+      _abort([self._pid])
+      self._pid = None
+
+    self._later.destroy()
+
+
+def executeManyUnordered(commands, concurrency=None, env=None, stdin=None,
+                         stdout=None, stderr=b""):
+  """Execute a number of independent commands, yielding results as they finish.
+
+    Up to 'concurrency' commands (the number of CPUs by default) run
+    at any time. The 'env', 'stdin', 'stdout', and 'stderr' arguments
+    apply to each command and have the same meaning as for execute.
+    Because the same stdin is supplied to each command, it cannot be a
+    stream (such as a file object or a generator) as it can for
+    pipeline.
+    The function yields (index, result) tuples in the order in which the
+    commands finish, with 'index' being the position of the command in
+    'commands'. The result is what execute would have returned for
+    the command or, if the command failed, the ProcessError it would
+    have raised. A command that cannot be executed at all results in a
+    ProcessError with status 127 (or 126), like in a shell.
+    If the iteration is stopped early, all commands still running are
+    killed.
+  """
+  if concurrency is None:
+    concurrency = cpu_count() or 1
+
+  assert concurrency > 0, concurrency
+
+  commands = enumerate(commands)
+  running = set()
+  handlers = {}
+  poll_ = poll()
+
+  def abort():
+    """Abort all running jobs."""
+    for job in running:
+      job.abort()
+
+  def start():
+    """Start new jobs until the concurrency limit is reached.
+
+      The function returns a list of (index, error) tuples for commands
+      that could not be started.
+    """
+    failed = []
+
+    while len(running) < concurrency:
+      next_ = next(commands, None)
+      if next_ is None:
+        break
+
+      index, command = next_
+      try:
+        job = _Job(index, command, env, stdin, stdout, stderr)
+      except OSError as e:
+        # Depending on the spawn backend, a command that cannot be
+        # executed is reported right away. Report it like a shell would,
+        # but only for this very command.
+        status = 127 if isinstance(e, FileNotFoundError) else 126
+        error = ProcessError(status, formatCommands([command]), str(e))
+        error.__cause__ = e
+        failed += [(index, error)]
+        continue
+
+      running.add(job)
+      job.register(poll_, handlers)
+
+    return failed
+
+  with defer() as d:
+    d.defer(abort)
+
+    while True:
+      yield from start()
+      # Note that start only returns with no job running once it ran out
+      # of commands.
+      if not running:
+        break
+
+      # Jobs without anything to poll for are finished right away.
+      done = [job for job in running if job.pending == 0]
+
+      if not done:
+        for fd, event in poll_.poll():
+          job, data = handlers[fd]
+          if job.handle(data, event):
+            del handlers[fd]
+
+            if job.pending == 0:
+              done += [job]
+
+      for job in done:
+        running.remove(job)
+        yield job.index, job.finish()
+
+
+def executeMany(commands, concurrency=None, env=None, stdin=None,
+                stdout=None, stderr=b""):
+  """Execute a number of independent commands concurrently.
+
+    The function returns a list with the results of the commands in
+    the order of the commands, see executeManyUnordered.
+  """
+  commands = list(commands)
+  results = [None] * len(commands)
+
+  for index, result in executeManyUnordered(commands, concurrency, env, stdin,
+                                            stdout, stderr):
+    results[index] = result
+
+  return results
@@ -33,7 +33,11 @@ def allTests():
   # Explicitly load all tests by name and not using a single discovery
   # to be able to easily deselect parts.
   tests = [
+    "testAsync.py",
+    "testCoprocess.py",
     "testExecute.py",
+    "testExecutor.py",
+    "testMany.py",
     "testUtil.py",
   ]
 
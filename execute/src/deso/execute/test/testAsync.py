@@ -0,0 +1,221 @@
+# testAsync.py
+
+#/***************************************************************************
+# *   Copyright (C) 2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Test asynchronous command execution."""
+
+from asyncio import (
+  gather,
+  run,
+  TimeoutError,
+  wait_for,
+)
+from deso.execute import (
+  executeAsync,
+  findCommand,
+  formatCommands,
+  pipelineAsync,
+  ProcessError,
+  springAsync,
+)
+from os import (
+  kill,
+)
+from re import (
+  escape,
+)
+from sys import (
+  executable,
+)
+from tempfile import (
+  mktemp,
+  NamedTemporaryFile,
+)
+from textwrap import (
+  dedent,
+)
+from time import (
+  monotonic,
+)
+from unittest import (
+  TestCase,
+  main,
+)
+
+
+_TRUE = findCommand("true")
+_FALSE = findCommand("false")
+_ECHO = findCommand("echo")
+_CAT = findCommand("cat")
+_TR = findCommand("tr")
+_SLEEP = findCommand("sleep")
+
+
+class TestAsync(TestCase):
+  """A test case for asynchronous command execution."""
+  def testExecuteAndOutput(self):
+    """Test command execution and output retrieval."""
+    out = run(executeAsync(_ECHO, "success", stdout=b"", stderr=None))
+    self.assertEqual(out, b"success\n")
+
+
+  def testExecuteAndInputOutput(self):
+    """Verify that we can supply data to stdin and read stdout at the same time."""
+    data = b"a" * 1024 * 1024
+    out, err = run(executeAsync(_CAT, stdin=data, stdout=b""))
+    self.assertEqual(out, data)
+    self.assertEqual(err, b"")
+
+
+  def testExecuteWithStreamInput(self):
+    """Verify that stdin data can be supplied by an iterable."""
+    chunks = [b"a" * 100000, b"b" * 100000]
+    out, _ = run(executeAsync(_CAT, stdin=iter(chunks), stdout=b""))
+    self.assertEqual(out, b"".join(chunks))
+
+
+  def testExecuteThrowsAndReportsError(self):
+    """Verify that a failing command raises an error containing its stderr output."""
+    regex = r"No such file or directory"
+
+    with self.assertRaisesRegex(ProcessError, regex):
+      run(executeAsync(_CAT, mktemp()))
+
+
+  def testPipelineWithRead(self):
+    """Test execution of a pipeline and reading the output."""
+    commands = [
+      [_ECHO, "suaaerr"],
+      [_TR, "a", "c"],
+      [_TR, "r", "s"],
+    ]
+    out = run(pipelineAsync(commands, stdout=b"", stderr=None))
+    self.assertEqual(out, b"success\n")
+
+
+  def testPipelineErrorStatus(self):
+    """Verify that the first failure in a pipeline is reported."""
+    commands = [
+      [_TRUE],
+      [executable, "-c", "exit(42)"],
+      [_FALSE],
+    ]
+    with self.assertRaises(ProcessError) as e:
+      run(pipelineAsync(commands))
+
+    self.assertEqual(e.exception.status, 42)
+
+
+  def testPipelinesRunConcurrently(self):
+    """Verify that multiple pipelines can run concurrently on the same event loop."""
+    async def sleep():
+      """Run a number of sleep commands concurrently."""
+      return await gather(*[executeAsync(_SLEEP, "0.5") for _ in range(4)])
+
+    start = monotonic()
+    run(sleep())
+    self.assertLess(monotonic() - start, 1.5)
+
+
+  def testPipelineCancellation(self):
+    """Verify that cancelling a pipeline kills the processes it started."""
+    with NamedTemporaryFile() as file_:
+      script = dedent("""\
+        from os import getpid
+        from time import sleep
+
+        with open("{path}", "w") as file_:
+          file_.write("%d" % getpid())
+
+        sleep(10)
+      """).format(path=file_.name)
+      commands = [
+        [executable, "-c", script],
+        [_CAT],
+      ]
+
+      start = monotonic()
+      with self.assertRaises(TimeoutError):
+        run(wait_for(pipelineAsync(commands, stdout=b""), 1))
+
+      self.assertLess(monotonic() - start, 5)
+      pid = int(file_.read())
+
+    # The process must have been killed and reaped.
+    with self.assertRaises(ProcessLookupError):
+      kill(pid, 0)
+
+
+  def testSpringReadWithPipeline(self):
+    """Execute a spring followed by a pipeline."""
+    commands = [
+      [[_ECHO, "suaaerr"], [_ECHO, "yippie"], [_ECHO, "wohoo"]],
+      [_TR, "a", "c"],
+      [_TR, "r", "s"],
+    ]
+    out = run(springAsync(commands, stdout=b"", stderr=None))
+    self.assertEqual(out, b"success\nyippie\nwohoo\n")
+
+
+  def testSpringReadOut(self):
+    """Execute a spring without a pipeline and verify its output order."""
+    texts = ["abc", "def", "ghi", "jkl", "mno"]
+    commands = [[_ECHO, text] for text in texts]
+
+    out = run(springAsync([commands], stdout=b"", stderr=None))
+    self.assertEqual(out, bytes("\n".join(texts) + "\n", "utf-8"))
+
+
+  def testSpringError(self):
+    """Verify that a failing command of a spring stops the spring."""
+    path = mktemp()
+    commands = [
+      [[_ECHO, "test1"], [_CAT, path], [_ECHO, "test2"]],
+      [_CAT],
+    ]
+
+    with self.assertRaisesRegex(ProcessError, r"%s.*No such file" % _CAT):
+      run(springAsync(commands))
+
+
+  def testSpringPipelineError(self):
+    """Verify that a failing command of the pipeline after a spring is reported as such."""
+    fail = [executable, "-c", "import sys; sys.stdin.read(); exit(3)"]
+    commands = [
+      [[_ECHO, "a"], [_ECHO, "b"]],
+      [_CAT],
+      fail,
+    ]
+    regex = r"^\[Status 3\] %s$" % escape(formatCommands(fail))
+
+    with self.assertRaisesRegex(ProcessError, regex):
+      run(springAsync(commands))
+
+
+  def testSpringWithLargeOutput(self):
+    """Verify that a spring producing more than a pipe buffer of output does not stall."""
+    script = "import sys; sys.stdout.write('x' * 1024 * 1024)"
+    commands = [
+      [[executable, "-c", script], [executable, "-c", script]],
+    ]
+    out = run(springAsync(commands, stdout=b"", stderr=None))
+    self.assertEqual(len(out), 2 * 1024 * 1024)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,160 @@
+# testCoprocess.py
+
+#/***************************************************************************
+# *   Copyright (C) 2016 Daniel Mueller (deso@posteo.net)                   *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Test the coprocess functionality."""
+
+from deso.execute import (
+  Coprocess,
+  findCommand,
+  LengthFraming,
+  ProcessError,
+  TerminatorFraming,
+)
+from sys import (
+  executable,
+)
+from textwrap import (
+  dedent,
+)
+from threading import (
+  Thread,
+)
+from unittest import (
+  TestCase,
+  main,
+)
+
+
+_CAT = findCommand("cat")
+
+# A script echoing length prefixed requests in upper case.
+_UPPER = dedent("""\
+  import sys
+  while True:
+    size = sys.stdin.buffer.read(2)
+    if not size:
+      break
+    data = sys.stdin.buffer.read(int.from_bytes(size, "little")).upper()
+    sys.stdout.buffer.write(len(data).to_bytes(2, "little") + data)
+    sys.stdout.flush()
+""")
+
+# A script echoing NUL terminated requests until it read a given number
+# of them, and exiting with status 3 on request 'die'.
+_LIMITED = dedent("""\
+  import sys
+  for _ in range(int(sys.argv[1])):
+    data = b""
+    while not data.endswith(b"\\0"):
+      char = sys.stdin.buffer.read(1)
+      if not char:
+        sys.exit(0)
+      data += char
+    if data == b"die\\0":
+      sys.exit(3)
+    sys.stdout.buffer.write(data)
+    sys.stdout.flush()
+""")
+
+
+class TestCoprocess(TestCase):
+  """A test case for coprocesses."""
+  def testLines(self):
+    """Verify that line framed requests are answered."""
+    with Coprocess([_CAT]) as cat:
+      self.assertEqual(cat.request(b"foo"), b"foo")
+      self.assertEqual(cat.request(b""), b"")
+      self.assertEqual(cat.request(b"bar" * 100000), b"bar" * 100000)
+
+
+  def testLengthPrefix(self):
+    """Verify that length prefixed requests are answered."""
+    framing = LengthFraming(size=2, byteorder="little")
+    with Coprocess([executable, "-c", _UPPER], framing) as upper:
+      self.assertEqual(upper.request(b"foo\nbar"), b"FOO\nBAR")
+      self.assertEqual(upper.request(b""), b"")
+      self.assertEqual(upper.request(b"baz" * 10000), b"BAZ" * 10000)
+
+
+  def testPipelined(self):
+    """Verify that many requests can be in flight at once."""
+    requests = [str(i).encode() * (i % 100) for i in range(20000)]
+
+    with Coprocess([_CAT]) as cat:
+      self.assertEqual(list(cat.requests(requests)), requests)
+      self.assertEqual(list(cat.requests(iter(requests))), requests)
+
+
+  def testAbandoned(self):
+    """Verify that stopping the iteration early does not leave stale responses."""
+    with Coprocess([_CAT]) as cat:
+      for response in cat.requests([b"1", b"2", b"3"]):
+        self.assertEqual(response, b"1")
+        break
+
+      self.assertEqual(cat.request(b"4"), b"4")
+
+
+  def testThreads(self):
+    """Verify that requests can be issued from multiple threads."""
+    results = {}
+
+    def run(cat, index):
+      """Issue a number of requests."""
+      results[index] = [cat.request(b"%d-%d" % (index, i)) for i in range(100)]
+
+    with Coprocess([_CAT]) as cat:
+      threads = [Thread(target=run, args=(cat, i)) for i in range(8)]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+
+    for index in range(8):
+      self.assertEqual(results[index], [b"%d-%d" % (index, i) for i in range(100)])
+
+
+  def testRestart(self):
+    """Verify that a terminated coprocess gets restarted."""
+    framing = TerminatorFraming(b"\0")
+    command = [executable, "-c", _LIMITED, "2"]
+    requests = [b"%d" % i for i in range(7)]
+
+    with Coprocess(command, framing) as limited:
+      self.assertEqual(list(limited.requests(requests)), requests)
+      self.assertEqual(limited.request(b"foo"), b"foo")
+
+
+  def testCrash(self):
+    """Verify that a coprocess failing repeatedly results in an error."""
+    framing = TerminatorFraming(b"\0")
+    command = [executable, "-c", _LIMITED, "10"]
+    regex = r"^\[Status 3\] %s" % executable
+
+    with Coprocess(command, framing) as limited:
+      self.assertEqual(limited.request(b"foo"), b"foo")
+      with self.assertRaisesRegex(ProcessError, regex):
+        limited.request(b"die")
+
+      # The coprocess is usable again afterwards.
+      self.assertEqual(limited.request(b"bar"), b"bar")
+
+
+if __name__ == "__main__":
+  main()
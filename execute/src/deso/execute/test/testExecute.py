@@ -24,14 +24,37 @@ from deso.execute import (
   findCommand,
   formatCommands,
   pipeline as pipeline_,
+  pipelineIter,
   ProcessError,
-  spring as spring_
+  ProcessTimeoutError,
+  setUsageHook,
+  spring as spring_,
+  springIter,
+  Tee,
+  Usage,
 )
 from deso.execute.execute_ import (
   eventToString,
+  pidfd_open,
+  posix_spawn,
+  splice as splice_,
+  tee as tee_,
+  _pipe,
+  _spawnFork,
+)
+from fcntl import (
+  F_GETPIPE_SZ,
+  fcntl,
+)
+from mmap import (
+  mmap,
 )
 from os import (
+  close,
   environ,
+  kill,
+  listdir,
+  readv as readv_,
   remove,
 )
 from os.path import (
@@ -63,9 +86,17 @@ from tempfile import (
 from textwrap import (
   dedent,
 )
+from time import (
+  monotonic,
+  sleep,
+)
 from unittest import (
   TestCase,
   main,
+  skipIf,
+)
+from unittest.mock import (
+  patch,
 )
 
 
@@ -76,25 +107,30 @@ _TOUCH = findCommand("touch")
 _CAT = findCommand("cat")
 _TR = findCommand("tr")
 _DD = findCommand("dd")
+_HEAD = findCommand("head")
 
 
-def execute(*args, env=None, stdin=None, stdout=None, stderr=None):
+def execute(*args, env=None, stdin=None, stdout=None, stderr=None, **kwargs):
   """Run a program with reading from stderr disabled by default."""
-  return execute_(*args, env=env, stdin=stdin, stdout=stdout, stderr=stderr)
+  return execute_(*args, env=env, stdin=stdin, stdout=stdout, stderr=stderr,
+                  **kwargs)
 
 
-def pipeline(commands, env=None, stdin=None, stdout=None, stderr=None):
+def pipeline(commands, env=None, stdin=None, stdout=None, stderr=None, **kwargs):
   """Run a pipeline with reading from stderr disabled by default."""
-  return pipeline_(commands, env=env, stdin=stdin, stdout=stdout, stderr=stderr)
+  return pipeline_(commands, env=env, stdin=stdin, stdout=stdout, stderr=stderr,
+                   **kwargs)
 
 
-def spring(commands, env=None, stdout=None, stderr=None):
+def spring(commands, env=None, stdout=None, stderr=None, **kwargs):
   """Run a spring with reading from stderr disabled by default."""
-  return spring_(commands, env=env, stdout=stdout, stderr=stderr)
+  return spring_(commands, env=env, stdout=stdout, stderr=stderr, **kwargs)
 
 
 class TestExecute(TestCase):
   """A test case for command execution functionality."""
+  FORK = posix_spawn is None
+
   def testProcessErrorNoStderr(self):
     """Verify that when not reading stderr output we get a rather generic error report."""
     tmp_file = mktemp()
@@ -427,6 +463,17 @@ class TestExecute(TestCase):
                "/bin/tr a a"
     self.assertEqual(formatCommands(commands), expected)
 
+    # Case 7) A pipeline fanning out its output.
+    commands = [
+      ["/bin/echo", "test"],
+      Tee(
+        [["/bin/cat"]],
+        [["/bin/tr", "a", "b"], ["/bin/cat"]],
+      ),
+    ]
+    expected = "/bin/echo test | tee(/bin/cat, /bin/tr a b | /bin/cat)"
+    self.assertEqual(formatCommands(commands), expected)
+
 
   def testPipelineSingleProgram(self):
     """Verify that a pipeline can run a single program."""
@@ -511,6 +558,526 @@ class TestExecute(TestCase):
       self.assertEqual(len(out), len(data))
 
 
+  def testPipelineWithBufferInput(self):
+    """Verify that stdin data can be supplied in the form of arbitrary buffers."""
+    data = bytearray(b"0123456789" * 100000)
+
+    with memoryview(data) as view, view[500:] as slice_:
+      for stdin in (data, view, slice_):
+        out = pipeline([[_CAT]], stdin=stdin, stdout=b"")
+        self.assertEqual(out, bytes(stdin))
+
+    # The data must not be referenced anymore once the pipeline is done,
+    # i.e., we have to be able to resize it.
+    data += b"abc"
+
+
+  def testPipelineFailFast(self):
+    """Verify that a failing command of a fail-fast pipeline stops the others right away."""
+    sleep_ = findCommand("sleep")
+    commands = [
+      [_FALSE],
+      [sleep_, "10"],
+      [_CAT],
+    ]
+    regex = r"^\[Status 1\] %s$" % escape(_FALSE)
+
+    start = monotonic()
+    with self.assertRaisesRegex(ProcessError, regex):
+      pipeline(commands, stdout=b"", failfast=True)
+
+    self.assertLess(monotonic() - start, 5)
+
+
+  def testPipelineFailFastSuccess(self):
+    """Verify that a fail-fast pipeline behaves like a regular one if all commands succeed."""
+    commands = [
+      [_ECHO, "suaaerr"],
+      [_TR, "a", "c"],
+      [_TR, "r", "s"],
+    ]
+    for stdout in (b"", None):
+      out = pipeline(commands, stdout=stdout, failfast=True)
+      self.assertEqual(out, b"success\n" if stdout is not None else None)
+
+    with patch("deso.execute.execute_.pidfd_open", None):
+      with self.assertRaises(ProcessError):
+        pipeline([[_TRUE], [_FALSE]], failfast=True)
+
+
+  def testExecuteTimeout(self):
+    """Verify that a command exceeding its timeout gets terminated."""
+    sleep_ = findCommand("sleep")
+    regex = r"^\[Timed out after 0.50s\] %s 10$" % escape(sleep_)
+
+    for pidfd in (True, False):
+      with patch("deso.execute.execute_.pidfd_open", pidfd_open if pidfd else None):
+        start = monotonic()
+        with self.assertRaisesRegex(ProcessTimeoutError, regex) as e:
+          execute(sleep_, "10", timeout=0.5)
+
+        self.assertLess(monotonic() - start, 5)
+        self.assertEqual(e.exception.status, 124)
+
+    # Commands finishing in time are unaffected.
+    self.assertEqual(execute(_ECHO, "ok", stdout=b"", timeout=10), b"ok\n")
+    with self.assertRaises(ProcessError):
+      execute(_FALSE, timeout=10)
+
+
+  def testPipelineTimeoutOutput(self):
+    """Verify that the output read before a pipeline timed out is reported."""
+    script = dedent("""\
+      import sys, time
+      print("partial", flush=True)
+      print("error", file=sys.stderr, flush=True)
+      time.sleep(10)
+    """)
+    commands = [
+      [executable, "-c", script],
+      [_CAT],
+    ]
+    for failfast in (False, True):
+      with self.assertRaises(ProcessTimeoutError) as e:
+        pipeline(commands, stdout=b"", stderr=b"", failfast=failfast,
+                 deadline=monotonic() + 1)
+
+      self.assertEqual(e.exception.stdout, b"partial\n")
+      self.assertEqual(e.exception.stderr, "error")
+
+
+  def testPipelineTimeoutKill(self):
+    """Verify that processes ignoring SIGTERM get killed after the grace period."""
+    script = dedent("""\
+      import signal, time
+      signal.signal(signal.SIGTERM, signal.SIG_IGN)
+      print("ready", flush=True)
+      time.sleep(10)
+    """)
+    start = monotonic()
+    with self.assertRaises(ProcessTimeoutError) as e:
+      pipeline([[executable, "-c", script]], stdout=b"", timeout=1)
+
+    self.assertEqual(e.exception.stdout, b"ready\n")
+    self.assertLess(monotonic() - start, 5)
+
+
+  def testSpringTimeout(self):
+    """Verify that a spring exceeding its timeout gets terminated."""
+    sleep_ = findCommand("sleep")
+    commands = [
+      [[_ECHO, "first"], [sleep_, "10"], [_ECHO, "last"]],
+      [_CAT],
+    ]
+    for parallel in (False, True):
+      start = monotonic()
+      with self.assertRaises(ProcessTimeoutError) as e:
+        spring(commands, stdout=b"", parallel=parallel, timeout=0.5)
+
+      self.assertLess(monotonic() - start, 5)
+      self.assertEqual(e.exception.stdout, b"first\n")
+
+    out = spring([[[_ECHO, "first"], [_ECHO, "last"]]], stdout=b"", timeout=10)
+    self.assertEqual(out, b"first\nlast\n")
+
+
+  def testPipelineSpill(self):
+    """Verify that large outputs are spilled to disk."""
+    data = b"0123456789abcdef" * 100000
+    commands = [[_CAT]]
+
+    for splice in (True, False):
+      with patch("deso.execute.execute_.splice", splice_ if splice else None):
+        out = pipeline(commands, stdin=data, stdout=b"head", spill=1000)
+        self.assertIsInstance(out, mmap)
+        self.assertEqual(len(out), len(data) + 4)
+        self.assertEqual(out[:4], b"head")
+        self.assertEqual(out[4:], data)
+
+    # Output below the threshold is kept in memory.
+    out = pipeline(commands, stdin=data[:1000], stdout=b"", spill=1000)
+    self.assertEqual(out, data[:1000])
+
+    out = spring([[[_ECHO, "abc"], [_CAT]]], stdout=b"", spill=2)
+    self.assertEqual(out[:], b"abc\n")
+
+
+  def testPipelineReadSize(self):
+    """Verify that the read size adapts to the amount of data arriving."""
+    data = b"0123456789abcdef" * 1000000
+    reads = []
+
+    def readv(fd, buffers):
+      """Count read invocations."""
+      reads.append(len(buffers[0]))
+      return readv_(fd, buffers)
+
+    with patch("deso.execute.execute_.readv", readv):
+      for readsize, size in ((None, len(data)), (4096, 1000000), (1, 10000)):
+        del reads[:]
+        out = pipeline([[_CAT]], stdin=data[:size], stdout=b"", readsize=readsize)
+        self.assertEqual(out, data[:size])
+
+        if readsize is None:
+          self.assertGreater(max(reads), 4096)
+          self.assertLess(len(reads), len(data) // 4096)
+        else:
+          self.assertEqual(set(reads), {readsize})
+
+
+  def testPipelinePipeSize(self):
+    """Verify that the capacity of the pipes created can be set."""
+    size = 256 * 1024
+    fd_in, fd_out = _pipe(size)
+    try:
+      self.assertEqual(fcntl(fd_in, F_GETPIPE_SZ), size)
+    finally:
+      close(fd_in)
+      close(fd_out)
+
+    data = b"0123456789" * 100000
+    commands = [[_CAT], [_CAT], [_TR, "a", "a"]]
+    out = pipeline(commands, stdin=data, stdout=b"", pipesize=size)
+    self.assertEqual(out, data)
+
+    out = spring([[[_ECHO, "a"], [_ECHO, "b"]], [_CAT]], stdout=b"",
+                 pipesize=size, parallel=True)
+    self.assertEqual(out, b"a\nb\n")
+
+    # An excessive size is not an error.
+    self.assertEqual(execute(_ECHO, "ok", stdout=b"", pipesize=1 << 40), b"ok\n")
+
+
+  def testPipelineTee(self):
+    """Verify that the output of a pipeline can be fanned out, with and without tee."""
+    data = b"0123456789" * 100000
+    # The first branch only starts reading after a while, so that it
+    # cannot keep up with the others.
+    slow = [executable, "-c", dedent("""\
+      import sys, time
+      time.sleep(0.2)
+      sys.stdout.buffer.write(sys.stdin.buffer.read())
+    """)]
+    commands = [
+      [_CAT],
+      Tee(
+        [slow],
+        [[_TR, "0", "a"]],
+        [[_HEAD, "-c", "10"]],
+        [[_CAT], [_CAT]],
+      ),
+    ]
+    expected = [data, data.replace(b"0", b"a"), data[:10], data]
+
+    for teeing in (True, False):
+      with patch("deso.execute.execute_.tee", tee_ if teeing else None):
+        out = pipeline(commands, stdin=data, stdout=b"")
+        self.assertEqual(out, expected)
+
+    out, err = pipeline([[_ECHO, "test"], Tee([[_CAT]], [[_CAT]])],
+                        stdout=b"", stderr=b"")
+    self.assertEqual(out, [b"test\n", b"test\n"])
+    self.assertEqual(err, b"")
+
+    with NamedTemporaryFile() as file_:
+      pipeline([[_ECHO, "test"], Tee([[_CAT]], [[_CAT]])], stdout=file_.fileno())
+      file_.seek(0)
+      self.assertEqual(file_.read(), b"test\ntest\n")
+
+
+  def testPipelineTeeError(self):
+    """Verify that failures in and misuse of a fanned out pipeline are reported."""
+    before = len(listdir("/proc/self/fd"))
+    fail = [executable, "-c", "exit(3)"]
+    commands = [[_ECHO, "test"], Tee([[_CAT]], [[_CAT], fail])]
+    regex = r"^\[Status 3\] %s$" % escape(formatCommands(fail))
+
+    with self.assertRaisesRegex(ProcessError, regex):
+      pipeline(commands)
+
+    invalid = [
+      [Tee([[_CAT]])],
+      [[_ECHO, "test"], Tee([[_CAT]]), [_CAT]],
+      [[_ECHO, "test"], Tee([[_CAT], Tee([[_CAT]])])],
+    ]
+    for commands in invalid:
+      with self.assertRaises(ValueError):
+        pipeline(commands)
+
+    with self.assertRaises(ValueError):
+      spring([[[_ECHO, "test"]], Tee([[_CAT]])])
+
+    self.assertEqual(len(listdir("/proc/self/fd")), before)
+
+
+  def testPipelineUsage(self):
+    """Verify that the resource usage of the commands of a pipeline is reported."""
+    commands = [
+      [executable, "-c", "import sys; sum(range(10 ** 7)); print(sys.stdin.read())"],
+      [_TR, "a", "b"],
+    ]
+    out, usage = pipeline(commands, stdin=b"abc" * 10000, stdout=b"", usage=True)
+    self.assertEqual(out, b"bbc" * 10000 + b"\n")
+
+    self.assertEqual([u.command for u in usage.commands], commands)
+    for u in usage.commands:
+      self.assertEqual(u.status, 0)
+      self.assertGreater(u.wall, 0)
+      self.assertGreater(u.max_rss, 0)
+
+    self.assertGreater(usage.commands[0].user, 0)
+    self.assertGreaterEqual(usage.wall, usage.commands[0].wall)
+    self.assertEqual(usage.stdin, 30000)
+    self.assertEqual(usage.stdout, 30001)
+    self.assertEqual(usage.stderr, 0)
+
+    chunks = [b"abc", b"", b"d" * 100000]
+    usage = pipeline([[_CAT]], stdin=iter(chunks), usage=True)
+    self.assertIsInstance(usage, Usage)
+    self.assertEqual(usage.stdin, 100003)
+    self.assertEqual(usage.stdout, 0)
+
+    out, err, usage = execute(_ECHO, "ok", stdout=b"", stderr=b"", usage=True)
+    self.assertEqual((out, err), (b"ok\n", b""))
+    self.assertEqual(usage.stdout, 3)
+
+
+  def testUsageHook(self):
+    """Verify that the usage hook is invoked for every invocation."""
+    usages = []
+    self.assertIsNone(setUsageHook(usages.append))
+    self.addCleanup(setUsageHook, None)
+
+    execute(_TRUE)
+    with self.assertRaises(ProcessError):
+      pipeline([[_TRUE], [_FALSE]])
+
+    commands = [[[_ECHO, "a"], [_ECHO, "b"]], [_CAT]]
+    for parallel in (False, True):
+      self.assertEqual(spring(commands, stdout=b"", parallel=parallel), b"a\nb\n")
+
+    self.assertEqual(len(usages), 4)
+    self.assertEqual([u.status for u in usages[1].commands], [0, 1])
+    for usage in usages[2:]:
+      self.assertEqual(len(usage.commands), 3)
+      self.assertEqual(sorted(u.command for u in usage.commands),
+                       sorted([[_ECHO, "a"], [_ECHO, "b"], [_CAT]]))
+      self.assertEqual(usage.stdout, 4)
+
+
+  def testPipelineWithStreamInput(self):
+    """Verify that stdin data can be supplied by a file object or an iterable."""
+    chunks = [b"0123456789" * 10000, b"", bytearray(b"abc"), b"d" * 100000]
+    data = b"".join(chunks)
+
+    out = pipeline([[_CAT]], stdin=iter(chunks), stdout=b"")
+    self.assertEqual(out, data)
+
+    out = pipeline([[_CAT], [_CAT]], stdin=(c for c in chunks), stdout=b"")
+    self.assertEqual(out, data)
+
+    out = pipeline([[_CAT]], stdin=iter([]), stdout=b"")
+    self.assertEqual(out, b"")
+
+    with TemporaryFile() as file_:
+      file_.write(data)
+      file_.seek(0)
+
+      out = pipeline([[_CAT]], stdin=file_, stdout=b"")
+      self.assertEqual(out, data)
+
+
+  def testPipelineWithLazyStreamInput(self):
+    """Verify that a stream supplied as stdin is only read as it is consumed."""
+    pulled = 0
+
+    def generate():
+      """Generate a large amount of data while tracking what was pulled."""
+      nonlocal pulled
+      for _ in range(1024):
+        pulled += 1
+        yield b"a" * 65536
+
+    # Once we got the first output, only as much data can have been
+    # pulled from the generator as fits into the pipes and the buffer of
+    # the process.
+    output = pipelineIter([[_CAT]], stdin=generate(), stderr=None)
+    next(output)
+    self.assertLess(pulled, 16)
+
+    output.close()
+
+
+  def testPipelineWithFailingStreamInput(self):
+    """Verify that an error raised by a stream supplied as stdin is propagated."""
+    def generate():
+      """Generate some data and fail."""
+      yield b"abc"
+      raise ValueError("failed")
+
+    with self.assertRaisesRegex(ValueError, "failed"):
+      pipeline([[_CAT]], stdin=generate(), stdout=b"")
+
+
+  def testPipelineReadAppendsToInitialData(self):
+    """Verify that read data is appended to the initial buffer content."""
+    out = pipeline([[_ECHO, "success"]], stdout=b"result: ")
+    self.assertEqual(out, b"result: success\n")
+    self.assertIsInstance(out, bytes)
+
+
+  def testPipelineWithMissingCommand(self):
+    """Verify that a command that cannot be executed is reported when using posix_spawn."""
+    if self.FORK:
+      self.skipTest("A forked child fails on its own")
+
+    commands = [
+      [_ECHO, "test"],
+      [mktemp()],
+      [_CAT],
+    ]
+    with self.assertRaises(FileNotFoundError):
+      pipeline(commands)
+
+    with self.assertRaises(FileNotFoundError):
+      spring([[[_ECHO, "test"], [mktemp()]], [_CAT]])
+
+
+  def testPipelineIter(self):
+    """Verify that we can iterate over the output of a pipeline."""
+    commands = [
+      [_ECHO, "suaaerr\nyippie"],
+      [_TR, "a", "c"],
+      [_TR, "r", "s"],
+    ]
+    out = b"".join(pipelineIter(commands, stderr=None))
+    self.assertEqual(out, b"success\nyippie\n")
+
+    lines = list(pipelineIter(commands, stderr=None, lines=True))
+    self.assertEqual(lines, ["success", "yippie"])
+
+
+  def testPipelineIterChunks(self):
+    """Verify that a large output is yielded in multiple chunks."""
+    data = b"a" * 4 * 1024 * 1024
+    chunks = list(pipelineIter([[_CAT]], stdin=data, stderr=None))
+
+    self.assertGreater(len(chunks), 1)
+    self.assertEqual(b"".join(chunks), data)
+
+
+  def testPipelineIterLines(self):
+    """Verify that lines spanning multiple chunks are reassembled correctly."""
+    script = dedent("""\
+      from sys import stdout
+      for i in range(1000):
+        stdout.write("%d" % i * (i % 100))
+        stdout.write("\\n")
+      stdout.write("end")
+    """)
+    expected = ["%d" % i * (i % 100) for i in range(1000)] + ["end"]
+    commands = [[executable, "-c", script]]
+    lines = list(pipelineIter(commands, stderr=None, lines=True))
+    self.assertEqual(lines, expected)
+
+
+  def testPipelineIterDecodingErrors(self):
+    """Verify that the error handler for decoding lines can be chosen."""
+    commands = [[_CAT]]
+    data = b"valid\ninvalid \xff\n"
+
+    with self.assertRaises(UnicodeDecodeError):
+      list(pipelineIter(commands, stdin=data, stderr=None, lines=True))
+
+    lines = list(pipelineIter(commands, stdin=data, stderr=None, lines=True,
+                              errors="surrogateescape"))
+    self.assertEqual(lines, ["valid", "invalid \udcff"])
+
+
+  def testPipelineIterError(self):
+    """Verify that a failing command is reported after all output was yielded."""
+    path = mktemp()
+    commands = [
+      [_ECHO, "test"],
+      [_CAT, "-", path],
+    ]
+    lines = []
+
+    with self.assertRaisesRegex(ProcessError, r"No such file or directory"):
+      for line in pipelineIter(commands, lines=True):
+        lines.append(line)
+
+    self.assertEqual(lines, ["test"])
+
+
+  def testPipelineIterEarlyClose(self):
+    """Verify that processes are killed when stopping the iteration early."""
+    script = dedent("""\
+      from os import getpid
+      print(getpid(), flush=True)
+      while True:
+        print("y" * 100)
+    """)
+    lines = pipelineIter([[executable, "-c", script]], stderr=None, lines=True)
+    pid = int(next(lines))
+
+    for _ in range(100):
+      self.assertEqual(next(lines), "y" * 100)
+
+    lines.close()
+
+    # The process must have been killed and reaped.
+    with self.assertRaises(ProcessLookupError):
+      kill(pid, 0)
+
+
+  def testPipelineIterBackpressure(self):
+    """Verify that output is not read ahead of the consumer."""
+    script = dedent("""\
+      from sys import stdout
+      for _ in range(4096):
+        stdout.buffer.write(b"x" * 1024)
+    """)
+    chunks = pipelineIter([[executable, "-c", script]], stderr=None)
+    first = next(chunks)
+    self.assertGreater(len(first), 0)
+
+    # Give the process some time to write. As we do not consume any
+    # data, it has to block once the pipe buffer is full, so only a
+    # small fraction of the 4 MiB can have been read.
+    sleep(0.5)
+    second = next(chunks)
+    self.assertLess(len(first) + len(second), 1024 * 1024)
+
+    total = len(first) + len(second) + sum(len(chunk) for chunk in chunks)
+    self.assertEqual(total, 4096 * 1024)
+
+
+  def testSpringIter(self):
+    """Verify that we can iterate over the output of a spring."""
+    commands = [
+      [[_ECHO, "suaaerr"], [_ECHO, "yippie"], [_ECHO, "wohoo"]],
+      [_TR, "a", "c"],
+      [_TR, "r", "s"],
+    ]
+    lines = list(springIter(commands, stderr=None, lines=True))
+    self.assertEqual(lines, ["success", "yippie", "wohoo"])
+
+
+  def testSpringIterError(self):
+    """Verify that a failing spring command is reported at the end of the iteration."""
+    commands = [
+      [[_ECHO, "test"], [_FALSE], [_ECHO, "never"]],
+    ]
+    lines = []
+
+    with self.assertRaisesRegex(ProcessError, escape(_FALSE)):
+      for line in springIter(commands, stderr=None, lines=True):
+        lines.append(line)
+
+    self.assertEqual(lines, ["test"])
+
+
   def testPipelineWithFailingCommand(self):
     """Verify that a failing command in a pipeline fails the entire execution."""
     identity = [_TR, "a", "a"]
@@ -668,6 +1235,135 @@ class TestExecute(TestCase):
 
 
 
+  def testSpringDrainsWhileWaiting(self):
+    """Verify that output is drained while waiting for a command of a spring."""
+    # The first command writes more data to stderr than a pipe can hold
+    # and will only terminate once we read it.
+    script = "from sys import stderr; stderr.buffer.write(b'x' * 1024 * 1024)"
+    commands = [[[executable, "-c", script], [_ECHO, "a"]], [_CAT]]
+
+    for parallel in (False, True):
+      out, err = spring(commands, stdout=b"", stderr=b"", parallel=parallel)
+      self.assertEqual(out, b"a\n")
+      self.assertEqual(err, b"x" * 1024 * 1024)
+
+
+  def testSpringWithoutPidfd(self):
+    """Verify that springs work on systems not supporting pidfds."""
+    commands = [[[_ECHO, "a"], [_ECHO, "b"], [_ECHO, "c"]], [_CAT]]
+
+    with patch("deso.execute.execute_.pidfd_open", None):
+      for parallel in (False, True):
+        out = spring(commands, stdout=b"", parallel=parallel)
+        self.assertEqual(out, b"a\nb\nc\n")
+
+        with self.assertRaises(ProcessError):
+          spring([[[_ECHO, "a"], [_FALSE], [_ECHO, "b"]]], parallel=parallel)
+
+
+  def testParallelSpringReadOut(self):
+    """Verify that a parallel spring produces the same output as a serial one."""
+    texts = ["abc", "def", "ghi", "jkl", "mno", "pqr", "stu", "vwx", "yz"]
+    producers = [[_ECHO, text] for text in texts]
+    expected = ("\n".join(texts) + "\n").encode()
+
+    for pipe_cmds in ([], [[_CAT]], [[_TR, "a", "a"], [_CAT]]):
+      commands = [producers] + pipe_cmds
+      self.assertEqual(spring(commands, stdout=b"", parallel=True), expected)
+      self.assertIsNone(spring(commands, parallel=True))
+
+
+  def testParallelSpringOrder(self):
+    """Verify that the output of a parallel spring is ordered even if buffering is limited."""
+    def produce(delay, char):
+      """Create a command sleeping and producing a large amount of data."""
+      script = dedent("""\
+        from sys import stdout
+        from time import sleep
+        sleep({delay})
+        stdout.buffer.write(b"{char}" * 200000)
+      """).format(delay=delay, char=char)
+      return [executable, "-c", script]
+
+    # The first command is the slowest, so the output of all others
+    # would arrive before its.
+    commands = [
+      [produce(0.3, "a"), produce(0.1, "b"), produce(0, "c")],
+      [_CAT],
+    ]
+    expected = b"a" * 200000 + b"b" * 200000 + b"c" * 200000
+
+    for limit in (1, 4096, 1024 * 1024):
+      out = spring(commands, stdout=b"", parallel=True, limit=limit)
+      self.assertEqual(out, expected)
+
+
+  def testParallelSpringForwarding(self):
+    """Verify that forwarding works with and without splicing, for all kinds of sinks."""
+    data = b"0123456789" * 100000
+    expected = data * 3
+
+    def sinks():
+      """Yield file objects to use as sink, with and without O_APPEND."""
+      for mode in ("w+b", "a+b"):
+        with TemporaryFile(mode) as file_:
+          yield file_
+
+    with NamedTemporaryFile() as file_:
+      file_.write(data)
+      file_.flush()
+      producers = [[_CAT, file_.name]] * 3
+
+      for splice in (True, False):
+        with patch("deso.execute.execute_.splice", splice_ if splice else None):
+          for pipe_cmds in ([], [[_CAT]]):
+            out = spring([producers] + pipe_cmds, stdout=b"", parallel=True)
+            self.assertEqual(out, expected)
+
+          for sink in sinks():
+            spring([producers], stdout=sink.fileno(), parallel=True)
+            sink.seek(0)
+            self.assertEqual(sink.read(), expected)
+
+
+  def testParallelSpringError(self):
+    """Verify that a parallel spring reports failures like a serial one."""
+    fail = [executable, "-c", "exit(255)"]
+    commands = [[[_ECHO, "a"], fail, [_ECHO, "b"]]]
+    regex = r"^\[Status 255\] %s$" % escape(formatCommands(fail))
+
+    with self.assertRaisesRegex(ProcessError, regex):
+      spring(commands, parallel=True)
+
+    # The failure of the last command of a spring is attributed to the
+    # spring as a whole.
+    commands = [[[_ECHO, "a"], [_ECHO, "b"], fail], [_CAT]]
+    regex = r"^\[Status 255\] %s$" % escape(formatCommands([commands[0]]))
+
+    for parallel in (False, True):
+      with self.assertRaisesRegex(ProcessError, regex):
+        spring(commands, parallel=parallel)
+
+
+  def testParallelSpringErrorOutput(self):
+    """Verify that no output of commands after a failed one is forwarded."""
+    commands = [[[_ECHO, "a"], [_FALSE], [_ECHO, "b"]]]
+
+    with TemporaryFile() as file_:
+      with self.assertRaises(ProcessError):
+        spring(commands, stdout=file_.fileno(), parallel=True)
+
+      file_.seek(0)
+      self.assertEqual(file_.read(), b"a\n")
+
+
+  def testParallelSpringIter(self):
+    """Verify that the output of a parallel spring can be iterated over."""
+    commands = [[[_ECHO, "a"], [_ECHO, "b"], [_ECHO, "c"]], [_CAT]]
+    lines = list(springIter(commands, lines=True, parallel=True))
+    self.assertEqual(lines, ["a", "b", "c"])
+
+
   def testSpringWriteFileDescriptor(self):
     """Execute a spring and redirect the accumulated output into a file."""
     # It is important to disable buffering here, otherwise we might not
@@ -725,5 +1421,17 @@ class TestExecute(TestCase):
     self.assertTrue(stdout == b"PARENT\n", stdout)
 
 
+@skipIf(posix_spawn is None, "posix_spawn is not available")
+class TestForkExecute(TestExecute):
+  """A test case running all execution tests using fork & exec to start processes."""
+  FORK = True
+
+  def setUp(self):
+    """Force usage of fork & exec."""
+    spawn = patch("deso.execute.execute_._spawn", _spawnFork)
+    spawn.start()
+    self.addCleanup(spawn.stop)
+
+
 if __name__ == "__main__":
   main()
@@ -0,0 +1,111 @@
+# testExecutor.py
+
+#/***************************************************************************
+# *   Copyright (C) 2016 Daniel Mueller (deso@posteo.net)                   *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Test the reusable execution context."""
+
+from deso.execute import (
+  Executor,
+  findCommand,
+  ProcessError,
+)
+from os import (
+  environ,
+  listdir,
+)
+from unittest import (
+  TestCase,
+  main,
+)
+
+
+_CAT = findCommand("cat")
+_ECHO = findCommand("echo")
+_ENV = findCommand("env")
+_FALSE = findCommand("false")
+_TRUE = findCommand("true")
+
+
+class TestExecutor(TestCase):
+  """A test case for the Executor class."""
+  def testExecute(self):
+    """Verify that commands can be executed repeatedly."""
+    with Executor() as executor:
+      for i in range(8):
+        out, _ = executor.execute(_ECHO, str(i), stdout=b"")
+        self.assertEqual(out, b"%d\n" % i)
+
+      out, _ = executor.pipeline([[_ECHO, "test"], [_CAT]], stdout=b"")
+      self.assertEqual(out, b"test\n")
+
+      out, _ = executor.spring([[[_ECHO, "a"], [_ECHO, "b"]], [_CAT]], stdout=b"")
+      self.assertEqual(out, b"a\nb\n")
+
+
+  def testNoLeak(self):
+    """Verify that no file descriptors are leaked, also in case of failure."""
+    before = len(listdir("/proc/self/fd"))
+
+    with Executor() as executor:
+      executor.execute(_TRUE)
+      after = len(listdir("/proc/self/fd"))
+
+      for _ in range(4):
+        executor.execute(_TRUE, stdout=b"")
+        with self.assertRaises(ProcessError):
+          executor.pipeline([[_ECHO, "test"], [_FALSE]], stdout=b"")
+
+      # Nothing but the null device must be kept open.
+      self.assertEqual(len(listdir("/proc/self/fd")), after)
+      self.assertEqual(len(executor._poll.poll(0)), 0)
+
+    self.assertEqual(len(listdir("/proc/self/fd")), before)
+
+
+  def testEnvironment(self):
+    """Verify that the environment is captured upon creation."""
+    environ["DESO_EXECUTOR_TEST"] = "1"
+    try:
+      with Executor() as executor:
+        environ["DESO_EXECUTOR_TEST"] = "2"
+        out, _ = executor.execute(_ENV, stdout=b"")
+        self.assertIn(b"DESO_EXECUTOR_TEST=1\n", out)
+
+        out, _ = executor.execute(_ENV, env={"FOO": "bar"}, stdout=b"")
+        self.assertEqual(out, b"FOO=bar\n")
+    finally:
+      del environ["DESO_EXECUTOR_TEST"]
+
+    with Executor(env={"FOO": "baz"}) as executor:
+      out, _ = executor.execute(_ENV, stdout=b"")
+      self.assertEqual(out, b"FOO=baz\n")
+
+
+  def testFindCommand(self):
+    """Verify that commands are found and cached."""
+    with Executor() as executor:
+      self.assertEqual(executor.findCommand("true"), _TRUE)
+      self.assertIn("true", executor._commands)
+      self.assertEqual(executor.findCommand("true"), _TRUE)
+
+      with self.assertRaises(FileNotFoundError):
+        executor.findCommand("a-command-that-does-not-exist")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,147 @@
+# testMany.py
+
+#/***************************************************************************
+# *   Copyright (C) 2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Test concurrent execution of many commands."""
+
+from deso.execute import (
+  executeMany,
+  executeManyUnordered,
+  findCommand,
+  ProcessError,
+)
+from sys import (
+  executable,
+)
+from tempfile import (
+  mktemp,
+)
+from time import (
+  monotonic,
+)
+from unittest import (
+  TestCase,
+  main,
+)
+
+
+_TRUE = findCommand("true")
+_ECHO = findCommand("echo")
+_CAT = findCommand("cat")
+_SLEEP = findCommand("sleep")
+
+
+class TestMany(TestCase):
+  """A test case for the concurrent execution of many commands."""
+  def testExecuteManyOutput(self):
+    """Verify that results are reported in the order of the commands."""
+    commands = [[_ECHO, str(i)] for i in range(50)]
+    results = executeMany(commands, concurrency=8, stdout=b"", stderr=None)
+
+    self.assertEqual(results, [b"%d\n" % i for i in range(50)])
+
+
+  def testExecuteManyNoOutput(self):
+    """Verify that commands without any pipes to service are handled correctly."""
+    results = executeMany([[_TRUE]] * 10, concurrency=3, stderr=None)
+    self.assertEqual(results, [None] * 10)
+
+
+  def testExecuteManyInput(self):
+    """Verify that the same input data is supplied to each command."""
+    data = b"x" * 256 * 1024
+    results = executeMany([[_CAT]] * 4, stdin=data, stdout=b"", stderr=None)
+
+    self.assertEqual(results, [data] * 4)
+
+
+  def testExecuteManyErrors(self):
+    """Verify that failing commands are reported as ProcessError objects."""
+    path = mktemp()
+    commands = [
+      [_ECHO, "success"],
+      [_CAT, path],
+      [executable, "-c", "exit(42)"],
+    ]
+    results = executeMany(commands, stdout=b"")
+
+    self.assertEqual(results[0], (b"success\n", b""))
+    self.assertIsInstance(results[1], ProcessError)
+    self.assertRegex(results[1].stderr, r"No such file or directory")
+    self.assertIsInstance(results[2], ProcessError)
+    self.assertEqual(results[2].status, 42)
+
+
+  def testExecuteManyMissingCommand(self):
+    """Verify that a command that cannot be executed only fails itself."""
+    commands = [
+      [_ECHO, "a"],
+      [mktemp()],
+      [_ECHO, "b"],
+    ]
+    results = executeMany(commands, concurrency=1, stdout=b"", stderr=None)
+
+    self.assertEqual(results[0], b"a\n")
+    self.assertIsInstance(results[1], ProcessError)
+    self.assertEqual(results[1].name, commands[1][0])
+    self.assertEqual(results[2], b"b\n")
+
+
+  def testExecuteManyCompletionOrder(self):
+    """Verify that results are reported in the order in which commands finish."""
+    commands = [
+      [_SLEEP, "0.6"],
+      [_SLEEP, "0.3"],
+      [_SLEEP, "0"],
+    ]
+    results = executeManyUnordered(commands, concurrency=3, stderr=None)
+    indices = [index for index, _ in results]
+    self.assertEqual(indices, [2, 1, 0])
+
+
+  def testExecuteManyConcurrency(self):
+    """Verify that no more than the given number of commands run at a time."""
+    commands = [[_SLEEP, "0.3"]] * 4
+
+    start = monotonic()
+    executeMany(commands, concurrency=4)
+    self.assertLess(monotonic() - start, 0.9)
+
+    start = monotonic()
+    executeMany(commands, concurrency=2)
+    self.assertGreater(monotonic() - start, 0.6)
+
+
+  def testExecuteManyAbort(self):
+    """Verify that stopping the iteration early kills the remaining commands."""
+    commands = [
+      [_ECHO, "done"],
+      [_SLEEP, "10"],
+    ]
+    start = monotonic()
+    iterator = executeManyUnordered(commands, concurrency=2, stdout=b"",
+                                    stderr=None)
+    index, result = next(iterator)
+
+    self.assertEqual((index, result), (0, b"done\n"))
+    iterator.close()
+    self.assertLess(monotonic() - start, 5)
+
+
+if __name__ == "__main__":
+  main()
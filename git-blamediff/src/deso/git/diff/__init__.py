@@ -24,3 +24,18 @@ from .diff import (
   DiffFile,
   Parser,
 )
+from .entry import (
+  DiffEntry,
+)
+from .index import (
+  Index,
+)
+from .mapping import (
+  LineMap,
+)
+from .parallel import (
+  parseParallel,
+)
+from .table import (
+  HunkTable,
+)
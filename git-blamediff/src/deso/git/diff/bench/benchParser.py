@@ -0,0 +1,220 @@
+# benchParser.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Microbenchmarks for the diff parser.
+
+  The benchmarks run each of the available parser engines on a set of
+  synthetic diffs of varying shape as well as on the output of 'git log
+  -p' for a fixture repository. For every combination the throughput in
+  lines and MiB per second and the peak amount of memory allocated
+  during parsing are reported.
+"""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.execute import (
+  findCommand,
+)
+from deso.git.diff import (
+  Index,
+  Parser,
+  parseParallel,
+)
+from deso.git.repo import (
+  Repository,
+  write,
+)
+from random import (
+  Random,
+)
+from sys import (
+  argv,
+)
+from time import (
+  perf_counter,
+)
+from tracemalloc import (
+  get_traced_memory,
+  start as startTracing,
+  stop as stopTracing,
+)
+
+
+GIT = findCommand("git")
+MIB = 1024 * 1024
+
+
+def parseLines(lines, strict):
+  """Parse a diff split into lines."""
+  parser = Parser(strict=strict)
+  parser.parse(lines)
+  return parser
+
+
+def parseBuffer(buffer, strict):
+  """Parse a diff supplied as a buffer."""
+  parser = Parser(strict=strict)
+  parser.parseBuffer(buffer)
+  return parser
+
+
+# All engines we benchmark. Each engine is a function invoked with the
+# diff as bytes and as a list of decoded lines.
+ENGINES = [
+  ("lines/strict", lambda buffer, lines: parseLines(lines, True)),
+  ("lines", lambda buffer, lines: parseLines(lines, False)),
+  ("buffer/strict", lambda buffer, lines: parseBuffer(buffer, True)),
+  ("buffer", lambda buffer, lines: parseBuffer(buffer, False)),
+  ("index", lambda buffer, lines: Index(buffer)),
+  ("parallel", lambda buffer, lines: parseParallel(buffer)),
+]
+
+
+def generateDiff(files, hunks, size, length, seed=0):
+  """Generate a synthetic diff.
+
+    The diff contains the given number of files, each with the given
+    number of hunks. Each hunk contains 'size' lines of which roughly
+    a third is removed, added, and context, respectively. Lines are
+    'length' characters long.
+  """
+  random = Random(seed)
+  diff = bytearray()
+  text = b"x" * length
+
+  for i in range(files):
+    diff += b"diff --git file%d.c file%d.c\n" % (i, i)
+    diff += b"index 1bd3b05..3a4b3a4 100644\n"
+    diff += b"--- file%d.c\n+++ file%d.c\n" % (i, i)
+
+    line = 1
+    for _ in range(hunks):
+      kinds = [random.choice(b" -+") for _ in range(size)]
+      src = sum(1 for k in kinds if k != ord("+"))
+      dst = sum(1 for k in kinds if k != ord("-"))
+
+      diff += b"@@ -%d,%d +%d,%d @@\n" % (line, src, line, dst)
+      for kind in kinds:
+        diff.append(kind)
+        diff += text
+        diff += b"\n"
+
+      line += src + random.randrange(10, 100)
+
+  return bytes(diff)
+
+
+def generateLog(commits, files, seed=0):
+  """Create a fixture repository and retrieve the 'git log -p' output of it."""
+  random = Random(seed)
+
+  with Repository(GIT) as repo:
+    contents = [["line %d\n" % j for j in range(200)] for _ in range(files)]
+
+    for _ in range(commits):
+      for _ in range(random.randrange(1, files + 1)):
+        i = random.randrange(files)
+        content = contents[i]
+
+        for _ in range(random.randrange(1, 10)):
+          j = random.randrange(len(content))
+          if random.random() < 0.5:
+            content[j] = "changed %d\n" % random.randrange(1000)
+          else:
+            content.insert(j, "added %d\n" % random.randrange(1000))
+
+        write(repo, "file%d.txt" % i, data="".join(content))
+
+      repo.add("--all")
+      repo.commit()
+
+    # Note that we use a custom format without the (indented) commit
+    # message such that the line based engines can cope with the
+    # output.
+    out, _ = repo.log("-p", "--no-prefix", "--format=commit %H", stdout=b"")
+    return out
+
+
+def measure(engine, buffer, lines, repeat):
+  """Run an engine on a diff and determine its speed and memory usage."""
+  best = None
+  for _ in range(repeat):
+    start = perf_counter()
+    engine(buffer, lines)
+    elapsed = perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+
+  startTracing()
+  try:
+    engine(buffer, lines)
+    _, peak = get_traced_memory()
+  finally:
+    stopTracing()
+
+  return best, peak
+
+
+def scenarios(quick):
+  """Retrieve the list of (name, diff) pairs to benchmark."""
+  scale = 1 if quick else 10
+  yield "files", generateDiff(files=200 * scale, hunks=2, size=8, length=40)
+  yield "hunks", generateDiff(files=4, hunks=100 * scale, size=8, length=40)
+  yield "size", generateDiff(files=4, hunks=4, size=1000 * scale, length=40)
+  yield "length", generateDiff(files=10, hunks=10, size=8, length=200 * scale)
+  yield "git-log", generateLog(commits=20 * scale, files=10)
+
+
+def main(args):
+  """Run the parser benchmarks and print the results."""
+  parser = ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--quick", action="store_true",
+                      help="Use smaller diffs for a quick overview.")
+  parser.add_argument("--repeat", type=int, default=3,
+                      help="The number of runs of which the fastest is reported.")
+  parser.add_argument("--engine", action="append", default=None,
+                      help="Only run the given engine (may be repeated).")
+  namespace = parser.parse_args(args)
+
+  engines = [
+    (name, engine) for name, engine in ENGINES
+    if namespace.engine is None or name in namespace.engine
+  ]
+
+  row = "{:<10} {:<14} {:>8} {:>9} {:>14} {:>10} {:>12}"
+  print(row.format("scenario", "engine", "MiB", "lines", "lines/s", "MiB/s",
+                   "peak KiB"))
+
+  for name, buffer in scenarios(namespace.quick):
+    lines = buffer.decode("utf-8", "surrogateescape").splitlines()
+
+    for engine_name, engine in engines:
+      elapsed, peak = measure(engine, buffer, lines, namespace.repeat)
+      print(row.format(name, engine_name,
+                       "%.2f" % (len(buffer) / MIB),
+                       len(lines),
+                       "%.0f" % (len(lines) / elapsed),
+                       "%.1f" % (len(buffer) / MIB / elapsed),
+                       "%.0f" % (peak / 1024)))
+
+  return 0
+
+
+if __name__ == "__main__":
+  exit(main(argv[1:]))
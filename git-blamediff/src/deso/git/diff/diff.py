@@ -19,12 +19,20 @@
 
 """A module for parsing diffs."""
 
+from deso.git.diff.entry import (
+  DiffEntry,
+)
+from deso.git.diff.mapping import (
+  LineMap,
+)
+from deso.git.diff.table import (
+  DiffFile,
+  HunkTable,
+)
 from re import (
+  MULTILINE,
   compile as regex,
 )
-from collections import (
-  namedtuple,
-)
 
 
 _NUM_STRING = r"[0-9]"
@@ -47,9 +55,261 @@ _DIFF_DST_REGEX = regex(r"^\+\+\+{ws}{f}".format(ws=_WS_STRING, f=_FILE_STRING))
 _DIFF_HEAD_LINE = r"^@@ {a}{nl}(?:,{nl})? {a}{nl}(?:,{nl})? @@"
 _DIFF_HEAD_REGEX = regex(_DIFF_HEAD_LINE.format(a=_ADDSUB_STRING,
                                                 nl=_NUMLINE_STRING))
+# git emits a couple of additional lines in front of the file headers.
+# They contain information about file modes, renames, and copies, for
+# example, and are the only content for entries that do not change the
+# contents of a file.
+_GIT_DIFF_REGEX = regex(r"^diff --git {f} {f}".format(f=_FILE_STRING))
+_GIT_EXTENDED_REGEX = regex(r"^(old mode|new mode|deleted file mode|"
+                            r"new file mode|similarity index|"
+                            r"dissimilarity index|rename from|rename to|"
+                            r"copy from|copy to|index) (.*)$")
+_GIT_BINARY_REGEX = regex(r"^Binary files .* differ$")
+_GIT_BINARY_PATCH = "GIT binary patch"
+_GIT_DIFF_PREFIX = "diff --git "
+# When scanning an entire buffer at once we are only interested in file
+# and hunk headers as well as all lines that cannot be part of a hunk
+# body (such as git's "diff --git" or "index" lines). All other lines
+# are skipped by the regular expression engine directly, without ever
+# being converted into a Python object.
+_DIFF_SCAN_REGEX = regex(rb"^(?:---|\+\+\+|@@|[^+\- \\\n])[^\n]*",
+                         MULTILINE)
+_DIFF_EOL_REGEX = regex(rb"\n")
+# A single (possibly empty) line of a hunk body.
+_BODY_LINE = rb"(?:[ +\-\\][^\n]*)?\n"
+# Compiled regular expressions matching 2^n body lines, keyed by n.
+_BODY_RUN_REGEXES = {}
+# Any number of body lines.
+_BODY_REGEX = regex(rb"(?:%s)*" % _BODY_LINE)
+_GIT_DIFF_SCAN_REGEX = regex(rb"^diff --git ", MULTILINE)
+# Variants of the header regular expressions working on bytes.
+_DIFF_SRC_BYTES_REGEX = regex(_DIFF_SRC_REGEX.pattern.encode())
+_DIFF_DST_BYTES_REGEX = regex(_DIFF_DST_REGEX.pattern.encode())
+_DIFF_HEAD_BYTES_REGEX = regex(_DIFF_HEAD_REGEX.pattern.encode())
+# A mapping from the first character of a line in a hunk body to the
+# number of source and destination lines it accounts for. Note that we
+# support both lines (i.e., strings) as well as bytes-like buffers (in
+# which case indexing yields an int). Empty lines are treated as
+# context lines, as some tools strip the trailing whitespace of the
+# latter.
+_BODY_LINES = {
+  " ": (1, 1),
+  "-": (1, 0),
+  "+": (0, 1),
+  "\\": (0, 0),
+  "\n": (1, 1),
+  "": (1, 1),
+  ord(" "): (1, 1),
+  ord("-"): (1, 0),
+  ord("+"): (0, 1),
+  ord("\\"): (0, 0),
+  ord("\n"): (1, 1),
+}
+
+
+def _bodyRun(exponent):
+  """Retrieve a regular expression matching exactly 2^exponent body lines."""
+  run = _BODY_RUN_REGEXES.get(exponent)
+  if run is None:
+    run = regex(rb"(?:%s){%d}" % (_BODY_LINE, 1 << exponent))
+    _BODY_RUN_REGEXES[exponent] = run
+
+  return run
+
+
+def decode(line):
+  """Decode a line of a diff read as bytes.
+
+    A diff is not guaranteed to be valid UTF-8: file names as well as
+    file contents can contain arbitrary bytes. We use the
+    'surrogateescape' error handler such that undecodable bytes survive
+    the round trip, e.g., when a file name is handed back to git.
+  """
+  return bytes(line).decode("utf-8", "surrogateescape")
+
+
+class Body:
+  """A class keeping track of the lines of a hunk body still to come."""
+  def __init__(self, src_count, dst_count, mapping=None,
+               src_line=0, dst_line=0):
+    """Create a new Body object expecting the given number of lines.
+
+      If a LineMap object is supplied, the body records the segments of
+      unchanged and changed lines it encounters in it. In this case the
+      line numbers the hunk starts at on both sides are required as
+      well.
+    """
+    self._src = src_count
+    self._dst = dst_count
+    self._mapping = mapping
+    # Note that a count of zero indicates that the hunk is located
+    # after the given line.
+    self._old = src_line if src_count else src_line + 1
+    self._new = dst_line if dst_count else dst_line + 1
+    self._context = None
+
+
+  def consume(self, first):
+    """Try accounting for a line starting with the given character.
+
+      The character can either be a string (possibly empty) or an int
+      as retrieved by indexing a bytes-like object. The function returns
+      False if the line is not part of the body.
+    """
+    try:
+      src, dst = _BODY_LINES[first]
+    except KeyError:
+      return False
+
+    # Only lines fitting in the remaining line counts can be part of
+    # the body. Once all lines are accounted for, only the "continuation"
+    # character may follow (to indicate a missing newline at the end of
+    # the file).
+    if src > self._src or dst > self._dst:
+      return False
+
+    if not src and not dst:
+      return True
+
+    self._src -= src
+    self._dst -= dst
+
+    if self._mapping is not None:
+      self._track(src, dst)
+
+    return True
+
+
+  def _track(self, src, dst):
+    """Record a line of the body in our line mapping."""
+    # Only context lines are present on both sides.
+    context = bool(src and dst)
+    if context != self._context:
+      self._mapping.add(self._old, self._new, context)
+      self._context = context
+
+    self._old += src
+    self._new += dst
+
+    # After the last line of the body the remaining lines of the file
+    # are unchanged again.
+    if not self._src and not self._dst:
+      self._mapping.add(self._old, self._new, True)
+
+
+  def _remaining(self, buffer, start, end):
+    """Determine the line counts left after the body lines in a range.
+
+      The range has to consist of complete body lines only. The function
+      returns the remaining source and destination line counts, either
+      of which may be negative if the range exceeds the body.
+    """
+    # All lines that are not removed, added, or ignored are context
+    # lines. We include the line break preceding the first line, so that
+    # the start of each line is marked by one.
+    lines = bytes(buffer[start - 1:end])
+    count = lines.count(b"\n") - 1
+    removed = lines.count(b"\n-")
+    added = lines.count(b"\n+")
+    context = count - removed - added - lines.count(b"\n\\")
+    return self._src - context - removed, self._dst - context - added
+
+
+  def _skipAll(self, buffer, pos):
+    """Skip all lines of the body in a single go.
+
+      The function returns the position after the body or None if the
+      lines looking like body lines do not add up to the line counts.
+    """
+    # In the common case the body is followed by a line that cannot be
+    # part of it (a hunk header or git's "diff --git" line, for
+    # example). So the longest run of body lines is the body.
+    end = _BODY_REGEX.match(buffer, pos).end()
+    if end == pos:
+      return None
+
+    src, dst = self._remaining(buffer, pos, end)
+    if src or dst:
+      return None
+
+    self._src = src
+    self._dst = dst
+    return end
+
+
+  def _skipRun(self, buffer, pos, count):
+    """Skip exactly 'count' lines of the body in a single go.
+
+      The function returns the position after the lines or None if they
+      cannot all be part of the body.
+    """
+    end = pos
+    remaining = count
+
+    # Matching the lines is left to the regular expression engine. We
+    # use runs with a power of two lines in order to get by with only a
+    # handful of compiled regular expressions.
+    while remaining:
+      exponent = remaining.bit_length() - 1
+      match = _bodyRun(exponent).match(buffer, end)
+      if match is None:
+        return None
+
+      end = match.end()
+      remaining -= 1 << exponent
+
+    src, dst = self._remaining(buffer, pos, end)
+    # If the line counts are exceeded the body ends somewhere within the
+    # lines and we have to look at them one by one.
+    if src < 0 or dst < 0:
+      return None
+
+    self._src = src
+    self._dst = dst
+    return end
+
+
+  def skip(self, buffer, pos):
+    """Skip the body in a bytes-like buffer, starting at the given position.
+
+      The position has to be at the start of a line (and not at the
+      start of the buffer). The function
+      returns the position of the first line after the body.
+    """
+    size = len(buffer)
 
+    # Unless we have to track each line for a mapping, we first try
+    # skipping the entire body at once. If that fails (because the body
+    # is followed by a file header as used by plain diffs, for example)
+    # we make use of the fact that the body spans at least as many lines
+    # as the larger of the two counts and skip that many lines at once
+    # until all lines are accounted for.
+    if self._mapping is None:
+      end = self._skipAll(buffer, pos)
+      if end is not None:
+        return end
 
-DiffFile = namedtuple("DiffFile", ["file", "add_sub", "line", "count"])
+      count = max(self._src, self._dst)
+      while count:
+        end = self._skipRun(buffer, pos, count)
+        if end is None:
+          break
+
+        pos = end
+        count = max(self._src, self._dst)
+
+    # Remaining lines (including lines following the body that only
+    # indicate a missing newline at the end of the file) are handled
+    # individually.
+
+    while pos < size and self.consume(buffer[pos]):
+      match = _DIFF_EOL_REGEX.search(buffer, pos)
+      if match is None:
+        return size
+
+      pos = match.end()
+
+    return pos
 
 
 class State:
@@ -91,6 +351,49 @@ class State:
     return self._parser
 
 
+def parseGit(state, line):
+  """Try parsing a line starting a new file in a diff emitted by git."""
+  m = _GIT_DIFF_REGEX.match(line)
+  if m is not None:
+    src, dst = m.groups()
+    state.parser.addEntry(src, dst)
+    return True
+  else:
+    return False
+
+
+def parseExtended(state, line):
+  """Try parsing one of git's extended header lines."""
+  m = _GIT_EXTENDED_REGEX.match(line)
+  if m is not None:
+    entry = state.parser.entry
+    if entry is not None:
+      key, value = m.groups()
+      entry.addHeader(key, value)
+    return True
+  else:
+    return False
+
+
+def parseBinary(state, line):
+  """Try parsing a line indicating that a file is binary."""
+  binary = _GIT_BINARY_REGEX.match(line) is not None
+  patch = line == _GIT_BINARY_PATCH
+
+  if binary or patch:
+    entry = state.parser.entry
+    if entry is not None:
+      entry.binary = True
+
+    # A binary patch contains the encoded data of the file directly,
+    # and it is of no interest to us.
+    if patch:
+      state.parser.skipEntry()
+    return True
+  else:
+    return False
+
+
 def parseSrc(state, line):
   """Try parsing a line containing the source file."""
   m = _DIFF_SRC_REGEX.match(line)
@@ -108,26 +411,52 @@ def parseDst(state, line):
   if m is not None:
     dst, = m.groups()
     state.parser.advance(dstState(state.parser, state.src, dst))
+    state.parser.addFile(state.src, dst)
     return True
   else:
     return False
 
 
+def parseHunk(line, src_file, dst_file):
+  """Parse a hunk header into a pair of DiffFile objects.
+
+    None is returned if the given line is not a hunk header.
+  """
+  m = _DIFF_HEAD_REGEX.match(line)
+  if m is None:
+    return None
+
+  # Because a diff header might not contain counts if only a single
+  # line is affected, we supply the default "1" to the groups method.
+  add_src, start_src, count_src,\
+  add_dst, start_dst, count_dst = m.groups(default="1")
+
+  src = DiffFile(src_file, add_src, int(start_src), int(count_src))
+  dst = DiffFile(dst_file, add_dst, int(start_dst), int(count_dst))
+  return src, dst
+
+
 def parseHead(state, line):
   """Try parsing a line containg information about the changed lines."""
-  m = _DIFF_HEAD_REGEX.match(line)
-  if m is not None:
-    # Because a diff header might not contain counts if only a single
-    # line is affected, we supply the default "1" to the groups method.
-    add_src, start_src, count_src,\
-    add_dst, start_dst, count_dst = m.groups(default="1")
+  diff = parseHunk(line, state.src, state.dst)
+  if diff is not None:
+    src, dst = diff
+    parser = state.parser
+    parser.addDiff(diff)
+    body = Body(src.count, dst.count, parser.mapping, src.line, dst.line)
+    parser.enterBody(body)
+    return True
+  else:
+    return False
 
-    src = DiffFile(state.src, add_src, int(start_src), int(count_src))
-    dst = DiffFile(state.dst, add_dst, int(start_dst), int(count_dst))
+
+def parseFirstHead(state, line):
+  """Try parsing the first line containing information about changed lines of a file."""
+  if parseHead(state, line):
+    # Subsequent hunks are parsed in the header state, which we only
+    # have to enter once per file.
     header = headerState(state.parser, state.src, state.dst)
     state.parser.advance(header)
-    diff = (src, dst)
-    state.parser.addDiff(diff)
     return True
   else:
     return False
@@ -146,7 +475,11 @@ def matchDiff(state, line):
 def restart(state, line):
   """Try matching a line not from an actual diff that indicates the start of a new file."""
   if _DIFF_NODIFF_REGEX.match(line):
-    state.parser.advance(startState(state.parser))
+    start = startState(state.parser)
+    state.parser.advance(start)
+    # The line itself could already be part of the header of the new
+    # file.
+    start.parse(line)
     return True
   else:
     return False
@@ -154,7 +487,8 @@ def restart(state, line):
 
 def startState(parser):
   """Retrieve the state to enter when we expect a new file to start."""
-  return State(parser, [parseSrc, matchNoDiff])
+  functions = [parseGit, parseExtended, parseBinary, parseSrc, matchNoDiff]
+  return State(parser, functions)
 
 
 def srcState(parser, src):
@@ -164,25 +498,68 @@ def srcState(parser, src):
 
 def dstState(parser, src, dst):
   """Retrieve the state to enter after we parsed the destination file header part."""
-  return State(parser, [parseHead], src=src, dst=dst)
+  return State(parser, [parseFirstHead], src=src, dst=dst)
 
 
 def headerState(parser, src, dst):
   """Retrieve the state to enter after we parsed the entire header."""
-  return State(parser, [matchDiff, parseHead, restart], src=src, dst=dst)
+  if parser.strict:
+    return State(parser, [matchDiff, parseHead, restart], src=src, dst=dst)
+  else:
+    # If we are not in strict mode the hunk body has already been
+    # skipped by the time we are asked to parse a line. So the line may
+    # very well be the start of a new file, even if there was no
+    # non-diff line in between.
+    functions = [parseHead, parseSrc, restart, matchDiff]
+    return State(parser, functions, src=src, dst=dst)
 
 
 class Parser:
-  """The parser class interpretes a diff and extracts relevant information."""
-  def __init__(self):
+  """The parser class interpretes a diff and extracts relevant information.
+
+    By default the parser uses the line counts contained in a hunk
+    header to skip over the body of the hunk, only looking at the first
+    character of each line. In strict mode, each line of a hunk body is
+    validated by the full set of parsing functions instead.
+
+    Mapping line numbers between the two sides of a file requires
+    looking at each line of a hunk body. Hence, LineMap objects are
+    only created if explicitly requested.
+  """
+  def __init__(self, strict=False, mappings=False):
     """Create a new Parser object ready for diff parsing."""
+    self._strict = strict
+    self._mappings_enabled = mappings
     self._state = startState(self)
-    self._diffs = []
+    self._body = None
+    self._diffs = HunkTable()
+    self._skip = False
+    self._entry = None
+    self._file_entry = None
+    self._entries = []
+    self._mapping = None
+    self._mappings = []
+    self._mappings_by_file = {}
 
 
   def parse(self, lines):
     """Parse the given diff and extract the relevant information."""
     for line in lines:
+      if self._skip:
+        if not line.startswith(_GIT_DIFF_PREFIX):
+          continue
+
+        self._skip = False
+
+      if self._body is not None:
+        if self._body.consume(line[:1]):
+          # In strict mode the line is validated by the current state
+          # nevertheless.
+          if not self._strict:
+            continue
+        else:
+          self._body = None
+
       # We simply ignore any empty lines and do not even hand them into
       # the state for further consideration because they cannot change
       # anything.
@@ -191,6 +568,41 @@ class Parser:
         self._state.parse(line[:-1] if line[-1] == "\n" else line)
 
 
+  def parseBuffer(self, buffer):
+    """Parse the given diff supplied as a bytes-like object.
+
+      The buffer can be a bytes object, a memoryview, or an mmap'ed
+      file, for example. As opposed to the parse method, we do not
+      require the diff to be split into lines or to be decoded.
+      Instead, we scan the entire buffer for lines of interest and only
+      decode those. Hunk bodies are skipped without creating a Python
+      object for each of their lines.
+    """
+    if self._strict:
+      # In strict mode we have to look at every line anyway.
+      self.parse(map(decode, bytes(buffer).split(b"\n")))
+      return
+
+    pos = 0
+    while True:
+      match = _DIFF_SCAN_REGEX.search(buffer, pos)
+      if match is None:
+        break
+
+      self._state.parse(decode(match.group()))
+      pos = match.end()
+
+      if self._skip:
+        match = _GIT_DIFF_SCAN_REGEX.search(buffer, pos)
+        pos = match.start() if match is not None else len(buffer)
+        self._skip = False
+        continue
+
+      if self._body is not None:
+        pos = self._body.skip(buffer, pos + 1)
+        self._body = None
+
+
   def advance(self, state):
     """Advance the parsers state."""
     self._state = state
@@ -199,6 +611,97 @@ class Parser:
   def addDiff(self, diff):
     """Add a found diff to the list of all diffs."""
     self._diffs.append(diff)
+    if self._entry is not None:
+      self._entry.addHunk()
+
+
+  def addEntry(self, src, dst):
+    """Register a new file entry in a diff emitted by git."""
+    self._entry = DiffEntry(src, dst, len(self._diffs))
+    self._entries.append(self._entry)
+
+
+  def addFile(self, src, dst):
+    """Register the start of a new file in the diff."""
+    # If the current entry has already seen its file headers (or if
+    # there is no entry at all, as is the case for diffs not emitted by
+    # git) we start a new entry.
+    if self._entry is None or self._entry is self._file_entry:
+      self.addEntry(src, dst)
+
+    self._file_entry = self._entry
+    self._entry.setFiles(src, dst)
+
+    if not self._mappings_enabled:
+      return
+
+    self._mapping = LineMap(src, dst)
+    self._mappings.append(self._mapping)
+    self._entry.mapping = self._mapping
+
+    for file_ in (src, dst):
+      if file_ != "/dev/null":
+        self._mappings_by_file[file_] = self._mapping
+
+
+  def skipEntry(self):
+    """Skip all lines up to the start of the next file entry."""
+    self._skip = True
+
+
+  def enterBody(self, body):
+    """Account for the lines of a hunk body following the current line.
+
+      Unless in strict mode, these lines are skipped without further
+      validation.
+    """
+    self._body = body
+
+
+  def lineMap(self, file_):
+    """Retrieve the LineMap for the file with the given name.
+
+      If the file is contained in the diff multiple times, the mapping
+      of its last occurrence is returned. None is returned if the file
+      is not part of the diff or if mappings are not enabled.
+    """
+    return self._mappings_by_file.get(file_)
+
+
+  @property
+  def entry(self):
+    """Retrieve the file entry currently being parsed."""
+    return self._entry
+
+
+  @property
+  def entries(self):
+    """Retrieve the DiffEntry objects of all files in the diff."""
+    return self._entries
+
+
+  @property
+  def mapping(self):
+    """Retrieve the LineMap of the file currently being parsed."""
+    return self._mapping
+
+
+  @property
+  def lineMaps(self):
+    """Retrieve the LineMap objects of all files in the diff."""
+    return self._mappings
+
+
+  @property
+  def mappings(self):
+    """Check whether the parser creates LineMap objects."""
+    return self._mappings_enabled
+
+
+  @property
+  def strict(self):
+    """Check whether the parser validates each line of a hunk body."""
+    return self._strict
 
 
   @property
@@ -0,0 +1,129 @@
+# entry.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""A module providing meta data about the files contained in a diff."""
+
+
+NULL = "/dev/null"
+
+MODIFIED = "modified"
+NEW = "new"
+DELETED = "deleted"
+RENAMED = "renamed"
+COPIED = "copied"
+
+
+class DiffEntry:
+  """A class representing a single file in a diff.
+
+    Aside from the names of the source and destination file, an entry
+    contains the information found in git's extended header lines, if
+    any. It also references the range of hunks belonging to the file.
+  """
+  def __init__(self, src, dst, first):
+    """Create a new entry for the given files, with hunks starting at 'first'."""
+    self.src = src
+    self.dst = dst
+    self.status = MODIFIED
+    self.binary = False
+    self.old_mode = None
+    self.new_mode = None
+    self.similarity = None
+    self.mapping = None
+    self._first = first
+    self._count = 0
+    self._update()
+
+
+  def _update(self):
+    """Update the status of the entry based on the file names."""
+    if self.status == MODIFIED:
+      if self.src == NULL:
+        self.status = NEW
+      elif self.dst == NULL:
+        self.status = DELETED
+
+
+  def setFiles(self, src, dst):
+    """Set the source and destination file names as found in the file headers."""
+    self.src = src
+    self.dst = dst
+    self._update()
+
+
+  def addHeader(self, key, value):
+    """Account for an extended header line."""
+    if key == "new file mode":
+      self.status = NEW
+      self.new_mode = value
+    elif key == "deleted file mode":
+      self.status = DELETED
+      self.old_mode = value
+    elif key == "old mode":
+      self.old_mode = value
+    elif key == "new mode":
+      self.new_mode = value
+    elif key in ("rename from", "copy from"):
+      self.src = value
+    elif key in ("rename to", "copy to"):
+      self.dst = value
+    elif key == "similarity index":
+      self.similarity = int(value.rstrip("%"))
+
+    if key.startswith("rename "):
+      self.status = RENAMED
+    elif key.startswith("copy "):
+      self.status = COPIED
+
+
+  def addHunk(self):
+    """Account for a hunk belonging to the entry."""
+    self._count += 1
+
+
+  def __repr__(self):
+    """Convert the entry into a string."""
+    return "DiffEntry(%r, %r, status=%r, binary=%r)" % (
+      self.src, self.dst, self.status, self.binary
+    )
+
+
+  @property
+  def hunks(self):
+    """Retrieve a slice selecting the entry's hunks out of a parser's diffs."""
+    return slice(self._first, self._first + self._count)
+
+
+  @property
+  def renameOnly(self):
+    """Check whether the entry only renames or copies a file without changing it."""
+    return self.status in (RENAMED, COPIED) and not self.binary and not self._count
+
+
+  @property
+  def modeOnly(self):
+    """Check whether the entry only changes the mode of a file."""
+    return self.status == MODIFIED and not self.binary and not self._count and\
+           self.old_mode != self.new_mode
+
+
+  @property
+  def needsBlame(self):
+    """Check whether the entry contains lines of a previous state to annotate."""
+    return not self.binary and self.status != NEW and self._count > 0
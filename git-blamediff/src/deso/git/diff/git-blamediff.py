@@ -22,6 +22,10 @@
 from deso.git.diff import (
   Parser,
 )
+from mmap import (
+  ACCESS_READ,
+  mmap,
+)
 from subprocess import (
   call,
 )
@@ -55,12 +59,32 @@ def blame(diffs, args=None):
     call(cmd.split())
 
 
+def readDiff(file_):
+  """Retrieve the contents of a file as a bytes-like object."""
+  try:
+    # If our input is a regular file we can just map it into memory
+    # instead of reading it.
+    return mmap(file_.fileno(), 0, access=ACCESS_READ)
+  except (OSError, ValueError):
+    # Pipes (the common case) cannot be mapped and neither can empty
+    # files.
+    return file_.buffer.read()
+
+
 def main(args):
   """Parse the diff from stdin and invoke git blame on each hunk."""
   parser = Parser()
-  parser.parse(stdin.readlines())
+  parser.parseBuffer(readDiff(stdin))
 
-  blame(parser.diffs, args)
+  # Binary files, newly added files, and entries only changing meta
+  # data (such as renames or mode changes) contain no lines to
+  # annotate.
+  diffs = [
+    diff
+    for entry in parser.entries if entry.needsBlame
+    for diff in parser.diffs[entry.hunks]
+  ]
+  blame(diffs, args)
   return 0
 
 
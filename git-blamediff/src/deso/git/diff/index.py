@@ -0,0 +1,319 @@
+# index.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""A module providing random access to the hunks of a diff.
+
+  An index is created by scanning a diff once, recording the byte offsets
+  of all file and hunk headers. Hunks are only decoded when accessed.
+  An index can be saved alongside the diff it belongs to and be loaded
+  again later on, without the need for another scan.
+"""
+
+from array import (
+  array,
+)
+from deso.git.diff.diff import (
+  Body,
+  _DIFF_DST_BYTES_REGEX,
+  _DIFF_EOL_REGEX,
+  _DIFF_HEAD_BYTES_REGEX,
+  _DIFF_SCAN_REGEX,
+  _DIFF_SRC_BYTES_REGEX,
+  decode,
+  parseHunk,
+)
+from mmap import (
+  ACCESS_READ,
+  mmap,
+)
+from os import (
+  fstat,
+)
+from struct import (
+  Struct,
+)
+from sys import (
+  byteorder,
+)
+
+
+# The header of a saved index: a magic value, the byte order the index
+# was written in, the size and modification time of the diff file, the
+# number of files and hunks, and the size of the file name table.
+_INDEX_MAGIC = b"DIFFIDX2"
+_INDEX_HEADER = Struct("=8s8sQqQQQ")
+# The suffix we append to the path of a diff to get the path of the
+# index belonging to it.
+INDEX_SUFFIX = ".idx"
+
+
+class Index:
+  """A lazily decoded index over the hunks of a diff.
+
+    An index behaves like a read-only sequence of the (src, dst) pairs
+    of DiffFile objects a Parser would produce for the same diff.
+  """
+  def __init__(self, buffer, stat=None):
+    """Create an index by scanning the given bytes-like buffer."""
+    self._buffer = buffer
+    self._stat = stat
+    # Each file is represented by its source and destination name (as
+    # bytes), the offset of its '---' line, and the range of its hunks
+    # (which are always contiguous).
+    self._names = []
+    self._file_offsets = array("Q")
+    self._file_firsts = array("Q")
+    self._file_ends = array("Q")
+    # A mapping from file names (as bytes) to the sorted list of files
+    # using them as source or destination name.
+    self._file_ids = {}
+    # Each hunk is represented by the offset of its header, the offset
+    # just past its body, and the file it belongs to.
+    self._hunk_offsets = array("Q")
+    self._hunk_ends = array("Q")
+    self._hunk_files = array("I")
+    # Decoded file names, created on demand.
+    self._files = {}
+
+    if buffer is not None:
+      self._scan(buffer)
+
+
+  def _scan(self, buffer):
+    """Scan a buffer for file and hunk headers."""
+    pos = 0
+    src = None
+    file_ = None
+
+    while True:
+      match = _DIFF_SCAN_REGEX.search(buffer, pos)
+      if match is None:
+        break
+
+      line = match.group()
+      pos = match.end()
+
+      m = _DIFF_HEAD_BYTES_REGEX.match(line)
+      if m is not None:
+        if file_ is None:
+          continue
+
+        _, _, count_src, _, _, count_dst = m.groups(default=b"1")
+        body = Body(int(count_src), int(count_dst))
+        start = match.start()
+        pos = body.skip(buffer, pos + 1)
+
+        self._hunk_offsets.append(start)
+        self._hunk_ends.append(min(pos, len(buffer)))
+        self._hunk_files.append(file_)
+        self._file_ends[file_] = len(self._hunk_offsets)
+        continue
+
+      m = _DIFF_SRC_BYTES_REGEX.match(line)
+      if m is not None:
+        src = (match.start(), m.group(1))
+        file_ = None
+        continue
+
+      m = _DIFF_DST_BYTES_REGEX.match(line)
+      if m is not None and src is not None:
+        offset, src_name = src
+        self._names.append((src_name, m.group(1)))
+        self._file_offsets.append(offset)
+        self._file_firsts.append(len(self._hunk_offsets))
+        self._file_ends.append(len(self._hunk_offsets))
+        file_ = len(self._names) - 1
+        src = None
+        continue
+
+      # Any other line ends the current file.
+      src = None
+      file_ = None
+
+    self._mapNames()
+
+
+  def _mapNames(self):
+    """Create the mapping from file names to the files using them."""
+    for i, names in enumerate(self._names):
+      for name in set(names):
+        self._file_ids.setdefault(name, []).append(i)
+
+
+  @classmethod
+  def open(cls, path, save=True):
+    """Create an index for the diff stored in the file at the given path.
+
+      If an up-to-date index was saved next to the diff previously, it
+      is loaded instead of scanning the diff. Otherwise the diff is
+      scanned and, if 'save' is True, the resulting index is saved for
+      later use.
+    """
+    with open(path, "rb") as file_:
+      stat = fstat(file_.fileno())
+      try:
+        buffer = mmap(file_.fileno(), 0, access=ACCESS_READ)
+      except ValueError:
+        # Empty files cannot be mapped.
+        buffer = b""
+
+    try:
+      return cls.load(path + INDEX_SUFFIX, buffer, stat)
+    except (OSError, ValueError):
+      pass
+
+    index = cls(buffer, stat)
+    if save:
+      try:
+        index.save(path + INDEX_SUFFIX)
+      except OSError:
+        # The saved index is merely a cache. Not being able to write it,
+        # e.g., because the diff is located in a read-only directory,
+        # does not affect the index we got.
+        pass
+    return index
+
+
+  @classmethod
+  def load(cls, path, buffer, stat=None):
+    """Load an index previously saved to the given path.
+
+      The index has to belong to the given buffer, which is checked
+      by comparing the sizes and, if a stat result of the diff file is
+      supplied, the modification times. A ValueError is raised if the
+      index is out of date or corrupt.
+    """
+    with open(path, "rb") as file_:
+      header = file_.read(_INDEX_HEADER.size)
+      if len(header) != _INDEX_HEADER.size:
+        raise ValueError("Index file %s is corrupt" % path)
+
+      magic, order, size, mtime, files, hunks, names = _INDEX_HEADER.unpack(header)
+      if magic != _INDEX_MAGIC or order.rstrip(b"\0").decode() != byteorder:
+        raise ValueError("Index file %s has an unsupported format" % path)
+
+      if size != len(buffer) or (stat is not None and mtime != stat.st_mtime_ns):
+        raise ValueError("Index file %s is out of date" % path)
+
+      index = cls(None, stat)
+      index._buffer = buffer
+
+      try:
+        index._file_offsets.fromfile(file_, files)
+        index._file_firsts.fromfile(file_, files)
+        index._file_ends.fromfile(file_, files)
+        index._hunk_offsets.fromfile(file_, hunks)
+        index._hunk_ends.fromfile(file_, hunks)
+        index._hunk_files.fromfile(file_, hunks)
+      except EOFError:
+        raise ValueError("Index file %s is corrupt" % path)
+
+      table = file_.read(names).split(b"\0")
+      if len(table) != 2 * files + 1:
+        raise ValueError("Index file %s is corrupt" % path)
+
+      index._names = list(zip(table[0:-1:2], table[1:-1:2]))
+      index._mapNames()
+      return index
+
+
+  def save(self, path):
+    """Save the index to the given path."""
+    table = b"".join(src + b"\0" + dst + b"\0" for src, dst in self._names)
+    mtime = self._stat.st_mtime_ns if self._stat is not None else 0
+    header = _INDEX_HEADER.pack(_INDEX_MAGIC, byteorder.encode(),
+                                len(self._buffer), mtime,
+                                len(self._names), len(self._hunk_offsets),
+                                len(table))
+
+    with open(path, "wb") as file_:
+      file_.write(header)
+      self._file_offsets.tofile(file_)
+      self._file_firsts.tofile(file_)
+      self._file_ends.tofile(file_)
+      self._hunk_offsets.tofile(file_)
+      self._hunk_ends.tofile(file_)
+      self._hunk_files.tofile(file_)
+      file_.write(table)
+
+
+  def _file(self, index):
+    """Retrieve the decoded source and destination name of a file."""
+    names = self._files.get(index)
+    if names is None:
+      src, dst = self._names[index]
+      names = decode(src), decode(dst)
+      self._files[index] = names
+
+    return names
+
+
+  def _decode(self, index):
+    """Decode the hunk with the given index."""
+    start = self._hunk_offsets[index]
+    match = _DIFF_EOL_REGEX.search(self._buffer, start)
+    end = match.start() if match is not None else len(self._buffer)
+
+    src, dst = self._file(self._hunk_files[index])
+    return parseHunk(decode(self._buffer[start:end]), src, dst)
+
+
+  def __len__(self):
+    """Retrieve the number of hunks in the diff."""
+    return len(self._hunk_offsets)
+
+
+  def __getitem__(self, index):
+    """Retrieve a hunk or a list of hunks for a slice."""
+    if isinstance(index, slice):
+      return [self._decode(i) for i in range(*index.indices(len(self)))]
+
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError("hunk index out of range")
+
+    return self._decode(index)
+
+
+  def body(self, index):
+    """Retrieve the raw bytes of a hunk, including its header."""
+    start = self._hunk_offsets[index]
+    end = self._hunk_ends[index]
+    return memoryview(self._buffer)[start:end]
+
+
+  def lookup(self, file_):
+    """Retrieve all hunks of the file with the given name.
+
+      The name is matched against both the source and the destination
+      file name.
+    """
+    name = file_.encode("utf-8", "surrogateescape")
+    return [
+      self._decode(i)
+      for id_ in self._file_ids.get(name, [])
+      for i in range(self._file_firsts[id_], self._file_ends[id_])
+    ]
+
+
+  @property
+  def files(self):
+    """Retrieve a list of (src, dst) file name pairs of all files in the diff."""
+    return [self._file(i) for i in range(len(self._names))]
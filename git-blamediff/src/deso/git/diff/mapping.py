@@ -0,0 +1,124 @@
+# mapping.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""A module for mapping line numbers between the two sides of a diff."""
+
+from array import (
+  array,
+)
+from bisect import (
+  bisect_right,
+)
+
+
+class LineMap:
+  """A mapping between the old and the new line numbers of a file.
+
+    The mapping is represented by a sorted list of anchors. Each anchor
+    marks the start of a segment of lines on both sides of the diff.
+    Lines in a mapped segment correspond to each other one-to-one (they
+    are unchanged), while lines in an unmapped segment were removed or
+    added, respectively, and have no counterpart on the other side.
+  """
+  def __init__(self, src, dst):
+    """Create an identity mapping for the given source and destination file."""
+    self._src = src
+    self._dst = dst
+    # Lines before the first hunk are left untouched, so we start off
+    # with an anchor mapping each line to itself.
+    self._old = array("I", [0])
+    self._new = array("I", [0])
+    self._mapped = array("B", [1])
+
+
+  def add(self, old, new, mapped):
+    """Add an anchor starting a new segment at the given lines."""
+    if self._old[-1] == old and self._new[-1] == new:
+      # An anchor at the very same position supersedes the previous
+      # one, as the segment of the latter is empty.
+      self._mapped[-1] = mapped
+    elif mapped and self._mapped[-1] and\
+         self._new[-1] - self._old[-1] == new - old:
+      # A mapped segment continuing the previous one with the same
+      # offset does not need an anchor of its own.
+      return
+    else:
+      self._old.append(old)
+      self._new.append(new)
+      self._mapped.append(mapped)
+
+
+  def _translate(self, lines, from_, to):
+    """Translate a number of lines using the given anchor arrays."""
+    # We look up the lines in ascending order, which allows us to
+    # narrow down the range to search for subsequent lines.
+    order = sorted(range(len(lines)), key=lines.__getitem__)
+    result = [None] * len(lines)
+    index = 0
+
+    for i in order:
+      line = lines[i]
+      index = bisect_right(from_, line, index) - 1
+      if index < 0:
+        # Only negative line numbers can end up here.
+        index = 0
+        continue
+
+      if self._mapped[index]:
+        result[i] = to[index] + (line - from_[index])
+
+    return result
+
+
+  def newLine(self, line):
+    """Translate a line number of the old file into one of the new file.
+
+      None is returned if the line was removed.
+    """
+    return self._translate([line], self._old, self._new)[0]
+
+
+  def oldLine(self, line):
+    """Translate a line number of the new file into one of the old file.
+
+      None is returned if the line was added.
+    """
+    return self._translate([line], self._new, self._old)[0]
+
+
+  def newLines(self, lines):
+    """Translate a sequence of line numbers of the old file into ones of the new file."""
+    return self._translate(lines, self._old, self._new)
+
+
+  def oldLines(self, lines):
+    """Translate a sequence of line numbers of the new file into ones of the old file."""
+    return self._translate(lines, self._new, self._old)
+
+
+  @property
+  def src(self):
+    """Retrieve the name of the source file."""
+    return self._src
+
+
+  @property
+  def dst(self):
+    """Retrieve the name of the destination file."""
+    return self._dst
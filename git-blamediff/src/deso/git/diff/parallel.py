@@ -0,0 +1,218 @@
+# parallel.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""A module for parsing large diffs using multiple processes.
+
+  A diff is split into chunks at file boundaries and each chunk is
+  parsed by a separate process. The chunks are never copied into the
+  worker processes: a diff stored in a file is mapped into memory by
+  each worker and a diff given as a buffer is placed into shared memory
+  once. Workers only receive the offsets of the chunk to parse.
+"""
+
+from concurrent.futures import (
+  ProcessPoolExecutor,
+)
+from deso.git.diff.diff import (
+  Body,
+  Parser,
+  _DIFF_HEAD_BYTES_REGEX,
+)
+from deso.git.diff.table import (
+  HunkTable,
+)
+from mmap import (
+  ACCESS_READ,
+  mmap,
+)
+from multiprocessing import (
+  cpu_count,
+)
+from multiprocessing.shared_memory import (
+  SharedMemory,
+)
+from re import (
+  MULTILINE,
+  compile as regex,
+)
+
+
+# We preferably split a diff at git's "diff --git" lines. Plain diffs
+# lack those, in which case we split at a '---' line that is directly
+# followed by a '+++' line and a hunk header. The latter regular
+# expression matches hunk headers with optional file headers in front.
+_DIFF_GIT_REGEX = regex(rb"^diff --git ", MULTILINE)
+_DIFF_FILE_REGEX = regex(rb"^(---[^\n]*\n\+\+\+[^\n]*\n)?(@@ [^\n]*)", MULTILINE)
+# Diffs smaller than this size are not worth the overhead of starting
+# additional processes and are parsed directly.
+_MIN_CHUNK_SIZE = 1024 * 1024
+
+
+def _findGit(buffer, pos):
+  """Find the start of the next file in a diff emitted by git."""
+  match = _DIFF_GIT_REGEX.search(buffer, pos)
+  return match.start() if match is not None else None
+
+
+def _findFile(buffer, pos):
+  """Find the start of the next file in a plain diff.
+
+    The file headers of a plain diff may just as well be removed and
+    added lines of a hunk body. Hunk headers, on the other hand, cannot
+    be mistaken for anything else. So we only accept file headers
+    following a hunk body that we skipped based on the line counts in
+    its header.
+  """
+  skipped = False
+  while True:
+    match = _DIFF_FILE_REGEX.search(buffer, pos)
+    if match is None:
+      return None
+
+    if skipped and match.group(1) is not None:
+      return match.start()
+
+    pos = match.end()
+    m = _DIFF_HEAD_BYTES_REGEX.match(match.group(2))
+    if m is None:
+      skipped = False
+      continue
+
+    _, _, count_src, _, _, count_dst = m.groups(default=b"1")
+    body = Body(int(count_src), int(count_dst))
+    pos = body.skip(buffer, pos + 1)
+    skipped = True
+
+
+def split(buffer, count):
+  """Split a buffer into at most 'count' chunks at file boundaries.
+
+    The function returns a list of (start, end) offset pairs.
+  """
+  size = len(buffer)
+  find = _findGit if _DIFF_GIT_REGEX.search(buffer) else _findFile
+
+  chunks = []
+  start = 0
+
+  for i in range(1, count):
+    target = max(size * i // count, start + 1)
+    if target >= size:
+      break
+
+    offset = find(buffer, target)
+    if offset is None:
+      break
+
+    # A file boundary far ahead might lead us past the next target
+    # already, in which case we simply skip that one.
+    if offset > start:
+      chunks.append((start, offset))
+      start = offset
+
+  chunks.append((start, size))
+  return chunks
+
+
+def _parse(buffer, start, end, strict):
+  """Parse a part of a buffer."""
+  parser = Parser(strict=strict)
+  with memoryview(buffer) as view:
+    with view[start:end] as chunk:
+      parser.parseBuffer(chunk)
+
+  return parser.diffs
+
+
+def _parseFile(path, start, end, strict):
+  """Parse a part of a diff stored in a file (in a worker process)."""
+  with open(path, "rb") as file_:
+    with mmap(file_.fileno(), 0, access=ACCESS_READ) as buffer:
+      return _parse(buffer, start, end, strict)
+
+
+def _parseShared(name, start, end, strict):
+  """Parse a part of a diff stored in shared memory (in a worker process)."""
+  memory = SharedMemory(name)
+  try:
+    return _parse(memory.buf, start, end, strict)
+  finally:
+    memory.close()
+
+
+def parseParallel(source, processes=None, strict=False):
+  """Parse a diff using a pool of processes.
+
+    The source can either be the path to a file containing the diff or
+    a bytes-like object. The result is a HunkTable containing the same
+    diffs Parser.diffs would contain after parsing the diff
+    sequentially.
+  """
+  if processes is None:
+    processes = cpu_count()
+
+  memory = None
+  file_ = None
+  buffer = None
+
+  try:
+    if isinstance(source, str):
+      file_ = open(source, "rb")
+      try:
+        buffer = mmap(file_.fileno(), 0, access=ACCESS_READ)
+      except ValueError:
+        # Empty files cannot be mapped.
+        buffer = b""
+    else:
+      buffer = source
+
+    count = min(processes, len(buffer) // _MIN_CHUNK_SIZE)
+    chunks = split(buffer, count) if count > 1 else []
+
+    if len(chunks) <= 1:
+      return _parse(buffer, 0, len(buffer), strict)
+
+    if file_ is not None:
+      function = _parseFile
+      name = source
+    else:
+      memory = SharedMemory(create=True, size=len(buffer))
+      memory.buf[:len(buffer)] = buffer
+      function = _parseShared
+      name = memory.name
+
+    diffs = HunkTable()
+    with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+      futures = [
+        executor.submit(function, name, start, end, strict)
+        for start, end in chunks
+      ]
+      # Merge the results in order of the chunks.
+      for future in futures:
+        diffs.extend(future.result())
+
+    return diffs
+  finally:
+    if memory is not None:
+      memory.close()
+      memory.unlink()
+    if file_ is not None:
+      if isinstance(buffer, mmap):
+        buffer.close()
+      file_.close()
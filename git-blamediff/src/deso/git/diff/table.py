@@ -0,0 +1,161 @@
+# table.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""A module providing compact storage for the hunks of a diff."""
+
+from array import (
+  array,
+)
+from collections import (
+  namedtuple,
+)
+
+
+DiffFile = namedtuple("DiffFile", ["file", "add_sub", "line", "count"])
+
+# Flags indicating that the source or destination part of a hunk
+# carries a '+' (as opposed to a '-').
+_SRC_ADD = 1
+_DST_ADD = 2
+
+
+class HunkTable:
+  """A table storing hunks in a columnar fashion.
+
+    Each hunk is a pair of DiffFile objects describing the source and
+    the destination side, respectively. Instead of storing these objects
+    directly, we store each file name only once and keep line numbers
+    and counts in typed arrays. DiffFile objects are only created when a
+    hunk is accessed, which makes a table behave like a list of hunks
+    for all intents and purposes.
+  """
+  def __init__(self, diffs=None):
+    """Create a new table, optionally containing the given hunks."""
+    self._names = []
+    self._ids = {}
+    self._src_files = array("I")
+    self._src_lines = array("I")
+    self._src_counts = array("I")
+    self._dst_files = array("I")
+    self._dst_lines = array("I")
+    self._dst_counts = array("I")
+    self._flags = array("B")
+
+    if diffs is not None:
+      self.extend(diffs)
+
+
+  def _intern(self, name):
+    """Retrieve the ID of a file name, adding it to the table if necessary."""
+    id_ = self._ids.get(name)
+    if id_ is None:
+      id_ = len(self._names)
+      self._names.append(name)
+      self._ids[name] = id_
+
+    return id_
+
+
+  def append(self, diff):
+    """Append a hunk to the table."""
+    src, dst = diff
+    self._src_files.append(self._intern(src.file))
+    self._src_lines.append(src.line)
+    self._src_counts.append(src.count)
+    self._dst_files.append(self._intern(dst.file))
+    self._dst_lines.append(dst.line)
+    self._dst_counts.append(dst.count)
+    self._flags.append((_SRC_ADD if src.add_sub == "+" else 0) |
+                       (_DST_ADD if dst.add_sub == "+" else 0))
+
+
+  def extend(self, diffs):
+    """Append a number of hunks to the table."""
+    if not isinstance(diffs, HunkTable):
+      for diff in diffs:
+        self.append(diff)
+      return
+
+    # If we got passed in another table we can copy entire columns and
+    # only have to translate the IDs of the file names.
+    ids = [self._intern(name) for name in diffs._names]
+    self._src_files.extend(ids[id_] for id_ in diffs._src_files)
+    self._src_lines.extend(diffs._src_lines)
+    self._src_counts.extend(diffs._src_counts)
+    self._dst_files.extend(ids[id_] for id_ in diffs._dst_files)
+    self._dst_lines.extend(diffs._dst_lines)
+    self._dst_counts.extend(diffs._dst_counts)
+    self._flags.extend(diffs._flags)
+
+
+  def _hunk(self, index):
+    """Create the pair of DiffFile objects for the hunk with the given index."""
+    flags = self._flags[index]
+    src = DiffFile(self._names[self._src_files[index]],
+                   "+" if flags & _SRC_ADD else "-",
+                   self._src_lines[index],
+                   self._src_counts[index])
+    dst = DiffFile(self._names[self._dst_files[index]],
+                   "+" if flags & _DST_ADD else "-",
+                   self._dst_lines[index],
+                   self._dst_counts[index])
+    return src, dst
+
+
+  def __len__(self):
+    """Retrieve the number of hunks in the table."""
+    return len(self._flags)
+
+
+  def __getitem__(self, index):
+    """Retrieve a hunk or a list of hunks for a slice."""
+    if isinstance(index, slice):
+      return [self._hunk(i) for i in range(*index.indices(len(self)))]
+
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError("hunk index out of range")
+
+    return self._hunk(index)
+
+
+  def __iter__(self):
+    """Iterate over all hunks in the table."""
+    for i in range(len(self)):
+      yield self._hunk(i)
+
+
+  def __eq__(self, other):
+    """Compare the table to another table or a sequence of hunks."""
+    if isinstance(other, (HunkTable, list, tuple)):
+      return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    return NotImplemented
+
+
+  def __repr__(self):
+    """Convert the table into a string."""
+    return "HunkTable(%r)" % list(self)
+
+
+  @property
+  def files(self):
+    """Retrieve a list of all file names referenced by hunks in the table."""
+    return list(self._names)
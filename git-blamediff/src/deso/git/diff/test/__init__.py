@@ -35,6 +35,10 @@ def allTests():
   tests = [
     "testGitBlameDiff.py",
     "testDiff.py",
+    "testIndex.py",
+    "testMapping.py",
+    "testParallel.py",
+    "testTable.py",
   ]
 
   loader = TestLoader()
@@ -23,6 +23,19 @@ from deso.git.diff.diff import (
   DiffFile,
   Parser,
 )
+from deso.git.diff.entry import (
+  DELETED,
+  MODIFIED,
+  NEW,
+  RENAMED,
+)
+from mmap import (
+  ACCESS_READ,
+  mmap,
+)
+from tempfile import (
+  TemporaryFile,
+)
 from textwrap import (
   dedent,
 )
@@ -34,9 +47,11 @@ from unittest import (
 
 class TestParser(TestCase):
   """Tests for the diff parsing functionality."""
+  STRICT = False
+
   def setUp(self):
     """Create a new Parser object ready to use."""
-    self._parser = Parser()
+    self._parser = Parser(strict=self.STRICT)
 
 
   def testParseEmptyDiff(self):
@@ -157,5 +172,287 @@ class TestParser(TestCase):
     self.assertEqual(dst, DiffFile("main.c", add_sub="+", line=1, count=6))
 
 
+  def testParseBufferSimpleDiff(self):
+    """Verify that we can parse a diff supplied as various bytes-like objects."""
+    diff = dedent("""\
+      --- main.c
+      +++ main.c
+      @@ -6,6 +6,6 @@ int main(int argc, char const* argv[])
+           fprintf(stderr, "Too many arguments.\\n");
+           return -1;
+         }
+      -  printf("Hello world!");
+      +  printf("Hello world!\\n");
+         return 0;
+       }
+    """).encode()
+
+    with TemporaryFile() as file_:
+      file_.write(diff)
+      file_.flush()
+
+      with mmap(file_.fileno(), 0, access=ACCESS_READ) as mapped:
+        for buffer in (diff, bytearray(diff), memoryview(diff), mapped):
+          parser = Parser(strict=self.STRICT)
+          parser.parseBuffer(buffer)
+
+          (src, dst), = parser.diffs
+          self.assertEqual(src, DiffFile("main.c", add_sub="-", line=6, count=6))
+          self.assertEqual(dst, DiffFile("main.c", add_sub="+", line=6, count=6))
+
+
+  def testParseBufferMultipleFiles(self):
+    """Verify that the buffer based parser handles git diffs with multiple files."""
+    diff = dedent("""\
+      diff --git main.c main.c
+      index 1bd3b05..3a4b3a4 100644
+      --- main.c
+      +++ main.c
+      @@ -1,2 +1,2 @@
+      --- a comment
+      +-- another comment
+       int x;
+      @@ -10 +10 @@
+      -}
+      \\ No newline at end of file
+      +}
+      diff --git util.c util.c
+      index 1bd3b05..3a4b3a4 100644
+      --- util.c
+      +++ util.c
+      @@ -3,0 +4 @@
+      +int y;
+    """).encode()
+
+    self._parser.parseBuffer(diff)
+
+    (src1, dst1), (src2, dst2), (src3, dst3) = self._parser.diffs
+    self.assertEqual(src1, DiffFile("main.c", add_sub="-", line=1, count=2))
+    self.assertEqual(dst1, DiffFile("main.c", add_sub="+", line=1, count=2))
+    self.assertEqual(src2, DiffFile("main.c", add_sub="-", line=10, count=1))
+    self.assertEqual(dst2, DiffFile("main.c", add_sub="+", line=10, count=1))
+    self.assertEqual(src3, DiffFile("util.c", add_sub="-", line=3, count=0))
+    self.assertEqual(dst3, DiffFile("util.c", add_sub="+", line=4, count=1))
+
+
+  def testParseBufferInvalidUtf8(self):
+    """Verify that the buffer based parser copes with diffs that are not valid UTF-8."""
+    diff = b"--- caf\xe9.txt\n" +\
+           b"+++ caf\xe9.txt\n" +\
+           b"@@ -1 +1 @@\n" +\
+           b"-\xff\xfe\n" +\
+           b"+\xfe\xff\n"
+
+    self._parser.parseBuffer(diff)
+
+    (src, dst), = self._parser.diffs
+    self.assertEqual(src.file.encode("utf-8", "surrogateescape"), b"caf\xe9.txt")
+    self.assertEqual(dst.file, src.file)
+    self.assertEqual(src.line, 1)
+    self.assertEqual(dst.count, 1)
+
+
+class TestStrictParser(TestParser):
+  """Tests for the diff parsing functionality in strict mode."""
+  STRICT = True
+
+
+class TestFastParser(TestCase):
+  """Tests for the hunk body skipping of the non-strict parser."""
+  def parse(self, diff):
+    """Parse a diff both line and buffer based and check for consistent results."""
+    parser = Parser()
+    parser.parse(diff.splitlines())
+
+    buf_parser = Parser()
+    buf_parser.parseBuffer(diff.encode())
+
+    self.assertEqual(parser.diffs, buf_parser.diffs)
+    return parser.diffs
+
+
+  def testParseDiffWithHeaderLookalikes(self):
+    """Verify that body lines looking like file headers are skipped."""
+    diff = dedent("""\
+      --- main.c
+      +++ main.c
+      @@ -1,2 +1,2 @@
+      --- not a file
+      +++ not a file either
+       @@ -1 +1 @@
+      \\ No newline at end of file
+    """)
+    (src, dst), = self.parse(diff)
+    self.assertEqual(src, DiffFile("main.c", add_sub="-", line=1, count=2))
+    self.assertEqual(dst, DiffFile("main.c", add_sub="+", line=1, count=2))
+
+
+  def testParseMultipleFilesWithoutGitHeaders(self):
+    """Verify that files following each other directly are detected."""
+    diff = dedent("""\
+      --- main.c
+      +++ main.c
+      @@ -1 +1 @@
+      -int x;
+      +int y;
+      \\ No newline at end of file
+      --- util.c
+      +++ util.c
+      @@ -5,2 +5 @@
+      -int x;
+       int z;
+    """)
+    (src1, dst1), (src2, dst2) = self.parse(diff)
+    self.assertEqual(src1, DiffFile("main.c", add_sub="-", line=1, count=1))
+    self.assertEqual(dst1, DiffFile("main.c", add_sub="+", line=1, count=1))
+    self.assertEqual(src2, DiffFile("util.c", add_sub="-", line=5, count=2))
+    self.assertEqual(dst2, DiffFile("util.c", add_sub="+", line=5, count=1))
+
+
+  def testParseTruncatedHunk(self):
+    """Verify that a hunk with fewer lines than announced does not confuse the parser."""
+    diff = dedent("""\
+      --- main.c
+      +++ main.c
+      @@ -1,10 +1,10 @@
+      -int x;
+      +int y;
+      diff --git util.c util.c
+      --- util.c
+      +++ util.c
+      @@ -1 +1 @@
+      -int x;
+      +int y;
+    """)
+    (src1, _), (src2, _) = self.parse(diff)
+    self.assertEqual(src1, DiffFile("main.c", add_sub="-", line=1, count=10))
+    self.assertEqual(src2, DiffFile("util.c", add_sub="-", line=1, count=1))
+
+
+class TestDiffEntries(TestCase):
+  """Tests for the classification of the files in a diff."""
+  DIFF = dedent("""\
+    diff --git image.png image.png
+    index 1bd3b05..3a4b3a4 100644
+    Binary files image.png and image.png differ
+    diff --git old.c new.c
+    similarity index 100%
+    rename from old.c
+    rename to new.c
+    diff --git run.sh run.sh
+    old mode 100644
+    new mode 100755
+    diff --git icon.png icon.png
+    index 1bd3b05..3a4b3a4 100644
+    GIT binary patch
+    literal 5
+    McmZQzKm`H<
+
+    literal 0
+    HcmV?d00001
+
+    diff --git main.c main.c
+    new file mode 100644
+    index 0000000..3a4b3a4
+    --- /dev/null
+    +++ main.c
+    @@ -0,0 +1 @@
+    +int main;
+    diff --git util.c util.c
+    deleted file mode 100644
+    index 3a4b3a4..0000000
+    --- util.c
+    +++ /dev/null
+    @@ -1,2 +0,0 @@
+    -int x;
+    -int y;
+    diff --git lib.c lib.c
+    index 1bd3b05..3a4b3a4 100644
+    --- lib.c
+    +++ lib.c
+    @@ -1 +1 @@
+    -int x;
+    +int y;
+    @@ -10 +10 @@
+    -int x;
+    +int y;
+  """)
+
+  def check(self, parser):
+    """Check the entries found by a parser."""
+    binary, rename, mode, patch, new, deleted, modified = parser.entries
+
+    self.assertTrue(binary.binary)
+    self.assertFalse(binary.needsBlame)
+
+    self.assertEqual(rename.status, RENAMED)
+    self.assertEqual((rename.src, rename.dst), ("old.c", "new.c"))
+    self.assertEqual(rename.similarity, 100)
+    self.assertTrue(rename.renameOnly)
+    self.assertFalse(rename.needsBlame)
+
+    self.assertEqual(mode.status, MODIFIED)
+    self.assertEqual((mode.old_mode, mode.new_mode), ("100644", "100755"))
+    self.assertTrue(mode.modeOnly)
+    self.assertFalse(mode.needsBlame)
+
+    self.assertTrue(patch.binary)
+    self.assertFalse(patch.needsBlame)
+
+    self.assertEqual(new.status, NEW)
+    self.assertEqual(new.new_mode, "100644")
+    self.assertFalse(new.needsBlame)
+    (src, dst), = parser.diffs[new.hunks]
+    self.assertEqual(dst, DiffFile("main.c", add_sub="+", line=1, count=1))
+
+    self.assertEqual(deleted.status, DELETED)
+    self.assertTrue(deleted.needsBlame)
+    (src, dst), = parser.diffs[deleted.hunks]
+    self.assertEqual(src, DiffFile("util.c", add_sub="-", line=1, count=2))
+
+    self.assertEqual(modified.status, MODIFIED)
+    self.assertFalse(modified.renameOnly)
+    self.assertFalse(modified.modeOnly)
+    self.assertTrue(modified.needsBlame)
+    self.assertEqual(len(parser.diffs[modified.hunks]), 2)
+    self.assertIs(parser.lineMap("lib.c"), modified.mapping)
+
+
+  def testClassifyEntries(self):
+    """Verify that git's extended header lines are interpreted correctly."""
+    for strict in (False, True):
+      parser = Parser(strict=strict)
+      parser.parse(self.DIFF.splitlines())
+      self.check(parser)
+
+      parser = Parser(strict=strict)
+      parser.parseBuffer(self.DIFF.encode())
+      self.check(parser)
+
+
+  def testPlainDiffEntries(self):
+    """Verify that entries are created for diffs not emitted by git."""
+    diff = dedent("""\
+      --- /dev/null
+      +++ main.c
+      @@ -0,0 +1 @@
+      +int main;
+      --- util.c
+      +++ util.c
+      @@ -1 +1 @@
+      -int x;
+      +int y;
+    """)
+
+    parser = Parser()
+    parser.parse(diff.splitlines())
+
+    new, modified = parser.entries
+    self.assertEqual(new.status, NEW)
+    self.assertFalse(new.needsBlame)
+    self.assertEqual(modified.status, MODIFIED)
+    self.assertTrue(modified.needsBlame)
+
+
 if __name__ == "__main__":
   main()
@@ -127,6 +127,18 @@ class TestGitBlameDiff(TestCase):
       self.assertEqual(out.decode(), expected)
 
 
+  def testBlameSkipsAddedFile(self):
+    """Check that git-blamediff does not try to annotate a newly added file."""
+    with GitRepository() as repo:
+      repo.commit("--allow-empty")
+
+      write(repo, "main.py", data="# main.py")
+      repo.add("main.py")
+
+      out = repo.blamediff(diff_args=["--staged"])
+      self.assertEqual(out.decode(), "")
+
+
   def testBlameWithAdditionalArguments(self):
     """Verify that we can pass additional arguments to git-blame."""
     with GitRepository() as repo:
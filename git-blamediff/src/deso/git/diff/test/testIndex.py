@@ -0,0 +1,180 @@
+# testIndex.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Test the random access diff index."""
+
+from deso.git.diff import (
+  DiffFile,
+  Index,
+  Parser,
+)
+from deso.git.diff.index import (
+  INDEX_SUFFIX,
+)
+from os import (
+  mkdir,
+)
+from os.path import (
+  isdir,
+  isfile,
+  join,
+)
+from tempfile import (
+  TemporaryDirectory,
+)
+from textwrap import (
+  dedent,
+)
+from unittest import (
+  TestCase,
+  main,
+)
+
+
+_DIFF = dedent("""\
+  diff --git main.c main.c
+  index 1bd3b05..3a4b3a4 100644
+  --- main.c
+  +++ main.c
+  @@ -1,2 +1,2 @@
+  --- a comment
+  +-- another comment
+   int x;
+  @@ -10 +10 @@
+  -}
+  \\ No newline at end of file
+  +}
+  diff --git util.c util.c
+  index 1bd3b05..3a4b3a4 100644
+  --- util.c
+  +++ util.c
+  @@ -3,0 +4 @@
+  +int y;
+""").encode()
+
+
+class TestIndex(TestCase):
+  """Tests for the diff index."""
+  def testIndexMatchesParser(self):
+    """Verify that an index yields the same hunks as the parser."""
+    parser = Parser()
+    parser.parseBuffer(_DIFF)
+    index = Index(_DIFF)
+
+    self.assertEqual(len(index), 3)
+    self.assertEqual(list(index), parser.diffs)
+    self.assertEqual(index[1:], parser.diffs[1:])
+    self.assertEqual(index[-1], parser.diffs[-1])
+
+    with self.assertRaises(IndexError):
+      index[3]
+
+
+  def testIndexLookup(self):
+    """Verify that we can look up the hunks of a file by name."""
+    index = Index(_DIFF)
+
+    self.assertEqual(index.files, [("main.c", "main.c"), ("util.c", "util.c")])
+    (src, dst), = index.lookup("util.c")
+    self.assertEqual(src, DiffFile("util.c", add_sub="-", line=3, count=0))
+    self.assertEqual(dst, DiffFile("util.c", add_sub="+", line=4, count=1))
+    self.assertEqual(len(index.lookup("main.c")), 2)
+    self.assertEqual(index.lookup("none.c"), [])
+
+
+  def testIndexLookupMultipleFiles(self):
+    """Verify that looking up a name yields the hunks of all files using it."""
+    diff = dedent("""\
+      --- a.c
+      +++ b.c
+      @@ -1 +1 @@
+      -x
+      +y
+      --- b.c
+      +++ b.c
+      @@ -5 +5 @@
+      -x
+      +y
+      @@ -9 +9 @@
+      -x
+      +y
+    """).encode()
+    index = Index(diff)
+
+    self.assertEqual(len(index.lookup("a.c")), 1)
+    hunks = index.lookup("b.c")
+    self.assertEqual(hunks, list(index))
+    self.assertEqual([src.line for src, _ in hunks], [1, 5, 9])
+
+
+  def testIndexBody(self):
+    """Verify that we can retrieve the raw bytes of a hunk."""
+    index = Index(_DIFF)
+
+    expected = b"@@ -10 +10 @@\n-}\n\\ No newline at end of file\n+}\n"
+    self.assertEqual(bytes(index.body(1)), expected)
+    self.assertEqual(bytes(index.body(2)), b"@@ -3,0 +4 @@\n+int y;\n")
+
+
+  def testIndexSaveAndLoad(self):
+    """Verify that an index is saved next to a diff and loaded again."""
+    with TemporaryDirectory() as directory:
+      path = join(directory, "diff")
+      with open(path, "wb") as file_:
+        file_.write(_DIFF)
+
+      index = Index.open(path)
+      self.assertTrue(isfile(path + INDEX_SUFFIX))
+
+      loaded = Index.load(path + INDEX_SUFFIX, _DIFF)
+      self.assertEqual(list(loaded), list(index))
+      self.assertEqual(loaded.files, index.files)
+      self.assertEqual(loaded.lookup("main.c"), index.lookup("main.c"))
+
+      # An index not matching the diff must be rejected.
+      with self.assertRaises(ValueError):
+        Index.load(path + INDEX_SUFFIX, _DIFF[:-1])
+
+      with open(path + INDEX_SUFFIX, "rb") as file_:
+        saved = file_.read()
+
+      # A corrupt index must be ignored.
+      with open(path + INDEX_SUFFIX, "wb") as file_:
+        file_.write(saved[:-3])
+
+      self.assertEqual(list(Index.open(path, save=False)), list(index))
+
+
+  def testIndexSaveFailure(self):
+    """Verify that failing to save an index does not fail opening the diff."""
+    with TemporaryDirectory() as directory:
+      path = join(directory, "diff")
+      with open(path, "wb") as file_:
+        file_.write(_DIFF)
+
+      # With a directory in its place, the index cannot be written.
+      mkdir(path + INDEX_SUFFIX)
+
+      index = Index.open(path)
+      self.assertEqual(list(index), list(Index(_DIFF)))
+      self.assertTrue(isdir(path + INDEX_SUFFIX))
+
+
+if __name__ == "__main__":
+  main()
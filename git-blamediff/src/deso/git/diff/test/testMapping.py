@@ -0,0 +1,182 @@
+# testMapping.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Test line number mapping between the two sides of a diff."""
+
+from deso.git.diff import (
+  Parser,
+)
+from difflib import (
+  SequenceMatcher,
+  unified_diff,
+)
+from random import (
+  Random,
+)
+from textwrap import (
+  dedent,
+)
+from unittest import (
+  TestCase,
+  main,
+)
+
+
+_DIFF = dedent("""\
+  --- main.c
+  +++ main.c
+  @@ -2,4 +2,5 @@
+   b
+  -c
+  +C
+  +C2
+   d
+   e
+  @@ -10,0 +12,2 @@
+  +x
+  +y
+  @@ -20,2 +23 @@
+  -t
+   u
+  diff --git util.c util.c
+  --- util.c
+  +++ util.c
+  @@ -1 +0,0 @@
+  -a
+""")
+
+
+class TestLineMap(TestCase):
+  """Tests for the LineMap class."""
+  def parse(self, strict=False, buffer=False):
+    """Parse our sample diff."""
+    parser = Parser(strict=strict, mappings=True)
+    if buffer:
+      parser.parseBuffer(_DIFF.encode())
+    else:
+      parser.parse(_DIFF.splitlines())
+    return parser
+
+
+  def testMapOldToNew(self):
+    """Verify that we can translate old line numbers into new ones."""
+    for strict in (False, True):
+      for buffer in (False, True):
+        mapping = self.parse(strict, buffer).lineMap("main.c")
+
+        self.assertEqual(mapping.newLine(1), 1)
+        self.assertEqual(mapping.newLine(2), 2)
+        self.assertIsNone(mapping.newLine(3))
+        self.assertEqual(mapping.newLine(4), 5)
+        self.assertEqual(mapping.newLine(10), 11)
+        self.assertEqual(mapping.newLine(11), 14)
+        self.assertIsNone(mapping.newLine(20))
+        self.assertEqual(mapping.newLine(21), 23)
+        self.assertEqual(mapping.newLine(100), 102)
+
+
+  def testMapNewToOld(self):
+    """Verify that we can translate new line numbers into old ones."""
+    mapping = self.parse().lineMap("main.c")
+
+    self.assertEqual(mapping.oldLine(2), 2)
+    self.assertIsNone(mapping.oldLine(3))
+    self.assertIsNone(mapping.oldLine(4))
+    self.assertEqual(mapping.oldLine(5), 4)
+    self.assertEqual(mapping.oldLine(11), 10)
+    self.assertIsNone(mapping.oldLine(12))
+    self.assertIsNone(mapping.oldLine(13))
+    self.assertEqual(mapping.oldLine(14), 11)
+    self.assertEqual(mapping.oldLine(23), 21)
+
+
+  def testMapBatch(self):
+    """Verify that we can translate many line numbers at once."""
+    mapping = self.parse().lineMap("main.c")
+
+    lines = [100, 3, 1, 21, 4, 20]
+    expected = [mapping.newLine(line) for line in lines]
+    self.assertEqual(mapping.newLines(lines), expected)
+    self.assertEqual(mapping.newLines([]), [])
+
+
+  def testMapRemovedFile(self):
+    """Verify that the lines of a removed file map to nothing."""
+    parser = self.parse()
+    mapping = parser.lineMap("util.c")
+
+    self.assertIsNone(mapping.newLine(1))
+    self.assertEqual(len(parser.lineMaps), 2)
+    self.assertIsNone(parser.lineMap("none.c"))
+
+
+  def testMappingsDisabled(self):
+    """Verify that no LineMap objects are created unless requested."""
+    for strict in (False, True):
+      for buffer in (False, True):
+        parser = Parser(strict=strict)
+        if buffer:
+          parser.parseBuffer(_DIFF.encode())
+        else:
+          parser.parse(_DIFF.splitlines())
+
+        self.assertFalse(parser.mappings)
+        self.assertEqual(parser.lineMaps, [])
+        self.assertIsNone(parser.lineMap("main.c"))
+        self.assertEqual(len(parser.entries), 2)
+        for entry in parser.entries:
+          self.assertIsNone(entry.mapping)
+
+
+  def testMapRandomDiffs(self):
+    """Verify the mapping against difflib for randomly generated files."""
+    random = Random(1337)
+
+    for _ in range(50):
+      old = ["%d\n" % random.randrange(20) for _ in range(100)]
+      new = list(old)
+      for _ in range(10):
+        i = random.randrange(len(new))
+        if random.random() < 0.5:
+          del new[i]
+        else:
+          new.insert(i, "x\n")
+
+      diff = unified_diff(old, new, "file", "file", n=1)
+      parser = Parser(mappings=True)
+      parser.parse(diff)
+      mapping = parser.lineMap("file")
+
+      matcher = SequenceMatcher(None, old, new, autojunk=False)
+      expected = [None] * len(old)
+      for tag, i1, i2, j1, _ in matcher.get_opcodes():
+        if tag == "equal":
+          for k in range(i2 - i1):
+            expected[i1 + k] = j1 + k + 1
+
+      if mapping is None:
+        self.assertEqual(old, new)
+        continue
+
+      lines = list(range(1, len(old) + 1))
+      self.assertEqual(mapping.newLines(lines), expected)
+
+
+if __name__ == "__main__":
+  main()
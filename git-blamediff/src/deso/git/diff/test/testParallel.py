@@ -0,0 +1,129 @@
+# testParallel.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Test parallel diff parsing."""
+
+from deso.git.diff import (
+  Parser,
+  parseParallel,
+)
+from deso.git.diff.parallel import (
+  split,
+)
+from tempfile import (
+  NamedTemporaryFile,
+)
+from unittest import (
+  TestCase,
+  main,
+)
+
+
+def generateDiff(files, git=True):
+  """Generate a diff of a few MiB with the given number of files."""
+  diff = bytearray()
+  for i in range(files):
+    if git:
+      diff += b"diff --git file%d.c file%d.c\n" % (i, i)
+      diff += b"index 1bd3b05..3a4b3a4 100644\n"
+
+    diff += b"--- file%d.c\n+++ file%d.c\n" % (i, i)
+    for j in range(10):
+      diff += b"@@ -%d,4 +%d,4 @@\n" % (j * 100 + 1, j * 100 + 1)
+      diff += b" int a;\n-int b;\n+int c;\n int d;\n"
+      # Add a long context line to reach a diff size actually worth
+      # splitting.
+      diff += b" %s\n" % (b"e" * 2048)
+
+  return bytes(diff)
+
+
+class TestParallel(TestCase):
+  """Tests for the parallel diff parser."""
+  def testSplitAtFileBoundaries(self):
+    """Verify that chunks always start at a file boundary."""
+    for git in (True, False):
+      diff = generateDiff(50, git=git)
+      chunks = split(diff, 4)
+
+      self.assertEqual(len(chunks), 4)
+      self.assertEqual(chunks[0][0], 0)
+      self.assertEqual(chunks[-1][1], len(diff))
+
+      for (_, end), (start, _) in zip(chunks, chunks[1:]):
+        self.assertEqual(end, start)
+        prefix = b"diff --git " if git else b"--- file"
+        self.assertTrue(diff[start:].startswith(prefix))
+
+
+  def testParseParallelMatchesParser(self):
+    """Verify that parallel parsing yields the same result as sequential parsing."""
+    diff = generateDiff(200)
+
+    parser = Parser()
+    parser.parseBuffer(diff)
+    self.assertEqual(len(parser.diffs), 2000)
+
+    self.assertEqual(parseParallel(diff, processes=4), parser.diffs)
+
+    with NamedTemporaryFile() as file_:
+      file_.write(diff)
+      file_.flush()
+
+      self.assertEqual(parseParallel(file_.name, processes=4), parser.diffs)
+
+
+  def testSplitPlainDiffWithinHunk(self):
+    """Verify that lines looking like file headers within a hunk are no boundaries."""
+    diff = bytearray(b"--- a.c\n+++ a.c\n@@ -1,2002 +1,2002 @@\n")
+    for _ in range(2000):
+      diff += b" %s\n" % (b"e" * 2048)
+
+    # A removed line "-- x" followed by an added line "++ y" looks just
+    # like the file headers of a plain diff.
+    diff += b"--- x\n+++ y\n@@ -500 +500 @@\n-a\n+b\n"
+    diff = bytes(diff)
+
+    self.assertEqual(split(diff, 2), [(0, len(diff))])
+
+    parser = Parser()
+    parser.parseBuffer(diff)
+    files = [(src.file, src.line, dst.file) for src, dst in parser.diffs]
+    self.assertEqual(files, [("a.c", 1, "a.c"), ("a.c", 500, "a.c")])
+
+    diffs = parseParallel(diff, processes=2)
+    self.assertEqual(diffs, parser.diffs)
+
+
+  def testParseParallelSmallDiff(self):
+    """Verify that small and empty diffs are handled."""
+    diff = b"--- main.c\n+++ main.c\n@@ -1 +1 @@\n-x\n+y\n"
+
+    parser = Parser()
+    parser.parseBuffer(diff)
+
+    self.assertEqual(parseParallel(diff, processes=4), parser.diffs)
+    self.assertEqual(parseParallel(b"", processes=4), [])
+
+    with NamedTemporaryFile() as file_:
+      self.assertEqual(parseParallel(file_.name), [])
+
+
+if __name__ == "__main__":
+  main()
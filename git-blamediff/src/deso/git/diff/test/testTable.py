@@ -0,0 +1,89 @@
+# testTable.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2016 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Test the compact hunk table."""
+
+from deso.git.diff import (
+  DiffFile,
+  HunkTable,
+)
+from pickle import (
+  dumps,
+  loads,
+)
+from unittest import (
+  TestCase,
+  main,
+)
+
+
+_HUNKS = [
+  (DiffFile("main.c", "-", 6, 6), DiffFile("main.c", "+", 6, 7)),
+  (DiffFile("main.c", "-", 20, 1), DiffFile("main.c", "+", 21, 0)),
+  (DiffFile("/dev/null", "-", 0, 0), DiffFile("util.c", "+", 1, 3)),
+]
+
+
+class TestHunkTable(TestCase):
+  """Tests for the HunkTable class."""
+  def testTableBehavesLikeList(self):
+    """Verify that a table can be used like a list of hunks."""
+    table = HunkTable(_HUNKS)
+
+    self.assertEqual(len(table), 3)
+    self.assertEqual(table, _HUNKS)
+    self.assertEqual(list(table), _HUNKS)
+    self.assertEqual(table[0], _HUNKS[0])
+    self.assertEqual(table[-1], _HUNKS[-1])
+    self.assertEqual(table[1:], _HUNKS[1:])
+    self.assertNotEqual(table, _HUNKS[1:])
+
+    with self.assertRaises(IndexError):
+      table[3]
+
+    src, dst = table[2]
+    self.assertEqual(src.file, "/dev/null")
+    self.assertEqual(dst.add_sub, "+")
+    self.assertEqual(dst.count, 3)
+
+
+  def testTableInternsFileNames(self):
+    """Verify that each file name is stored only once."""
+    table = HunkTable(_HUNKS)
+    self.assertEqual(table.files, ["main.c", "/dev/null", "util.c"])
+
+
+  def testTableExtend(self):
+    """Verify that tables can be merged."""
+    table = HunkTable(_HUNKS[2:])
+    table.extend(HunkTable(_HUNKS))
+    table.extend(_HUNKS[:1])
+
+    self.assertEqual(table, _HUNKS[2:] + _HUNKS + _HUNKS[:1])
+    self.assertEqual(table.files, ["/dev/null", "util.c", "main.c"])
+
+
+  def testTablePickle(self):
+    """Verify that tables can be pickled."""
+    table = HunkTable(_HUNKS)
+    self.assertEqual(loads(dumps(table)), _HUNKS)
+
+
+if __name__ == "__main__":
+  main()